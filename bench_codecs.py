@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ma'lumot fayllari kodeklarini solishtirish
+Generatsiya qilingan users.json ko'rinishidagi ma'lumotlar uchun har bir
+o'rnatilgan kodek va siqish usulining yozish/o'qish vaqti va hajmi o'lchanadi.
+
+Ishlatish:
+    python bench_codecs.py [foydalanuvchilar_soni ...]
+    python bench_codecs.py 10000 100000 1000000
+"""
+
+import os
+import sys
+import gc
+import time
+import random
+from datetime import datetime, timedelta
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+
+def generate_users(count: int, seed: int = 42) -> dict:
+    """users.json bilan bir xil tuzilishdagi foydalanuvchilar (Database.add_user yozadigan maydonlar)"""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    users = {}
+    for n in range(count):
+        user_id = 100_000_000 + rng.randrange(7_000_000_000)
+        joined = start + timedelta(seconds=rng.randrange(60 * 86400))
+        active = joined + timedelta(seconds=rng.randrange(300 * 86400))
+        users[str(user_id)] = {
+            "joined_date": joined.strftime("%Y-%m-%d %H:%M:%S"),
+            "last_activity": active.strftime("%Y-%m-%d %H:%M:%S"),
+            "movies_downloaded": rng.randrange(50),
+            "is_subscribed": rng.random() < 0.8
+        }
+    return users
+
+
+def best_of(func, repeat: int) -> float:
+    """Eng yaxshi natija (soniya); GC o'lchovga aralashmasligi uchun o'chiriladi"""
+    best = float("inf")
+    for _ in range(repeat):
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - started)
+        finally:
+            gc.enable()
+    return best
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    sys.path.insert(0, BOT_DIR)
+    import bot
+    bot.setup_logging()
+
+    print(f"Kodeklar: {', '.join(bot.CODECS)}; siqish: {', '.join(bot.COMPRESSORS)}")
+    header = ("foyd.", "kodek", "siqish", "yozish ms", "o'qish ms", "hajm KB", "nisbat")
+    print("{:>9} {:<12} {:<6} {:>10} {:>10} {:>10} {:>7}".format(*header))
+
+    for size in sizes:
+        users = generate_users(size)
+        repeat = 5 if size <= 100_000 else 2
+        baseline = None
+
+        for codec in bot.CODECS:
+            for compression in bot.COMPRESSORS:
+                payload = bot.encode_data(users, codec, compression)
+                assert bot.decode_data(payload) == users, f"{codec}/{compression} noto'g'ri o'qidi"
+                encode_time = best_of(lambda: bot.encode_data(users, codec, compression), repeat)
+                decode_time = best_of(lambda: bot.decode_data(payload), repeat)
+                if baseline is None:
+                    baseline = len(payload)
+                print(f"{size:>9} {codec:<12} {compression:<6} {encode_time * 1000:>10.1f} "
+                      f"{decode_time * 1000:>10.1f} {len(payload) / 1024:>10.0f} {len(payload) / baseline:>7.2f}")
+        del users
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -9,16 +9,63 @@ EGA admin - boshqa adminlarni boshqarishi mumkin
 """
 
 import os
+import sys
+import time
+# Ishga tushish hisoboti uchun boshlang'ich nuqta
+PROCESS_STARTED = time.perf_counter()
+import queue
+import atexit
+import signal
+import random
 import logging
+import functools
+import traceback
+import threading
+import cProfile
+import pstats
+import marshal
+import gc
+import tracemalloc
+from logging.handlers import QueueHandler, QueueListener
+from contextvars import ContextVar
 import json
 import re
-from datetime import datetime
-from typing import Dict, List, Optional, Tuple, Set
+import csv
+import io
+import hmac
+import hashlib
+import zlib
+import gzip
+from collections import Counter, OrderedDict, deque
+from itertools import chain, islice
+from contextlib import asynccontextmanager, contextmanager
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Set
 import asyncio
-from fastapi import FastAPI
-import uvicorn
 from threading import Thread
 
+# fcntl faqat Unix tizimlarida mavjud (SHARED_STORE rejimi uchun kerak)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Ixtiyoriy tezroq serializatsiya va siqish kutubxonalari
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 # Dotenv ni o'rnatish
 try:
     from dotenv import load_dotenv
@@ -26,13 +73,19 @@ try:
 except ImportError:
     pass
 
+from telegram.error import BadRequest, RetryAfter
+from telegram.request import HTTPXRequest
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 from telegram.ext import (
     Application, 
+    CallbackContext,
     CommandHandler, 
     MessageHandler, 
+    TypeHandler,
     CallbackQueryHandler, 
+    ChatMemberHandler,
     ContextTypes,
+    BaseRateLimiter,
     filters
 )
 
@@ -41,9 +94,18 @@ from telegram.ext import (
 BOT_TOKEN = os.getenv("BOT_TOKEN", "8570818233:AAGNh0lZgU4MTRoaM0XyrafOGRLAxHumhis")
 OWNER_ID = int(os.getenv("OWNER_ID", "8197301287"))
 
+# Ishga tushirish rejimi: all - bot va web server, worker - faqat bot (fastapi/uvicorn import qilinmaydi)
+RUN_MODE = os.getenv("RUN_MODE", "all")
+
 # Server porti (Render uchun)
 PORT = int(os.getenv("PORT", 10000))
 
+# Himoyalangan web endpointlar uchun token (bo'sh bo'lsa endpointlar yopiq)
+API_TOKEN = os.getenv("API_TOKEN", "")
+
+# Eksportda bitta bo'lakka yoziladigan qatorlar soni
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", 500))
+
 # Adminlar fayli
 ADMINS_FILE = "admins.json"
 
@@ -52,59 +114,918 @@ MOVIES_FILE = "movies.json"
 CHANNELS_FILE = "channels.json"
 USERS_FILE = "users.json"
 
-# ========================== LOGGING ==========================
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+# Ommaviy yuklashda har nechta fayldan keyin javob berish
+BULK_ACK_EVERY = int(os.getenv("BULK_ACK_EVERY", 25))
+
+# Admin oqimlari holati (kino yuklash, admin o'chirish va h.k.)
+CONV_STATE_FILE = os.getenv("CONV_STATE_FILE", "conversations.json")  # bo'sh qoldirilsa diskka yozilmaydi
+CONV_STATE_TTL = int(os.getenv("CONV_STATE_TTL", 1800))  # soniya, tashlab ketilgan oqim shundan keyin o'chadi
+CONV_STATE_MAX = int(os.getenv("CONV_STATE_MAX", 1000))  # eng ko'p saqlanadigan holatlar soni (LRU)
+CONV_STATE_SAVE_INTERVAL = int(os.getenv("CONV_STATE_SAVE_INTERVAL", 30))  # soniya
+
+# Kanal a'zoligini fon rejimida tekshirish tezligi (get_chat_member / soniya)
+MEMBERSHIP_BOOTSTRAP_RATE = float(os.getenv("MEMBERSHIP_BOOTSTRAP_RATE", 5))
+# To'liq solishtirish o'tishlari orasidagi vaqt (soniya)
+MEMBERSHIP_RECONCILE_INTERVAL = int(os.getenv("MEMBERSHIP_RECONCILE_INTERVAL", 6 * 3600))
+# A'zolik keshi: eng ko'p yozuvlar (kanal, foydalanuvchi) va amal qilish muddati (soniya).
+# SHARED_STORE da chat_member yangilanishi faqat bitta jarayonga keladi, shuning uchun muddat qisqa
+MEMBERSHIP_CACHE_MAX = int(os.getenv("MEMBERSHIP_CACHE_MAX", 200000))
+MEMBERSHIP_CACHE_TTL = int(os.getenv("MEMBERSHIP_CACHE_TTL", 24 * 3600))
+MEMBERSHIP_SHARED_TTL = int(os.getenv("MEMBERSHIP_SHARED_TTL", 60))
+
+# Flood nazorati (token bucket): soniyada nechta xabar va qancha "zaxira"
+FLOOD_RATE = float(os.getenv("FLOOD_RATE", 1))
+FLOOD_BURST = int(os.getenv("FLOOD_BURST", 5))
+# Birinchi cheklov muddati (soniya), har takrorlanganda ikki barobar oshadi
+FLOOD_COOLDOWN = int(os.getenv("FLOOD_COOLDOWN", 10))
+FLOOD_MAX_COOLDOWN = int(os.getenv("FLOOD_MAX_COOLDOWN", 600))
+# Shuncha vaqt jim turgan foydalanuvchi yozuvi o'chiriladi (soniya)
+FLOOD_IDLE_TTL = int(os.getenv("FLOOD_IDLE_TTL", 900))
+
+# Log sozlamalari: shovqinli loggerlarning INFO yozuvlaridan qanchasi yoziladi (0..1)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.1))
+LOG_SAMPLED_LOGGERS = tuple(
+    name.strip() for name in os.getenv("LOG_SAMPLED_LOGGERS", "httpx,uvicorn.access").split(",") if name.strip()
 )
+
+# Xatolar hisobotini egaga yuborish oralig'i (soniya)
+ERROR_DIGEST_INTERVAL = int(os.getenv("ERROR_DIGEST_INTERVAL", 300))
+
+# Shundan uzoq davom etgan yangilanishlar to'liq tafsiloti bilan logga yoziladi (ms)
+SLOW_UPDATE_THRESHOLD_MS = float(os.getenv("SLOW_UPDATE_THRESHOLD_MS", 1000))
+# Oxirgi nechta sekin yangilanish xotirada saqlanadi
+SLOW_TRACE_BUFFER = int(os.getenv("SLOW_TRACE_BUFFER", 50))
+
+# CPU profiling: stek namunasi olish oralig'i va eng uzoq davomiylik (soniya)
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", 0.005))
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", 120))
+
+# Xotira snapshotlari: nechtasi saqlanadi va hajm hisoblashda namuna o'lchami
+MEMORY_SNAPSHOT_KEEP = int(os.getenv("MEMORY_SNAPSHOT_KEEP", 5))
+MEMORY_SIZE_SAMPLE = int(os.getenv("MEMORY_SIZE_SAMPLE", 1000))
+
+# Xotira nazorati (fly.toml: 256 MB): RSS chegaralari (MB, 0 - o'chirilgan)
+MEMORY_SOFT_LIMIT_MB = int(os.getenv("MEMORY_SOFT_LIMIT_MB", 180))  # keshlar qisqartiriladi
+MEMORY_HARD_LIMIT_MB = int(os.getenv("MEMORY_HARD_LIMIT_MB", 220))  # holat yoziladi, yuklama kamaytiriladi
+MEMORY_CHECK_INTERVAL = int(os.getenv("MEMORY_CHECK_INTERVAL", 10))  # soniya
+MEMORY_ACTION_COOLDOWN = int(os.getenv("MEMORY_ACTION_COOLDOWN", 60))  # bir xil amallar orasida, soniya
+MEMORY_IDLE_STATE_AGE = int(os.getenv("MEMORY_IDLE_STATE_AGE", 300))  # shundan uzoq ishlatilmagan suhbat holati chiqariladi
+
+# Faollik statistikasi (DAU/WAU/MAU, retention) uchun kunlik bitmaplar
+ANALYTICS_DIR = os.getenv("ANALYTICS_DIR", "analytics")
+ANALYTICS_RETENTION_DAYS = int(os.getenv("ANALYTICS_RETENTION_DAYS", 62))
+ANALYTICS_SAVE_INTERVAL = int(os.getenv("ANALYTICS_SAVE_INTERVAL", 60))
+
+# Ma'lumot fayllari formati: auto (orjson bo'lsa u, aks holda json), json, json-pretty, orjson, msgpack
+DATA_CODEC = os.getenv("DATA_CODEC", "auto")
+DATA_COMPRESSION = os.getenv("DATA_COMPRESSION", "none")  # none, gzip, zstd
+
+# Event loop kechikishini kuzatish
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", 0.25))  # soniya
+LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", 200))
+LOOP_LAG_WINDOW = int(os.getenv("LOOP_LAG_WINDOW", 2400))  # foizliklar uchun namunalar
+LOOP_BLOCK_STACKS = int(os.getenv("LOOP_BLOCK_STACKS", 20))
+
+# SIGTERM/SIGINT dan keyin yangilanishlarni tugatish uchun vaqt (fly.toml kill_timeout dan kichik)
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 20))
+
+# Saqlangan file_id larni fon rejimida tekshirish
+FILE_CHECK_INTERVAL = int(os.getenv("FILE_CHECK_INTERVAL", 24 * 3600))  # to'liq aylanishlar orasida, 0 - o'chirilgan
+FILE_CHECK_RATE = float(os.getenv("FILE_CHECK_RATE", 1))  # soniyasiga tekshiruvlar
+FILE_CHECK_CONCURRENCY = int(os.getenv("FILE_CHECK_CONCURRENCY", 2))
+FILE_CHECK_STATE = os.getenv("FILE_CHECK_STATE", "file_check.json")
+
+# /stats keshi va /ready tekshiruvi
+STATS_CACHE_TTL = int(os.getenv("STATS_CACHE_TTL", 30))  # soniya
+# Web threaddan bot loopida bajariladigan o'qishlar (/stats, xotira hisobotlari) uchun muddat (soniya)
+BOT_LOOP_CALL_TIMEOUT = float(os.getenv("BOT_LOOP_CALL_TIMEOUT", 10))
+READY_MAX_QUEUE = int(os.getenv("READY_MAX_QUEUE", 1000))  # navbatdagi yangilanishlar
+READY_MAX_UPDATE_AGE = int(os.getenv("READY_MAX_UPDATE_AGE", 0))  # soniya, 0 - tekshirilmaydi
+
+# Faol bo'lmagan foydalanuvchilarni siqilgan arxivga ko'chirish
+COLD_USERS_DIR = os.getenv("COLD_USERS_DIR", "cold_users")
+USER_ARCHIVE_AFTER_DAYS = int(os.getenv("USER_ARCHIVE_AFTER_DAYS", 30))  # 0 - o'chirilgan
+USER_ARCHIVE_INTERVAL = int(os.getenv("USER_ARCHIVE_INTERVAL", 6 * 3600))  # soniya
+COLD_SEGMENT_MAX_RECORDS = int(os.getenv("COLD_SEGMENT_MAX_RECORDS", 10000))
+
+# Bir nechta bot jarayoni bitta ma'lumotlar papkasi bilan ishlashi (fayl qulflari orqali)
+SHARED_STORE = os.getenv("SHARED_STORE", "0") == "1"
+# SHARED_STORE: yakka fon vazifalari (fayllar tekshiruvi, arxivlash, a'zolik, xatolar hisoboti)
+# faqat yetakchi jarayonda ishlaydi; qolganlari qulfni shu oraliqda qayta so'raydi (soniya)
+LEADER_LOCK_FILE = "leader.lock"
+LEADER_RETRY_INTERVAL = int(os.getenv("LEADER_RETRY_INTERVAL", 30))
+# Yetakchi bo'lmagan jarayonlarning xatolari shu faylga yig'iladi va yetakchi yuboradi
+ERROR_SPOOL_FILE = "errors_pending.json"
+
+# Bitta jarayonda bir nechta bot: JSON fayl (bots.example.json ga qarang), bo'sh bo'lsa BOT_TOKEN/OWNER_ID
+BOTS_CONFIG = os.getenv("BOTS_CONFIG", "")
+
+# Bot API so'rovlari cheklovi (barcha botlar uchun bitta rejalashtiruvchi), 0 - cheklanmaydi
+RATE_LIMIT_PER_BOT = float(os.getenv("RATE_LIMIT_PER_BOT", 30))  # soniyasiga so'rovlar
+RATE_LIMIT_PER_CHAT = float(os.getenv("RATE_LIMIT_PER_CHAT", 1))  # soniyasiga xabarlar
+RATE_LIMIT_CHAT_BURST = int(os.getenv("RATE_LIMIT_CHAT_BURST", 5))
+
+# Yangilanishlar ustuvorlik navbatlari: bir vaqtda qayta ishlanadigan yangilanishlar (0 - ketma-ket, navbatlarsiz)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", 32))
+# nom:vazn:navbat_chegarasi - vazn ulushni belgilaydi, chegaradan oshgan yangilanishlar tashlab yuboriladi
+UPDATE_LANES = os.getenv("UPDATE_LANES", "admin:8:1000,delivery:4:2000,onboarding:2:2000,background:1:500")
+LANE_LATENCY_WINDOW = int(os.getenv("LANE_LATENCY_WINDOW", 1000))  # foizliklar uchun namunalar
+# Bitta foydalanuvchining navbatdagi yangilanishlari chegarasi (adminlardan tashqari, 0 - cheklanmaydi)
+UPDATE_USER_MAX_PENDING = int(os.getenv("UPDATE_USER_MAX_PENDING", 5))
+
+# Webhook rejimi: bir nechta instansiya polling qila olmaydi, shuning uchun
+# WEBHOOK_URL berilsa yangilanishlar /webhook endpointi orqali qabul qilinadi
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# ========================== LOGGING ==========================
+# Joriy yangilanish konteksti (har bir log yozuviga qo'shiladi)
+log_update_id: ContextVar[Optional[int]] = ContextVar("log_update_id", default=None)
+log_user_id: ContextVar[Optional[int]] = ContextVar("log_user_id", default=None)
+log_handler: ContextVar[Optional[str]] = ContextVar("log_handler", default=None)
+log_bot: ContextVar[Optional[str]] = ContextVar("log_bot", default=None)
+
+class JsonFormatter(logging.Formatter):
+    """Log yozuvlarini bir qatorli JSON ko'rinishida chiqarish"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        for field in ("bot", "update_id", "user_id", "handler"):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class ContextQueueHandler(QueueHandler):
+    """Yozuvni kontekst maydonlari bilan navbatga qo'yish (I/O fon threadida bajariladi)"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Kontekst yozuv yaratilgan threadda olinishi kerak
+        record.bot = log_bot.get()
+        record.update_id = log_update_id.get()
+        record.user_id = log_user_id.get()
+        record.handler = log_handler.get()
+        return super().prepare(record)
+
+class LogSampler(logging.Filter):
+    """Shovqinli loggerlarning INFO yozuvlaridan faqat bir qismini o'tkazish"""
+
+    def __init__(self, rate: float, prefixes: Tuple[str, ...]):
+        super().__init__()
+        self.rate = rate
+        self.prefixes = prefixes
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or not record.name.startswith(self.prefixes):
+            return True
+        return random.random() < self.rate
+
+def setup_logging() -> QueueListener:
+    """Root loggerni navbat orqali fon threadidagi yozuvchiga ulash"""
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter())
+    
+    queue_handler = ContextQueueHandler(log_queue)
+    queue_handler.addFilter(LogSampler(LOG_SAMPLE_RATE, LOG_SAMPLED_LOGGERS))
+    
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    # Chiqishda navbatdagi yozuvlar oxirigacha yoziladi
+    atexit.register(listener.stop)
+    return listener
+
+# Log yozuvchisi main() da ishga tushiriladi (import paytida thread va handlerlar yaratilmaydi)
+log_listener: Optional[QueueListener] = None
 logger = logging.getLogger(__name__)
 
+# ========================== TRACING ==========================
+class UpdateTrace:
+    """Bitta yangilanish davomida bajarilgan ishlar (handler, Database, Bot API)"""
+    __slots__ = ("update_id", "user_id", "handler", "started_at", "start", "spans")
+
+    def __init__(self, update_id: Optional[int], user_id: Optional[int]):
+        self.update_id = update_id
+        self.user_id = user_id
+        self.handler: Optional[str] = None
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        # (tur, nom, boshlanish, davomiylik) - soniyalarda
+        self.spans: List[Tuple[str, str, float, float]] = []
+
+    def add(self, kind: str, name: str, started: float):
+        """Tugagan bo'lakni qo'shish (started - perf_counter qiymati)"""
+        self.spans.append((kind, name, started - self.start, time.perf_counter() - started))
+
+    def to_dict(self, total: float) -> Dict:
+        return {
+            "update_id": self.update_id,
+            "user_id": self.user_id,
+            "handler": self.handler,
+            "started_at": datetime.fromtimestamp(self.started_at).strftime("%Y-%m-%d %H:%M:%S"),
+            "total_ms": round(total * 1000, 1),
+            "spans": [
+                {"kind": kind, "name": name, "start_ms": round(offset * 1000, 1), "duration_ms": round(duration * 1000, 1)}
+                for kind, name, offset, duration in self.spans
+            ]
+        }
+
+current_trace: ContextVar[Optional[UpdateTrace]] = ContextVar("current_trace", default=None)
+
+# Oxirgi sekin yangilanishlar (ring buffer)
+slow_traces: "deque[Dict]" = deque(maxlen=SLOW_TRACE_BUFFER)
+
+# Ishga tushish bosqichlari: modul boshidan necha ms o'tgani (import, state, first_poll, first_update)
+startup_report: Dict[str, float] = {}
+
+def mark_startup(stage: str):
+    """Bosqichni faqat birinchi marta yozish"""
+    if stage not in startup_report:
+        startup_report[stage] = round((time.perf_counter() - PROCESS_STARTED) * 1000, 1)
+
+def finish_trace(trace: UpdateTrace):
+    """Trace ni yakunlash: sekin bo'lsa logga va bufferga yozish"""
+    total = time.perf_counter() - trace.start
+    if total * 1000 < SLOW_UPDATE_THRESHOLD_MS:
+        return
+    
+    data = trace.to_dict(total)
+    slow_traces.append(data)
+    breakdown = ", ".join(
+        f"{span['kind']}:{span['name']}={span['duration_ms']}ms" for span in data["spans"]
+    )
+    logger.warning(f"Sekin yangilanish: {data['total_ms']}ms [{breakdown}]")
+
+def traced_db(func):
+    """Database metodining davomiyligini joriy trace ga yozish"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        trace = current_trace.get()
+        if trace is None:
+            return func(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            trace.add("db", func.__name__, started)
+    return wrapper
+
+class TracedRequest(HTTPXRequest):
+    """Har bir Bot API chaqiruvini joriy trace ga yozadigan so'rov klassi"""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        trace = current_trace.get()
+        if trace is None:
+            return await super().do_request(url, method, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        finally:
+            # URL oxiri - API metodi nomi (masalan sendVideo)
+            trace.add("api", url.rsplit('/', 1)[-1], started)
+
+def track_handler(func):
+    """Handler nomini log kontekstiga va trace ga yozish"""
+    @functools.wraps(func)
+    async def wrapper(update, context):
+        token = log_handler.set(func.__name__)
+        trace = current_trace.get()
+        started = time.perf_counter()
+        try:
+            return await func(update, context)
+        finally:
+            log_handler.reset(token)
+            if trace is not None:
+                trace.add("handler", func.__name__, started)
+                trace.handler = trace.handler or func.__name__
+    return wrapper
+
 # ========================== MA'LUMOTLARNI SAQLASH ==========================
+def file_version(filename: str) -> Optional[Tuple[int, int]]:
+    """Fayl versiyasi (inode, mtime). Fayl atomik almashtirilganda o'zgaradi"""
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns)
+
+# ---------- Kodeklar ----------
+# Har bir kodek: (serializatsiya, deserializatsiya). Faqat o'rnatilganlari ro'yxatga olinadi
+CODECS: Dict[str, Tuple[Any, Any]] = {
+    "json": (
+        lambda data: json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8'),
+        json.loads
+    ),
+    "json-pretty": (
+        lambda data: json.dumps(data, ensure_ascii=False, indent=4, default=str).encode('utf-8'),
+        json.loads
+    )
+}
+if orjson is not None:
+    CODECS["orjson"] = (
+        lambda data: orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS, default=str),
+        orjson.loads
+    )
+if msgpack is not None:
+    CODECS["msgpack"] = (
+        lambda data: msgpack.packb(data, use_bin_type=True, default=str),
+        lambda raw: msgpack.unpackb(raw, raw=False, strict_map_key=False)
+    )
+
+COMPRESSORS: Dict[str, Tuple[Any, Any]] = {
+    "none": (lambda raw: raw, lambda raw: raw),
+    "gzip": (lambda raw: gzip.compress(raw, compresslevel=6, mtime=0), gzip.decompress)
+}
+if zstandard is not None:
+    COMPRESSORS["zstd"] = (
+        lambda raw: zstandard.ZstdCompressor(level=3).compress(raw),
+        lambda raw: zstandard.ZstdDecompressor().decompressobj().decompress(raw)
+    )
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+def resolve_codec(name: str) -> str:
+    if name == "auto":
+        return "orjson" if "orjson" in CODECS else "json"
+    if name not in CODECS:
+        raise ValueError(f"Kodek mavjud emas yoki o'rnatilmagan: {name}")
+    return name
+
+def encode_data(data: Any, codec: str = DATA_CODEC, compression: str = DATA_COMPRESSION) -> bytes:
+    """Ma'lumotni tanlangan kodek va siqish bilan baytlarga aylantirish"""
+    if compression not in COMPRESSORS:
+        raise ValueError(f"Siqish usuli mavjud emas yoki o'rnatilmagan: {compression}")
+    dumps, _ = CODECS[resolve_codec(codec)]
+    compress, _ = COMPRESSORS[compression]
+    return compress(dumps(data))
+
+def decode_data(raw: bytes) -> Any:
+    """Formatni avtomatik aniqlab o'qish (siqilgan/siqilmagan, JSON/msgpack)
+    
+    Har qanday buzilgan ma'lumot uchun ValueError ko'tariladi.
+    """
+    try:
+        if raw.startswith(GZIP_MAGIC):
+            raw = gzip.decompress(raw)
+        elif raw.startswith(ZSTD_MAGIC):
+            if zstandard is None:
+                raise ValueError("zstd bilan siqilgan fayl, lekin zstandard o'rnatilmagan")
+            raw = COMPRESSORS["zstd"][1](raw)
+        
+        # JSON har doim '{' yoki '[' bilan boshlanadi (bo'shliqlardan keyin)
+        head = raw.lstrip()[:1]
+        if head in (b"{", b"["):
+            return orjson.loads(raw) if orjson is not None else json.loads(raw)
+        if not raw.strip():
+            raise ValueError("Fayl bo'sh")
+        if msgpack is None:
+            raise ValueError("msgpack formatidagi fayl, lekin msgpack o'rnatilmagan")
+        return CODECS["msgpack"][1](raw)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Ma'lumotni o'qib bo'lmadi: {e}") from e
+
+def read_data_file(filename: str) -> Any:
+    """Ma'lumot faylini o'qish (FileNotFoundError yoki ValueError ko'tarishi mumkin)"""
+    with open(filename, 'rb') as f:
+        return decode_data(f.read())
+
+def write_file_atomic(filename: str, data: Any, codec: str = DATA_CODEC, compression: str = DATA_COMPRESSION):
+    """Ma'lumotni vaqtinchalik faylga yozib, so'ng atomik almashtirish
+    
+    O'quvchilar (boshqa jarayonlar ham) hech qachon yarim yozilgan faylni ko'rmaydi.
+    """
+    payload = encode_data(data, codec, compression)
+    tmp_file = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_file, filename)
+
+@contextmanager
+def file_lock(filename: str):
+    """Jarayonlararo eksklyuziv qulf (filename.lock fayli orqali)"""
+    with open(f"{filename}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+# ========================== FAOLLIK STATISTIKASI ==========================
+def popcount(bitmap: bytes) -> int:
+    """Bitmapdagi 1 bitlar soni"""
+    return int.from_bytes(bitmap, 'little').bit_count()
+
+class ActivityAnalytics:
+    """Kunlik faollik bitmaplari: DAU/WAU/MAU va retention
+    
+    Har bir foydalanuvchiga zich indeks beriladi (user_index.bin, faqat
+    qo'shiladi). Har bir kun uchun ikkita bitmap saqlanadi: faol bo'lganlar
+    va qo'shilganlar. Yangilash O(1), hisoblash foydalanuvchilarni
+    aylanib chiqmaydi - faqat bitmaplar OR/AND qilinadi.
+    """
+
+    def __init__(self, directory: str, retention_days: int, shared: bool = False):
+        self.directory = directory
+        self.retention_days = retention_days
+        self.shared = shared
+        self.index_file = os.path.join(directory, "user_index.bin")
+        self._ids = array('q')
+        self._index: Dict[int, int] = {}
+        self._active: Dict[str, bytearray] = {}
+        self._joined: Dict[str, bytearray] = {}
+        self._dirty: Set[Tuple[str, str]] = set()
+
+    # ---------- indeks ----------
+    def _read_index_tail(self):
+        """Indeks faylining hali o'qilmagan qismini yuklash"""
+        if not os.path.exists(self.index_file):
+            return
+        with open(self.index_file, 'rb') as f:
+            f.seek(len(self._ids) * self._ids.itemsize)
+            tail = array('q')
+            tail.frombytes(f.read())
+        for user_id in tail:
+            self._index[user_id] = len(self._ids)
+            self._ids.append(user_id)
+
+    def _append_ids(self, user_ids: List[int]):
+        """Yangi foydalanuvchilarga indeks berish va faylga qo'shish"""
+        new_ids = array('q', user_ids)
+        with open(self.index_file, 'ab') as f:
+            new_ids.tofile(f)
+        for user_id in new_ids:
+            self._index[user_id] = len(self._ids)
+            self._ids.append(user_id)
+
+    def _user_index(self, user_id: int) -> int:
+        idx = self._index.get(user_id)
+        if idx is not None:
+            return idx
+        if self.shared:
+            # Boshqa jarayon ham indeks berayotgan bo'lishi mumkin
+            with file_lock(self.index_file):
+                self._read_index_tail()
+                if user_id not in self._index:
+                    self._append_ids([user_id])
+        else:
+            self._append_ids([user_id])
+        return self._index[user_id]
+
+    # ---------- bitmaplar ----------
+    def _set_bit(self, kind: str, day: str, idx: int):
+        bitmaps = self._active if kind == "active" else self._joined
+        bitmap = bitmaps.get(day)
+        if bitmap is None:
+            bitmap = bitmaps[day] = bytearray()
+        byte = idx >> 3
+        if byte >= len(bitmap):
+            bitmap.extend(bytes(byte - len(bitmap) + 1))
+        bit = 1 << (idx & 7)
+        if not bitmap[byte] & bit:
+            bitmap[byte] |= bit
+            self._dirty.add((kind, day))
+
+    def record_activity(self, user_id: int, when: Optional[datetime] = None):
+        """Foydalanuvchi faolligini belgilash (O(1))"""
+        day = (when or datetime.now()).strftime("%Y-%m-%d")
+        self._set_bit("active", day, self._user_index(user_id))
+
+    def record_join(self, user_id: int, when: Optional[datetime] = None):
+        """Yangi foydalanuvchini belgilash (O(1))"""
+        when = when or datetime.now()
+        idx = self._user_index(user_id)
+        day = when.strftime("%Y-%m-%d")
+        self._set_bit("joined", day, idx)
+        self._set_bit("active", day, idx)
+
+    # ---------- diskka saqlash ----------
+    def _path(self, kind: str, day: str) -> str:
+        return os.path.join(self.directory, f"{kind}-{day}.bin")
+
+    @staticmethod
+    def _read_bitmap(path: str) -> bytearray:
+        try:
+            with open(path, 'rb') as f:
+                return bytearray(zlib.decompress(f.read()))
+        except (OSError, zlib.error):
+            return bytearray()
+
+    def _oldest_day(self) -> str:
+        return (datetime.now() - timedelta(days=self.retention_days)).strftime("%Y-%m-%d")
+
+    def load(self, users: Dict):
+        """Indeks va bitmaplarni yuklash (birinchi ishga tushishda users dan to'ldiriladi)"""
+        os.makedirs(self.directory, exist_ok=True)
+        if self.shared:
+            # Bir vaqtda ishga tushgan jarayonlar indeksni faqat bir marta yaratadi:
+            # fayl mavjudligi qulf ichida qayta tekshiriladi
+            with file_lock(self.index_file):
+                if not os.path.exists(self.index_file):
+                    self._backfill(users)
+                    return
+                self._read_index_tail()
+        elif not os.path.exists(self.index_file):
+            self._backfill(users)
+            return
+        else:
+            self._read_index_tail()
+        
+        oldest = self._oldest_day()
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".bin") or filename == "user_index.bin":
+                continue
+            kind, _, day = filename[:-4].partition("-")
+            if kind not in ("active", "joined") or day < oldest:
+                continue
+            bitmaps = self._active if kind == "active" else self._joined
+            bitmaps[day] = self._read_bitmap(os.path.join(self.directory, filename))
+        logger.info(f"Faollik statistikasi yuklandi: {len(self._ids)} ta foydalanuvchi indeksi")
+
+    def _backfill(self, users: Dict):
+        """Mavjud foydalanuvchilardan indeks va bitmaplarni bir marta yaratish
+        
+        Umumiy rejimda load() indeks qulfini ushlab turgan holda chaqiradi.
+        """
+        self._append_ids([int(user_id) for user_id in users if user_id.lstrip('-').isdigit()])
+        oldest = self._oldest_day()
+        for user_id, info in users.items():
+            idx = self._index.get(int(user_id)) if user_id.lstrip('-').isdigit() else None
+            if idx is None:
+                continue
+            joined_day = str(info.get("joined_date", ""))[:10]
+            active_day = str(info.get("last_activity", ""))[:10]
+            if joined_day >= oldest:
+                self._set_bit("joined", joined_day, idx)
+                self._set_bit("active", joined_day, idx)
+            if active_day >= oldest:
+                self._set_bit("active", active_day, idx)
+        self.save()
+        logger.info(f"Faollik statistikasi yaratildi: {len(self._ids)} ta foydalanuvchi")
+
+    def save(self):
+        """O'zgargan bitmaplarni siqilgan holda yozish va eskilarini o'chirish"""
+        dirty, self._dirty = self._dirty, set()
+        for kind, day in dirty:
+            bitmaps = self._active if kind == "active" else self._joined
+            bitmap = bitmaps.get(day)
+            if bitmap is None:
+                continue
+            path = self._path(kind, day)
+            if self.shared:
+                # Bitmaplar faqat o'sadi, shuning uchun OR bilan birlashtirish xavfsiz
+                with file_lock(path):
+                    merged = int.from_bytes(bitmap, 'little') | int.from_bytes(self._read_bitmap(path), 'little')
+                    bitmaps[day] = bitmap = bytearray(merged.to_bytes((merged.bit_length() + 7) // 8, 'little'))
+                    self._write_bitmap(path, bitmap)
+            else:
+                self._write_bitmap(path, bitmap)
+        self._prune()
+
+    @staticmethod
+    def _write_bitmap(path: str, bitmap: bytearray):
+        tmp_file = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(zlib.compress(bytes(bitmap)))
+        os.replace(tmp_file, path)
+
+    def _prune(self):
+        """Saqlash muddatidan eski kunlarni o'chirish"""
+        oldest = self._oldest_day()
+        for kind, bitmaps in (("active", self._active), ("joined", self._joined)):
+            for day in [day for day in bitmaps if day < oldest]:
+                del bitmaps[day]
+                try:
+                    os.remove(self._path(kind, day))
+                except OSError:
+                    pass
+
+    # ---------- hisobotlar ----------
+    @staticmethod
+    def _union(bitmaps: Dict[str, bytearray], days: List[str]) -> int:
+        union = 0
+        for day in days:
+            bitmap = bitmaps.get(day)
+            if bitmap:
+                union |= int.from_bytes(bitmap, 'little')
+        return union
+
+    def summary(self) -> Dict:
+        """DAU/WAU/MAU, yangi foydalanuvchilar va D1/D7/D30 retention"""
+        today = datetime.now()
+        days = [(today - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(32)]
+        
+        retention = {}
+        # Retention to'liq kunlar bo'yicha: k+1 kun oldin qo'shilganlardan kechagi kun faol bo'lganlar
+        yesterday_active = int.from_bytes(self._active.get(days[1], b""), 'little')
+        for k in (1, 7, 30):
+            cohort = int.from_bytes(self._joined.get(days[k + 1], b""), 'little')
+            cohort_size = cohort.bit_count()
+            retained = (cohort & yesterday_active).bit_count()
+            retention[f"d{k}"] = {
+                "cohort": cohort_size,
+                "retained": retained,
+                "rate": round(retained / cohort_size, 3) if cohort_size else None
+            }
+        
+        return {
+            "dau": self._union(self._active, days[:1]).bit_count(),
+            "wau": self._union(self._active, days[:7]).bit_count(),
+            "mau": self._union(self._active, days[:30]).bit_count(),
+            "new_today": self._union(self._joined, days[:1]).bit_count(),
+            "new_7d": self._union(self._joined, days[:7]).bit_count(),
+            "new_30d": self._union(self._joined, days[:30]).bit_count(),
+            "retention": retention,
+            "indexed_users": len(self._ids)
+        }
+
+# ========================== ARXIV (SOVUQ) FOYDALANUVCHILAR ==========================
+class ColdUserStore:
+    """Faol bo'lmagan foydalanuvchilar uchun siqilgan, faqat qo'shiladigan segmentlar
+    
+    Har bir segment - gzip qilingan JSON qatorlar (segment-00001.jsonl.gz).
+    Har bir arxivlash faylga yangi gzip a'zosi qo'shadi, shuning uchun
+    fayl hech qachon qayta yozilmaydi. Xotirada faqat user_id -> (segment,
+    a'zo boshlanishi) indeksi saqlanadi: qaytarishda faqat bitta a'zo o'qiladi.
+    """
+
+    # prefetch() qilingan, hali olinmagan yozuvlar chegarasi
+    PREFETCH_MAX = 256
+
+    def __init__(self, directory: str, segment_max_records: int, shared: bool = False):
+        self.directory = directory
+        self.segment_max_records = segment_max_records
+        self.shared = shared
+        self._index: Dict[str, Tuple[int, int]] = {}
+        self._prefetched: "OrderedDict[str, Dict]" = OrderedDict()
+        # Segment -> o'qilgan baytlar soni va yozuvlar soni
+        self._offsets: Dict[int, int] = {}
+        self._records: Dict[int, int] = {}
+        self.rehydrated_total = 0
+        self.archived_total = 0
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"segment-{segment:05d}.jsonl.gz")
+
+    def _segments(self) -> List[int]:
+        segments = []
+        for filename in os.listdir(self.directory):
+            if filename.startswith("segment-") and filename.endswith(".jsonl.gz"):
+                segments.append(int(filename[8:13]))
+        return sorted(segments)
+
+    @staticmethod
+    def _read_lines(path: str, offset: int = 0) -> Iterator[Dict]:
+        """Segmentni (berilgan gzip a'zosidan boshlab) o'qish"""
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            try:
+                with gzip.GzipFile(fileobj=f) as gz:
+                    for line in gz:
+                        yield json.loads(line)
+            except (EOFError, OSError, zlib.error, json.JSONDecodeError):
+                # Oxirgi a'zo hali yozilayotgan bo'lishi mumkin
+                return
+
+    @staticmethod
+    def _scan_members(path: str, offset: int) -> Tuple[List[Tuple[int, List[Dict]]], int]:
+        """offset dan boshlab to'liq gzip a'zolari: [(a'zo boshlanishi, yozuvlar)], oxirgi to'liq a'zo oxiri"""
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        members = []
+        pos = 0
+        while pos < len(data):
+            decompressor = zlib.decompressobj(wbits=31)
+            try:
+                raw = decompressor.decompress(memoryview(data)[pos:])
+                records = [json.loads(line) for line in raw.splitlines() if line]
+            except (zlib.error, json.JSONDecodeError):
+                break
+            if not decompressor.eof:
+                break  # Oxirgi a'zo hali yozilayotgan bo'lishi mumkin
+            members.append((offset + pos, records))
+            pos = len(data) - len(decompressor.unused_data)
+        return members, offset + pos
+
+    def _read_record(self, location: Tuple[int, int], user_id: str) -> Optional[Dict]:
+        """Bitta gzip a'zosini o'qib, undan foydalanuvchi yozuvini olish"""
+        segment, offset = location
+        decompressor = zlib.decompressobj(wbits=31)
+        chunks = []
+        try:
+            with open(self._segment_path(segment), 'rb') as f:
+                f.seek(offset)
+                while not decompressor.eof:
+                    chunk = f.read(65536)
+                    if not chunk:
+                        break
+                    chunks.append(decompressor.decompress(chunk))
+        except (OSError, zlib.error) as e:
+            logger.error(f"Arxiv segmentini o'qishda xato ({segment}): {e}")
+            return None
+        
+        found = None
+        for line in b"".join(chunks).splitlines():
+            record = json.loads(line)
+            if record["id"] == user_id:
+                found = record["d"]
+        return found
+
+    @contextmanager
+    def _locked(self):
+        if not self.shared:
+            yield
+            return
+        with file_lock(os.path.join(self.directory, "segments")):
+            yield
+
+    def load(self):
+        """Segmentlardan indeksni tiklash"""
+        os.makedirs(self.directory, exist_ok=True)
+        self.refresh()
+        if self._index:
+            logger.info(f"Arxivdagi foydalanuvchilar: {len(self._index)} ta")
+
+    def refresh(self):
+        """Yangi qo'shilgan a'zolarni o'qish (boshqa jarayonlar yozganlari ham)"""
+        with self._locked():
+            for segment in self._segments():
+                path = self._segment_path(segment)
+                size = os.path.getsize(path)
+                offset = self._offsets.get(segment, 0)
+                if size == offset:
+                    continue
+                members, end = self._scan_members(path, offset)
+                for member_offset, records in members:
+                    for record in records:
+                        self._index[record["id"]] = (segment, member_offset)
+                    self._records[segment] = self._records.get(segment, 0) + len(records)
+                self._offsets[segment] = end
+
+    def archive(self, records: Dict[str, Dict]):
+        """Foydalanuvchilarni joriy segmentga qo'shish"""
+        if not records:
+            return
+        with self._locked():
+            segments = self._segments()
+            segment = segments[-1] if segments else 1
+            if self._records.get(segment, 0) >= self.segment_max_records:
+                segment += 1
+            
+            lines = "".join(
+                json.dumps({"id": user_id, "d": info}, ensure_ascii=False, separators=(',', ':')) + "\n"
+                for user_id, info in records.items()
+            )
+            path = self._segment_path(segment)
+            member_offset = os.path.getsize(path) if os.path.exists(path) else 0
+            # 'ab' rejimi faylga yangi gzip a'zosini qo'shadi
+            with gzip.open(path, 'ab') as gz:
+                gz.write(lines.encode('utf-8'))
+            
+            for user_id in records:
+                self._index[user_id] = (segment, member_offset)
+                self._prefetched.pop(user_id, None)
+            self._records[segment] = self._records.get(segment, 0) + len(records)
+            self._offsets[segment] = os.path.getsize(path)
+        self.archived_total += len(records)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._index
+
+    def fetch(self, user_id: str) -> Optional[Dict]:
+        """Arxivdan foydalanuvchi yozuvini olish (eng so'nggi versiyasi)"""
+        location = self._index.get(user_id)
+        if location is None:
+            return None
+        record = self._prefetched.pop(user_id, None)
+        if record is not None:
+            return record
+        return self._read_record(location, user_id)
+
+    async def prefetch(self, user_id: str):
+        """Arxivdagi foydalanuvchi yozuvini threadda o'qib qo'yish
+        
+        Handlerlardan oldin chaqiriladi: keyingi fetch() diskka tegmaydi va
+        sovuq foydalanuvchining birinchi xabari event loopni to'smaydi.
+        """
+        location = self._index.get(user_id)
+        if location is None or user_id in self._prefetched:
+            return
+        record = await asyncio.to_thread(self._read_record, location, user_id)
+        # O'qish paytida foydalanuvchi qaytarilgan yoki qayta arxivlangan bo'lishi mumkin
+        if record is not None and self._index.get(user_id) == location:
+            self._prefetched[user_id] = record
+            while len(self._prefetched) > self.PREFETCH_MAX:
+                self._prefetched.popitem(last=False)
+
+    def forget(self, user_ids: Iterable[str]):
+        """Faol (hot) bo'lgan foydalanuvchilarni indeksdan olib tashlash"""
+        for user_id in user_ids:
+            self._index.pop(user_id, None)
+            self._prefetched.pop(user_id, None)
+
+    def iter_records(self, exclude: Dict) -> Iterator[Tuple[str, Dict]]:
+        """Arxivdagi barcha foydalanuvchilar (faqat so'nggi versiyalar)"""
+        for segment in sorted({segment for segment, _ in self._index.values()}):
+            latest = {}
+            for record in self._read_lines(self._segment_path(segment)):
+                latest[record["id"]] = record["d"]
+            for user_id, info in latest.items():
+                if self._index.get(user_id, (None,))[0] == segment and user_id not in exclude:
+                    yield user_id, info
+
+    def count(self) -> int:
+        return len(self._index)
+
+    def stats(self) -> Dict:
+        return {
+            "users": len(self._index),
+            "segments": len(self._offsets),
+            "bytes": sum(self._offsets.values()),
+            "archived_total": self.archived_total,
+            "rehydrated_total": self.rehydrated_total
+        }
+
 class Database:
-    def __init__(self):
+    def __init__(self, data_dir: str = ".", owner_id: int = OWNER_ID):
+        if SHARED_STORE and fcntl is None:
+            raise RuntimeError("SHARED_STORE rejimi faqat Unix tizimlarida ishlaydi")
+        # Har bir bot o'z papkasida ishlaydi, fayllar nomi (MOVIES_FILE ...) kalit sifatida qoladi
+        self.data_dir = data_dir
+        self.owner_id = owner_id
+        os.makedirs(data_dir, exist_ok=True)
+        # Har bir faylning oxirgi yuklangan/saqlangan versiyasi
+        self._versions: Dict[str, Optional[Tuple[int, int]]] = {}
+        # Oxirgi saqlash vaqti (/ready uchun)
+        self.last_save: Optional[float] = None
         # Fayllar mavjudligini tekshirish
         self.ensure_files_exist()
         self.movies = self.load_data(MOVIES_FILE)
+        self._rebuild_movie_indexes()
         self.channels = self.load_data(CHANNELS_FILE)
         self.users = self.load_data(USERS_FILE)
         self.admins = self.load_admins()
+        # Faollik statistikasi (DAU/WAU/MAU)
+        self.analytics = ActivityAnalytics(self.path(ANALYTICS_DIR), ANALYTICS_RETENTION_DAYS, shared=SHARED_STORE)
+        self.analytics.load(self.users)
+        # Arxivlangan foydalanuvchilar (faol foydalanuvchilar users.json da qoladi)
+        self.cold_users = ColdUserStore(self.path(COLD_USERS_DIR), COLD_SEGMENT_MAX_RECORDS, shared=SHARED_STORE)
+        self.cold_users.load()
+        self.cold_users.forget(self.users.keys())
+    
+    def path(self, filename: str) -> str:
+        """Bot papkasidagi fayl yo'li"""
+        return os.path.join(self.data_dir, filename)
     
     def ensure_files_exist(self):
         """Fayllar mavjudligini tekshirish va yaratish"""
         for file in [ADMINS_FILE, MOVIES_FILE, CHANNELS_FILE, USERS_FILE]:
-            if not os.path.exists(file):
+            if not os.path.exists(self.path(file)):
                 if file == ADMINS_FILE:
-                    data = {"admin_ids": [OWNER_ID]}
+                    data = {"admin_ids": [self.owner_id]}
                 else:
                     data = {}
                 
-                with open(file, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=4)
-                logger.info(f"{file} fayli yaratildi")
+                write_file_atomic(self.path(file), data)
+                logger.info(f"{self.path(file)} fayli yaratildi")
     
     def load_data(self, filename: str) -> Dict:
-        """JSON fayldan ma'lumotlarni yuklash"""
+        """Fayldan ma'lumotlarni yuklash (format avtomatik aniqlanadi)"""
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            self._versions[filename] = file_version(self.path(filename))
+            return read_data_file(self.path(filename))
         except FileNotFoundError:
             self.ensure_files_exist()
             return {}
-        except json.JSONDecodeError:
-            logger.error(f"{filename} faylda JSON xatosi")
+        except ValueError as e:
+            logger.error(f"{filename} faylni o'qishda xato: {e}")
             return {}
     
     def load_admins(self) -> Set[int]:
         """Adminlarni yuklash"""
         try:
-            with open(ADMINS_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                admin_ids = set(data.get("admin_ids", []))
-                admin_ids.add(OWNER_ID)  # EGA admin har doim admin
-                return admin_ids
-        except (FileNotFoundError, json.JSONDecodeError):
+            self._versions[ADMINS_FILE] = file_version(self.path(ADMINS_FILE))
+            data = read_data_file(self.path(ADMINS_FILE))
+            admin_ids = set(data.get("admin_ids", []))
+            admin_ids.add(self.owner_id)  # EGA admin har doim admin
+            return admin_ids
+        except (FileNotFoundError, ValueError):
             self.ensure_files_exist()
-            return {OWNER_ID}
+            return {self.owner_id}
     
     def save_admins(self):
         """Adminlarni saqlash"""
@@ -112,13 +1033,63 @@ class Database:
             "admin_ids": list(self.admins),
             "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
-        with open(ADMINS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        self.save_data(ADMINS_FILE, data)
     
     def save_data(self, filename: str, data: Dict):
-        """Ma'lumotlarni JSON faylga saqlash"""
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        """Ma'lumotlarni faylga saqlash (DATA_CODEC / DATA_COMPRESSION)"""
+        trace = current_trace.get()
+        started = time.perf_counter()
+        write_file_atomic(self.path(filename), data)
+        self._versions[filename] = file_version(self.path(filename))
+        self.last_save = time.time()
+        if trace is not None:
+            trace.add("db", f"save_data({filename})", started)
+    
+    # ========== JARAYONLARARO SINXRONLASH ==========
+    def _reload(self, filename: str):
+        """Bitta faylni diskdan qayta yuklash"""
+        if filename == MOVIES_FILE:
+            self.movies = self.load_data(MOVIES_FILE)
+            self._rebuild_movie_indexes()
+        elif filename == CHANNELS_FILE:
+            self.channels = self.load_data(CHANNELS_FILE)
+        elif filename == USERS_FILE:
+            self.users = self.load_data(USERS_FILE)
+            # Boshqa jarayon arxivlagan yoki qaytargan foydalanuvchilar
+            if hasattr(self, "cold_users"):
+                self.cold_users.refresh()
+                self.cold_users.forget(self.users.keys())
+        elif filename == ADMINS_FILE:
+            self.admins = self.load_admins()
+    
+    def is_stale(self, filename: str) -> bool:
+        """Faylni boshqa jarayon o'zgartirganligini tekshirish"""
+        return file_version(self.path(filename)) != self._versions.get(filename)
+    
+    @traced_db
+    def refresh(self) -> List[str]:
+        """Boshqa jarayonlar o'zgartirgan fayllarni qayta yuklash (keshlarni yangilash)"""
+        changed = []
+        for filename in (MOVIES_FILE, CHANNELS_FILE, USERS_FILE, ADMINS_FILE):
+            if self.is_stale(filename):
+                self._reload(filename)
+                changed.append(filename)
+        return changed
+    
+    @contextmanager
+    def locked(self, filename: str):
+        """O'zgartirish uchun fayl qulfini olish (faqat SHARED_STORE rejimida)
+        
+        Qulf olingandan keyin fayl eskirgan bo'lsa qayta yuklanadi, shuning
+        uchun o'zgarish har doim eng so'nggi holatga qo'llaniladi.
+        """
+        if not SHARED_STORE:
+            yield
+            return
+        with file_lock(self.path(filename)):
+            if self.is_stale(filename):
+                self._reload(filename)
+            yield
     
     def save_movies(self):
         """Kinolarni saqlash"""
@@ -139,25 +1110,29 @@ class Database:
     
     def is_owner(self, user_id: int) -> bool:
         """Foydalanuvchi EGA admin ekanligini tekshirish"""
-        return user_id == OWNER_ID
+        return user_id == self.owner_id
     
+    @traced_db
     def add_admin(self, user_id: int) -> bool:
         """Yangi admin qo'shish (faqat EGA admin uchun)"""
-        if user_id not in self.admins:
-            self.admins.add(user_id)
-            self.save_admins()
-            logger.info(f"Yangi admin qo'shildi: {user_id}")
-            return True
-        return False
+        with self.locked(ADMINS_FILE):
+            if user_id not in self.admins:
+                self.admins.add(user_id)
+                self.save_admins()
+                logger.info(f"Yangi admin qo'shildi: {user_id}")
+                return True
+            return False
     
+    @traced_db
     def remove_admin(self, user_id: int) -> bool:
         """Adminni o'chirish (faqat EGA admin uchun)"""
-        if user_id in self.admins and user_id != OWNER_ID:  # EGAni o'chirib bo'lmaydi
-            self.admins.remove(user_id)
-            self.save_admins()
-            logger.info(f"Admin o'chirildi: {user_id}")
-            return True
-        return False
+        with self.locked(ADMINS_FILE):
+            if user_id in self.admins and user_id != self.owner_id:  # EGAni o'chirib bo'lmaydi
+                self.admins.remove(user_id)
+                self.save_admins()
+                logger.info(f"Admin o'chirildi: {user_id}")
+                return True
+            return False
     
     def get_admins(self) -> List[int]:
         """Barcha adminlarni olish"""
@@ -169,60 +1144,221 @@ class Database:
         return [(idx + 1, admin_id) for idx, admin_id in enumerate(admins)]
     
     # ========== KINO FUNKSIYALARI ==========
+    @traced_db
     def add_movie(self, code: str, file_id: str, file_type: str, caption: str = "", uploader_id: int = None):
         """Yangi kino qo'shish"""
-        self.movies[code] = {
-            "file_id": file_id,
-            "file_type": file_type,
-            "caption": caption,
-            "uploader_id": uploader_id,
-            "upload_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "download_count": 0
-        }
-        self.save_movies()
+        with self.locked(MOVIES_FILE):
+            if code in self.movies:
+                self._unindex_movie(code, self.movies[code])
+            self.movies[code] = {
+                "file_id": file_id,
+                "file_type": file_type,
+                "caption": caption,
+                "uploader_id": uploader_id,
+                "upload_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "download_count": 0
+            }
+            self._index_movie(code, self.movies[code])
+            self.save_movies()
+    
+    def next_movie_code(self) -> int:
+        """Keyingi bo'sh raqamli kod (eng katta raqamli koddan keyingisi)"""
+        numeric_codes = [int(code) for code in self.movies if code.isdigit()]
+        return max(numeric_codes, default=0) + 1
+    
+    @traced_db
+    def add_movies_bulk(self, items: List[Dict], uploader_id: int = None) -> Dict:
+        """Ko'p kinoni bitta saqlash bilan qo'shish
+        
+        Kodi yo'q elementlarga ketma-ket raqamli kod beriladi.
+        Takroriy kod yoki fayllar o'tkazib yuboriladi.
+        """
+        with self.locked(MOVIES_FILE):
+            return self._add_movies_bulk(items, uploader_id)
+    
+    def _add_movies_bulk(self, items: List[Dict], uploader_id: int = None) -> Dict:
+        upload_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        existing_files = {movie.get("file_id") for movie in self.movies.values()}
+        # Aniq berilgan kodlar avtomatik kodlarga berilmasligi uchun oldindan band qilinadi
+        reserved = {str(item.get("code") or "").strip() for item in items} - {""}
+        next_code = self.next_movie_code()
+        
+        batch = {}
+        batch_files = set()
+        duplicates = []
+        invalid = 0
+        
+        for item in items:
+            file_id = (item.get("file_id") or "").strip()
+            file_type = item.get("file_type") or "video"
+            if not file_id or file_type not in ("video", "document", "audio"):
+                invalid += 1
+                continue
+            
+            code = str(item.get("code") or "").strip()
+            if code and (code in self.movies or code in batch):
+                duplicates.append(code)
+                continue
+            if file_id in existing_files or file_id in batch_files:
+                duplicates.append(code or file_id[:12])
+                continue
+            
+            if not code:
+                while str(next_code) in self.movies or str(next_code) in reserved:
+                    next_code += 1
+                code = str(next_code)
+                next_code += 1
+            
+            batch[code] = {
+                "file_id": file_id,
+                "file_type": file_type,
+                "caption": item.get("caption") or "",
+                "uploader_id": uploader_id,
+                "upload_date": upload_date,
+                "download_count": 0
+            }
+            batch_files.add(file_id)
+        
+        if batch:
+            self.movies.update(batch)
+            for code, movie in batch.items():
+                self._index_movie(code, movie)
+            self.save_movies()
+            logger.info(f"Ommaviy yuklash: {len(batch)} ta kino qo'shildi")
+        
+        return {"added": list(batch), "duplicates": duplicates, "invalid": invalid}
     
     def get_movie(self, code: str) -> Optional[Dict]:
         """Kod bo'yicha kino olish"""
         return self.movies.get(code)
     
+    @traced_db
     def increment_download_count(self, code: str):
         """Kino yuklab olish sonini oshirish"""
-        if code in self.movies:
-            self.movies[code]["download_count"] += 1
-            self.save_movies()
+        with self.locked(MOVIES_FILE):
+            if code in self.movies:
+                self.movies[code]["download_count"] += 1
+                self.uploader_downloads[self.movies[code].get("uploader_id")] += 1
+                self.save_movies()
     
     def get_all_movies(self) -> Dict:
         """Barcha kinolarni olish"""
         return self.movies
     
-    def delete_movie(self, code: str) -> bool:
-        """Kino o'chirish"""
-        if code in self.movies:
-            del self.movies[code]
+    @traced_db
+    def set_movie_broken(self, code: str, reason: Optional[str]) -> bool:
+        """Kinoni yaroqsiz deb belgilash (karantin) yoki belgini olib tashlash"""
+        with self.locked(MOVIES_FILE):
+            movie = self.movies.get(code)
+            if movie is None or (reason is None and "broken" not in movie):
+                return False
+            if reason is None:
+                del movie["broken"]
+            else:
+                movie["broken"] = {"reason": reason, "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
             self.save_movies()
-            logger.info(f"Kino o'chirildi: {code}")
             return True
-        return False
+    
+    def get_broken_movies(self) -> Dict[str, Dict]:
+        """Karantindagi kinolar"""
+        return {code: movie["broken"] for code, movie in self.movies.items() if "broken" in movie}
+    
+    @traced_db
+    def delete_movie(self, code: str) -> bool:
+        """Kino o'chirish"""
+        with self.locked(MOVIES_FILE):
+            if code in self.movies:
+                self._unindex_movie(code, self.movies[code])
+                del self.movies[code]
+                self.save_movies()
+                logger.info(f"Kino o'chirildi: {code}")
+                return True
+            return False
+    
+    # ========== KINOLAR INDEKSLARI ==========
+    # movies_by_uploader: yuklovchi -> kodlar; movies_by_date: (upload_date, kod) tartiblangan;
+    # uploader_downloads: yuklovchi -> yuklab olishlar yig'indisi. Barchasi add_movie/delete_movie
+    # da yangilanadi va fayl yuklanganda qayta quriladi - admin ko'rinishlari butun db.movies ni aylanmaydi.
+    def _rebuild_movie_indexes(self):
+        """Indekslarni db.movies dan qayta qurish"""
+        self.movies_by_uploader: Dict[Optional[int], Set[str]] = {}
+        self.uploader_downloads: Counter = Counter()
+        for code, movie in self.movies.items():
+            uploader_id = movie.get("uploader_id")
+            self.movies_by_uploader.setdefault(uploader_id, set()).add(code)
+            self.uploader_downloads[uploader_id] += movie.get("download_count", 0)
+        self.movies_by_date: List[Tuple[str, str]] = sorted(
+            (movie.get("upload_date", ""), code) for code, movie in self.movies.items()
+        )
+    
+    def _index_movie(self, code: str, movie: Dict):
+        uploader_id = movie.get("uploader_id")
+        self.movies_by_uploader.setdefault(uploader_id, set()).add(code)
+        self.uploader_downloads[uploader_id] += movie.get("download_count", 0)
+        # Yangi kinolar odatda eng oxiriga tushadi
+        insort(self.movies_by_date, (movie.get("upload_date", ""), code))
+    
+    def _unindex_movie(self, code: str, movie: Dict):
+        uploader_id = movie.get("uploader_id")
+        codes = self.movies_by_uploader.get(uploader_id)
+        if codes is not None:
+            codes.discard(code)
+            if not codes:
+                del self.movies_by_uploader[uploader_id]
+        self.uploader_downloads[uploader_id] -= movie.get("download_count", 0)
+        if uploader_id not in self.movies_by_uploader:
+            del self.uploader_downloads[uploader_id]
+        
+        key = (movie.get("upload_date", ""), code)
+        index = bisect_left(self.movies_by_date, key)
+        if index < len(self.movies_by_date) and self.movies_by_date[index] == key:
+            del self.movies_by_date[index]
+    
+    def get_movies_by_uploader(self, uploader_id: Optional[int]) -> List[str]:
+        """Yuklovchining kinolari (eng yangisi birinchi)"""
+        codes = self.movies_by_uploader.get(uploader_id, ())
+        return sorted(codes, key=lambda code: self.movies[code].get("upload_date", ""), reverse=True)
+    
+    def get_movies_in_range(self, start: str, end: Optional[str] = None) -> List[str]:
+        """upload_date start..end oralig'idagi kinolar (eng yangisi birinchi)
+        
+        Sanalar saqlangan formatda ("%Y-%m-%d %H:%M:%S"), end ham kiradi.
+        """
+        low = bisect_left(self.movies_by_date, (start,))
+        high = bisect_right(self.movies_by_date, (end, "\uffff")) if end else len(self.movies_by_date)
+        return [code for _, code in reversed(self.movies_by_date[low:high])]
+    
+    def get_uploader_stats(self) -> List[Tuple[Optional[int], int, int]]:
+        """(yuklovchi, kinolar soni, yuklab olishlar) - yuklab olishlar bo'yicha kamayish tartibida"""
+        stats = [
+            (uploader_id, len(codes), self.uploader_downloads.get(uploader_id, 0))
+            for uploader_id, codes in self.movies_by_uploader.items()
+        ]
+        return sorted(stats, key=lambda item: (item[2], item[1]), reverse=True)
     
     # ========== KANAL FUNKSIYALARI ==========
+    @traced_db
     def add_channel(self, channel_id: str, channel_username: str, channel_name: str):
         """Yangi majburiy kanal qo'shish"""
-        self.channels[channel_id] = {
-            "username": channel_username,
-            "name": channel_name,
-            "added_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
-        self.save_channels()
+        with self.locked(CHANNELS_FILE):
+            self.channels[channel_id] = {
+                "username": channel_username,
+                "name": channel_name,
+                "added_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+            self.save_channels()
         logger.info(f"Kanal qo'shildi: {channel_id} - {channel_name}")
     
+    @traced_db
     def remove_channel(self, channel_id: str) -> bool:
         """Kanal o'chirish"""
-        if channel_id in self.channels:
-            del self.channels[channel_id]
-            self.save_channels()
-            logger.info(f"Kanal o'chirildi: {channel_id}")
-            return True
-        return False
+        with self.locked(CHANNELS_FILE):
+            if channel_id in self.channels:
+                del self.channels[channel_id]
+                self.save_channels()
+                logger.info(f"Kanal o'chirildi: {channel_id}")
+                return True
+            return False
     
     def get_channels(self) -> Dict:
         """Barcha kanallarni olish"""
@@ -240,92 +1376,2248 @@ class Database:
         return channel_list
     
     # ========== FOYDALANUVCHI FUNKSIYALARI ==========
+    @traced_db
     def add_user(self, user_id: int):
         """Yangi foydalanuvchi qo'shish"""
-        if str(user_id) not in self.users:
-            self.users[str(user_id)] = {
-                "joined_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "last_activity": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "movies_downloaded": 0,
-                "is_subscribed": False
-            }
-            self.save_users()
+        with self.locked(USERS_FILE):
+            if str(user_id) in self.users:
+                return
+            # Arxivdagi foydalanuvchi qaytdi - yangi sifatida yaratilmaydi
+            if self._rehydrate(str(user_id)):
+                self.save_users()
+                return
+            if str(user_id) not in self.users:
+                self.users[str(user_id)] = {
+                    "joined_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "last_activity": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "movies_downloaded": 0,
+                    "is_subscribed": False
+                }
+                self.save_users()
+                self.analytics.record_join(user_id)
     
+    @traced_db
     def update_user_activity(self, user_id: int):
         """Foydalanuvchi faolligini yangilash"""
-        user_id_str = str(user_id)
-        if user_id_str in self.users:
-            self.users[user_id_str]["last_activity"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.save_users()
+        with self.locked(USERS_FILE):
+            user_id_str = str(user_id)
+            if user_id_str in self.users or self._rehydrate(user_id_str):
+                self.users[user_id_str]["last_activity"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                self.save_users()
+                self.analytics.record_activity(user_id)
     
+    @traced_db
     def increment_user_downloads(self, user_id: int):
         """Foydalanuvchi yuklab olishlar sonini oshirish"""
-        user_id_str = str(user_id)
-        if user_id_str in self.users:
-            self.users[user_id_str]["movies_downloaded"] += 1
-            self.save_users()
+        with self.locked(USERS_FILE):
+            user_id_str = str(user_id)
+            if user_id_str in self.users or self._rehydrate(user_id_str):
+                self.users[user_id_str]["movies_downloaded"] += 1
+                self.save_users()
     
+    @traced_db
     def set_user_subscription(self, user_id: int, status: bool):
         """Foydalanuvchi obuna holatini o'rnatish"""
-        user_id_str = str(user_id)
-        if user_id_str in self.users:
-            self.users[user_id_str]["is_subscribed"] = status
+        with self.locked(USERS_FILE):
+            user_id_str = str(user_id)
+            if user_id_str in self.users or self._rehydrate(user_id_str):
+                self.users[user_id_str]["is_subscribed"] = status
+                self.save_users()
+    
+    @traced_db
+    def touch_user(self, user_id: int, subscribed: Optional[bool] = None):
+        """Qo'shish + faollik + obuna holati bitta yozuvda (add_user, update_user_activity va set_user_subscription o'rniga)"""
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self.locked(USERS_FILE):
+            user_id_str = str(user_id)
+            joined = False
+            if user_id_str not in self.users and not self._rehydrate(user_id_str):
+                self.users[user_id_str] = {
+                    "joined_date": now,
+                    "last_activity": now,
+                    "movies_downloaded": 0,
+                    "is_subscribed": False
+                }
+                joined = True
+            user = self.users[user_id_str]
+            user["last_activity"] = now
+            if subscribed is not None:
+                user["is_subscribed"] = subscribed
+            self.save_users()
+            if joined:
+                self.analytics.record_join(user_id)
+            self.analytics.record_activity(user_id)
+    
+    # ========== ARXIV FUNKSIYALARI ==========
+    def _rehydrate(self, user_id_str: str) -> bool:
+        """Arxivdagi foydalanuvchini faol ro'yxatga qaytarish (saqlash chaqiruvchida)"""
+        if user_id_str not in self.cold_users:
+            return False
+        record = self.cold_users.fetch(user_id_str)
+        self.cold_users.forget([user_id_str])
+        if record is None:
+            return False
+        self.users[user_id_str] = record
+        self.cold_users.rehydrated_total += 1
+        logger.info(f"Foydalanuvchi arxivdan qaytarildi: {user_id_str}")
+        return True
+    
+    @traced_db
+    def archive_inactive_users(self, max_age_days: int) -> int:
+        """last_activity eski bo'lgan foydalanuvchilarni arxivga ko'chirish"""
+        cutoff = (datetime.now() - timedelta(days=max_age_days)).strftime("%Y-%m-%d %H:%M:%S")
+        with self.locked(USERS_FILE):
+            inactive = {
+                user_id: info for user_id, info in self.users.items()
+                if info.get("last_activity", "") < cutoff
+            }
+            if not inactive:
+                return 0
+            # Avval arxivga yoziladi, keyin faol ro'yxatdan o'chiriladi
+            self.cold_users.archive(inactive)
+            for user_id in inactive:
+                del self.users[user_id]
             self.save_users()
+        logger.info(f"Arxivga ko'chirildi: {len(inactive)} ta foydalanuvchi")
+        return len(inactive)
+    
+    def count_users(self) -> int:
+        """Barcha foydalanuvchilar soni (faol + arxivdagi)"""
+        return len(self.users) + self.cold_users.count()
 
-# Global database obyekti
-db = Database()
+# ========================== SUHBAT HOLATI ==========================
+def deep_getsizeof(obj: Any, seen: Optional[Set[int]] = None) -> int:
+    """Obyektning taxminiy to'liq hajmi (baytlarda)"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_getsizeof(key, seen) + deep_getsizeof(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += deep_getsizeof(item, seen)
+    return size
 
-# FastAPI ilova yaratish
-fastapi_app = FastAPI()
+class ConversationStore:
+    """Admin oqimlari holatini saqlash (TTL, LRU va ixtiyoriy diskka yozish)"""
 
-@fastapi_app.get("/")
-async def root():
-    return {"status": "online", "bot": "Kino Bot", "timestamp": datetime.now().isoformat()}
+    def __init__(self, filename: Optional[str], ttl: int, max_entries: int, shared: bool = False,
+                 protected: Optional[Callable[[int], bool]] = None):
+        self.filename = filename
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # Chegaradan oshganda chiqarilmaydigan foydalanuvchilar (adminlar oqimi)
+        self.protected = protected or (lambda user_id: False)
+        # shared=True: fayl bir nechta jarayon orasida umumiy, har bir
+        # foydalanuvchi yozuvi alohida pull/push qilinadi
+        self.shared = shared and bool(filename)
+        self._shared_snapshot: Dict[str, list] = {}
+        self._shared_version: Optional[Tuple[int, int]] = None
+        # user_id -> (oxirgi murojaat vaqti, holat). Tartib = oxirgi murojaat tartibi
+        self._states: "OrderedDict[int, Tuple[float, Dict]]" = OrderedDict()
+        self._dirty = False
+        self.expired_count = 0
+        self.evicted_count = 0
+        self.load()
 
-@fastapi_app.get("/health")
-async def health_check():
-    return {"status": "healthy", "bot": "running"}
+    def get(self, user_id: int) -> "ConversationState":
+        """Foydalanuvchi holatini olish
+        
+        Yozuv bo'lmasa saqlanmagan bo'sh holat qaytariladi: u omborga faqat
+        birinchi yozishda qo'shiladi, shuning uchun oddiy foydalanuvchilarning
+        xabarlari yozuv yaratmaydi va faylni qayta yozdirmaydi.
+        """
+        now = time.time()
+        entry = self._states.get(user_id)
+        if entry is not None and now - entry[0] > self.ttl:
+            del self._states[user_id]
+            self.expired_count += 1
+            self._dirty = True
+            entry = None
+        if entry is None:
+            return ConversationState(self, user_id)
+        
+        # Murojaat vaqtini yangilash (o'zgarish emas, diskka yozilmaydi)
+        self._states[user_id] = (now, entry[1])
+        self._states.move_to_end(user_id)
+        return entry[1]
 
-@fastapi_app.get("/stats")
-async def get_stats():
-    return {
-        "movies_count": len(db.movies),
-        "channels_count": len(db.channels),
-        "users_count": len(db.users),
-        "admins_count": len(db.get_admins())
-    }
+    def _changed(self, user_id: int, state: "ConversationState"):
+        """Holat o'zgardi: bo'sh bo'lsa o'chiriladi, aks holda saqlanadi"""
+        if state:
+            self._states[user_id] = (time.time(), state)
+            self._states.move_to_end(user_id)
+            self._evict()
+        else:
+            entry = self._states.get(user_id)
+            if entry is not None and entry[1] is state:
+                del self._states[user_id]
+        self._dirty = True
 
-# ========================== FUNKSIYALAR ==========================
-def is_admin(user_id: int) -> bool:
-    """Foydalanuvchi admin ekanligini tekshirish"""
-    return db.is_admin(user_id)
+    def _evict(self):
+        """Chegaradan oshganda eng eski himoyalanmagan holatlarni chiqarish"""
+        while len(self._states) > self.max_entries:
+            victim = next(
+                (user_id for user_id in self._states if not self.protected(user_id)),
+                next(iter(self._states))  # hammasi himoyalangan - eng eskisi
+            )
+            del self._states[victim]
+            self.evicted_count += 1
 
-def is_owner(user_id: int) -> bool:
-    """Foydalanuvchi EGA admin ekanligini tekshirish"""
-    return db.is_owner(user_id)
+    def drop(self, user_id: int):
+        """Foydalanuvchi holatini o'chirish"""
+        if self._states.pop(user_id, None) is not None:
+            self._dirty = True
 
-def get_admin_keyboard(user_id: int) -> ReplyKeyboardMarkup:
-    """Admin paneli uchun pastki tugmalar"""
-    if is_owner(user_id):
-        # EGA admin uchun maxsus tugmalar
-        keyboard = [
-            [KeyboardButton("🎬 Kino Yuklash"), KeyboardButton("📢 Kanallarni Ko'rish")],
-            [KeyboardButton("➕ Kanal Qo'shish"), KeyboardButton("➖ Kanal O'chirish")],
-            [KeyboardButton("👑 Adminlarni Boshqarish"), KeyboardButton("📊 Statistika")],
-            [KeyboardButton("📝 Kinolar Ro'yxati"), KeyboardButton("🗑️ Kino O'chirish")],
-            [KeyboardButton("🔙 Asosiy Menyu")]
-        ]
+    def expire(self) -> int:
+        """Muddati o'tgan holatlarni o'chirish"""
+        deadline = time.time() - self.ttl
+        expired = 0
+        # Eng eski murojaatlar boshida turadi
+        while self._states:
+            user_id, (touched, state) = next(iter(self._states.items()))
+            if touched > deadline:
+                break
+            del self._states[user_id]
+            expired += 1
+        if expired:
+            self.expired_count += expired
+            self._dirty = True
+        return expired
+
+    def evict_idle(self, max_age: int) -> int:
+        """max_age soniyadan beri ishlatilmagan holatlarni chiqarish (xotira tanqisligida)"""
+        deadline = time.time() - max_age
+        evicted = 0
+        while self._states:
+            user_id, (touched, state) = next(iter(self._states.items()))
+            if touched > deadline:
+                break
+            del self._states[user_id]
+            evicted += 1
+        if evicted:
+            self.evicted_count += evicted
+            self._dirty = True
+        return evicted
+
+    def _read_file(self) -> Dict:
+        """Holatlar faylini o'qish"""
+        if not self.filename or not os.path.exists(self.filename):
+            return {}
+        try:
+            return read_data_file(self.filename)
+        except (OSError, ValueError) as e:
+            logger.error(f"{self.filename} faylini o'qishda xato: {e}")
+            return {}
+
+    def load(self):
+        """Saqlangan holatlarni diskdan yuklash"""
+        data = self._read_file()
+        if not data:
+            return
+        
+        deadline = time.time() - self.ttl
+        for user_id, (touched, state) in sorted(data.items(), key=lambda x: x[1][0]):
+            if touched > deadline and state:
+                self._states[int(user_id)] = (touched, ConversationState(self, int(user_id), state))
+        logger.info(f"Suhbat holatlari yuklandi: {len(self._states)} ta")
+
+    def save(self, force: bool = False):
+        """Holatlarni diskka ixcham ko'rinishda yozish"""
+        # Umumiy rejimda fayl push() orqali yoziladi
+        if not self.filename or self.shared or not (self._dirty or force):
+            return
+        # Bo'sh holatlar saqlanmaydi
+        data = {
+            str(user_id): [round(touched, 1), dict(state)]
+            for user_id, (touched, state) in self._states.items()
+            if state
+        }
+        write_file_atomic(self.filename, data)
+        self._dirty = False
+
+    def pull(self, user_id: int):
+        """Boshqa jarayon yozgan foydalanuvchi holatini olish (umumiy rejim)"""
+        if not self.shared:
+            return
+        version = file_version(self.filename)
+        if version != self._shared_version:
+            self._shared_snapshot = self._read_file()
+            self._shared_version = version
+        
+        # Umumiy fayl manba hisoblanadi: har bir yangilanishdan keyin push() qilinadi
+        entry = self._shared_snapshot.get(str(user_id))
+        if entry is not None and time.time() - entry[0] <= self.ttl:
+            self._states[user_id] = (entry[0], ConversationState(self, user_id, entry[1]))
+            self._states.move_to_end(user_id)
+        else:
+            self._states.pop(user_id, None)
+
+    def push(self, user_id: int):
+        """Foydalanuvchi holatini umumiy faylga yozish (umumiy rejim)"""
+        if not self.shared:
+            return
+        entry = self._states.get(user_id)
+        key = str(user_id)
+        if not (entry and entry[1]) and key not in self._shared_snapshot:
+            return  # O'zgarish yo'q
+        
+        with file_lock(self.filename):
+            data = self._read_file()
+            if entry and entry[1]:
+                data[key] = [round(entry[0], 1), dict(entry[1])]
+            else:
+                data.pop(key, None)
+            # Muddati o'tgan yozuvlarni ham tozalash
+            deadline = time.time() - self.ttl
+            data = {uid: item for uid, item in data.items() if item[0] > deadline}
+            write_file_atomic(self.filename, data)
+            self._shared_snapshot = data
+            self._shared_version = file_version(self.filename)
+
+    def memory_usage(self) -> Dict:
+        """Xotira sarfi haqida hisobot"""
+        return {
+            "entries": len(self._states),
+            "active_entries": sum(1 for _, state in self._states.values() if state),
+            "approx_bytes": deep_getsizeof(self._states),
+            "expired_total": self.expired_count,
+            "evicted_total": self.evicted_count
+        }
+
+class ConversationState(dict):
+    """Bitta foydalanuvchining holati; har bir o'zgarish omborga xabar beradi
+    
+    Ichki ro'yxatlarni joyida o'zgartirish kuzatilmaydi - o'zgargan qiymatni
+    kalitga qayta yozish kerak.
+    """
+
+    __slots__ = ("_store", "_user_id")
+
+    def __init__(self, store: ConversationStore, user_id: int, data: Optional[Dict] = None):
+        super().__init__(data or {})
+        self._store = store
+        self._user_id = user_id
+
+    def _changed(self):
+        self._store._changed(self._user_id, self)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+
+    def pop(self, key, *default):
+        changed = key in self
+        value = super().pop(key, *default)
+        if changed:
+            self._changed()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._changed()
+        return item
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._changed()
+
+    def clear(self):
+        if self:
+            super().clear()
+            self._changed()
+
+class BotContext(CallbackContext):
+    """user_data ni ConversationStore dan oladigan kontekst"""
+
+    @property
+    def user_data(self) -> Optional[Dict]:
+        if self._user_id is not None:
+            return conv_store.get(self._user_id)
+        return None
+
+    @user_data.setter
+    def user_data(self, value: object):
+        raise AttributeError("user_data ga yangi qiymat berib bo'lmaydi")
+
+async def analytics_save_loop():
+    """Faollik bitmaplarini davriy diskka yozish (fon vazifasi)"""
+    while True:
+        await asyncio.sleep(ANALYTICS_SAVE_INTERVAL)
+        try:
+            db.analytics.save()
+        except Exception as e:
+            logger.error(f"Faollik statistikasini saqlashda xato: {e}")
+
+async def user_archive_loop():
+    """Faol bo'lmagan foydalanuvchilarni davriy arxivlash (fon vazifasi)"""
+    while True:
+        try:
+            db.archive_inactive_users(USER_ARCHIVE_AFTER_DAYS)
+        except Exception as e:
+            logger.error(f"Foydalanuvchilarni arxivlashda xato: {e}")
+        await asyncio.sleep(USER_ARCHIVE_INTERVAL)
+
+async def conversation_state_loop():
+    """Muddati o'tgan holatlarni tozalash va diskka yozish (fon vazifasi)"""
+    while True:
+        await asyncio.sleep(CONV_STATE_SAVE_INTERVAL)
+        try:
+            expired = conv_store.expire()
+            conv_store.save()
+            if expired:
+                usage = conv_store.memory_usage()
+                logger.info(
+                    f"Suhbat holatlari: {expired} ta muddati o'tdi, "
+                    f"{usage['entries']} ta qoldi (~{usage['approx_bytes']} bayt)"
+                )
+        except Exception as e:
+            logger.error(f"Suhbat holatlarini saqlashda xato: {e}")
+
+# ========================== KANAL A'ZOLIGI ==========================
+# A'zo hisoblanadigan holatlar
+MEMBER_STATUSES = ('member', 'administrator', 'creator')
+
+class MembershipCache:
+    """Kanal a'zoligi keshi (chat_member yangilanishlari orqali to'ldiriladi)
+    
+    Hajmi cheklangan (eng eski yozuvlar chiqariladi) va har bir yozuv ttl
+    soniyadan keyin eskiradi - keyingi tekshiruv API orqali bo'ladi.
+    """
+
+    def __init__(self, max_entries: int = MEMBERSHIP_CACHE_MAX, ttl: int = MEMBERSHIP_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # (kanal, foydalanuvchi) -> (a'zomi, yozilgan vaqt). Tartib = yozilish tartibi
+        self._entries: "OrderedDict[Tuple[str, int], Tuple[bool, float]]" = OrderedDict()
+        self.cache_hits = 0
+        self.api_checks = 0
+        self.events = 0
+        self.evicted = 0
+
+    def status(self, channel_id: str, user_id: int) -> Optional[bool]:
+        """A'zolik holati: True/False, noma'lum yoki eskirgan bo'lsa None"""
+        entry = self._entries.get((channel_id, user_id))
+        if entry is None:
+            return None
+        if time.monotonic() - entry[1] > self.ttl:
+            del self._entries[(channel_id, user_id)]
+            return None
+        return entry[0]
+
+    def set_status(self, channel_id: str, user_id: int, is_member: bool):
+        """A'zolik holatini yozish"""
+        key = (channel_id, user_id)
+        self._entries.pop(key, None)
+        self._entries[key] = (is_member, time.monotonic())
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evicted += 1
+
+    def clear(self) -> int:
+        """Keshni tozalash (xotira tanqisligida); keyingi tekshiruvlar API orqali"""
+        dropped = len(self._entries)
+        self._entries.clear()
+        return dropped
+
+    def retain(self, channel_ids: List[str]):
+        """O'chirilgan kanallar ma'lumotlarini tashlab yuborish"""
+        channels = set(channel_ids)
+        for key in [key for key in self._entries if key[0] not in channels]:
+            del self._entries[key]
+
+    def stats(self) -> Dict:
+        return {
+            "entries": len(self._entries),
+            "members": sum(1 for is_member, _ in self._entries.values() if is_member),
+            "ttl": self.ttl,
+            "evicted": self.evicted,
+            "cache_hits": self.cache_hits,
+            "api_checks": self.api_checks,
+            "events": self.events
+        }
+
+# ========================== FLOOD NAZORATI ==========================
+class FloodBucket:
+    """Bitta foydalanuvchi uchun token bucket"""
+    __slots__ = ("tokens", "last_seen", "strikes", "blocked_until", "warned")
+
+    def __init__(self, now: float):
+        self.tokens = float(FLOOD_BURST)
+        self.last_seen = now
+        self.strikes = 0
+        self.blocked_until = 0.0
+        self.warned = False
+
+class FloodControl:
+    """Foydalanuvchilar bo'yicha xabarlar tezligini cheklash"""
+
+    def __init__(self, rate: float, burst: int, cooldown: int, max_cooldown: int, idle_ttl: int):
+        self.rate = rate
+        self.burst = burst
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.idle_ttl = idle_ttl
+        # Tartib = oxirgi xabar tartibi, eski yozuvlar boshida turadi
+        self._buckets: "OrderedDict[int, FloodBucket]" = OrderedDict()
+        self.shed_total = 0
+        self.warned_total = 0
+        self.blocked_users_total = 0
+
+    def _expire(self, now: float):
+        """Uzoq vaqt jim turgan foydalanuvchilarni o'chirish (amortizatsiyalangan O(1))"""
+        deadline = now - self.idle_ttl
+        while self._buckets:
+            user_id, bucket = next(iter(self._buckets.items()))
+            if bucket.last_seen > deadline:
+                break
+            del self._buckets[user_id]
+
+    def hit(self, user_id: int) -> Tuple[bool, bool]:
+        """Xabarni hisobga olish. (ruxsat berildimi, ogohlantirish kerakmi)"""
+        now = time.monotonic()
+        self._expire(now)
+        
+        bucket = self._buckets.pop(user_id, None) or FloodBucket(now)
+        self._buckets[user_id] = bucket
+        
+        if now < bucket.blocked_until:
+            allowed = False
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.last_seen) * self.rate)
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                allowed = True
+            else:
+                # Takroriy buzuvchilar uchun cheklov muddati oshib boradi
+                bucket.strikes += 1
+                bucket.blocked_until = now + min(self.max_cooldown, self.cooldown * 2 ** (bucket.strikes - 1))
+                bucket.warned = False
+                self.blocked_users_total += 1
+                allowed = False
+        bucket.last_seen = now
+        
+        if allowed:
+            return True, False
+        
+        self.shed_total += 1
+        warn = not bucket.warned
+        if warn:
+            bucket.warned = True
+            self.warned_total += 1
+        return False, warn
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        return {
+            "tracked_users": len(self._buckets),
+            "blocked_now": sum(1 for b in self._buckets.values() if b.blocked_until > now),
+            "shed_total": self.shed_total,
+            "warned_total": self.warned_total,
+            "blocks_total": self.blocked_users_total
+        }
+
+# ========================== XATOLAR HISOBOTI ==========================
+class ErrorDigest:
+    """Xatolarni tur va joy bo'yicha guruhlab, egaga davriy hisobot tayyorlash"""
+
+    def __init__(self):
+        self._entries: Dict[str, Dict] = {}
+        self.recorded_total = 0
+        self.suppressed_total = 0
+        self.digests_sent = 0
+
+    @staticmethod
+    def fingerprint(error: BaseException) -> Tuple[str, str]:
+        """Xato turi va u yuz bergan joy (fayl:qator)"""
+        frames = traceback.extract_tb(error.__traceback__) if error.__traceback__ else []
+        if frames:
+            frame = frames[-1]
+            location = f"{os.path.basename(frame.filename)}:{frame.lineno} ({frame.name})"
+        else:
+            location = "?"
+        return type(error).__name__, location
+
+    def record(self, error: BaseException):
+        """Xatoni hisobga olish"""
+        error_type, location = self.fingerprint(error)
+        key = f"{error_type}@{location}"
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = {
+                "type": error_type,
+                "location": location,
+                "message": str(error)[:200],
+                "count": 0,
+                "first_seen": now,
+                "last_seen": now,
+                "sample": "".join(traceback.format_exception(type(error), error, error.__traceback__))[-1500:]
+            }
+        entry["count"] += 1
+        entry["last_seen"] = now
+        self.recorded_total += 1
+
+    def drain(self) -> Dict[str, Dict]:
+        """Yig'ilgan xatolarni olish va hisoblagichni tozalash"""
+        entries, self._entries = self._entries, {}
+        return entries
+
+    def restore(self, entries: Dict[str, Dict]):
+        """Yuborilmagan hisobotni qaytarish (yangi yozuvlar bilan birlashtiriladi)"""
+        for key, old in entries.items():
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = old
+            else:
+                entry["count"] += old["count"]
+                entry["first_seen"] = old["first_seen"]
+
+    @staticmethod
+    def format(entries: Dict[str, Dict]) -> str:
+        """Egaga yuboriladigan hisobot matni"""
+        ranked = sorted(entries.values(), key=lambda e: e["count"], reverse=True)
+        text = f"❌ Xatolar hisoboti: {sum(e['count'] for e in ranked)} ta xato, {len(ranked)} xil\n\n"
+        for entry in ranked[:10]:
+            text += f"• {entry['type']} x{entry['count']}\n"
+            text += f"  📍 {entry['location']}\n"
+            text += f"  🕐 {entry['first_seen']} — {entry['last_seen']}\n"
+            text += f"  💬 {entry['message'][:100]}\n\n"
+        if len(ranked) > 10:
+            text += f"... va yana {len(ranked) - 10} xil xato\n\n"
+        text += f"Namuna ({ranked[0]['type']}):\n{ranked[0]['sample']}"
+        # Telegram xabar chegarasi 4096 belgi
+        return text[:4000]
+
+    def spool(self, filename: str):
+        """Yig'ilgan xatolarni umumiy faylga qo'shish (yetakchi bo'lmagan jarayon)"""
+        entries = self.drain()
+        if not entries:
+            return
+        with file_lock(filename):
+            pending = ErrorDigest()
+            pending._entries = self._read_spool(filename)
+            pending.restore(entries)
+            write_file_atomic(filename, pending._entries)
+
+    def collect(self, filename: str):
+        """Boshqa jarayonlar yig'gan xatolarni olish (yetakchi jarayon)"""
+        if not os.path.exists(filename):
+            return
+        with file_lock(filename):
+            entries = self._read_spool(filename)
+            if entries:
+                write_file_atomic(filename, {})
+        self.restore(entries)
+
+    @staticmethod
+    def _read_spool(filename: str) -> Dict[str, Dict]:
+        try:
+            return read_data_file(filename)
+        except (OSError, ValueError):
+            return {}
+
+    def stats(self) -> Dict:
+        return {
+            "pending_kinds": len(self._entries),
+            "pending_errors": sum(e["count"] for e in self._entries.values()),
+            "recorded_total": self.recorded_total,
+            "suppressed_total": self.suppressed_total,
+            "digests_sent": self.digests_sent
+        }
+
+async def error_digest_loop(bot, spool_file: Optional[str] = None):
+    """Yig'ilgan xatolarni egaga davriy yuborish (fon vazifasi, SHARED_STORE da faqat yetakchida)"""
+    while True:
+        await asyncio.sleep(ERROR_DIGEST_INTERVAL)
+        if spool_file:
+            try:
+                error_digest.collect(spool_file)
+            except Exception as e:
+                logger.warning(f"Boshqa jarayonlar xatolarini o'qib bo'lmadi: {e}")
+        entries = error_digest.drain()
+        if not entries:
+            continue
+        try:
+            await bot.send_message(chat_id=db.owner_id, text=ErrorDigest.format(entries))
+            error_digest.digests_sent += 1
+        except Exception as e:
+            logger.warning(f"Xatolar hisobotini yuborib bo'lmadi: {e}")
+            error_digest.restore(entries)
+
+async def error_spool_loop(spool_file: str):
+    """Xatolarni yetakchi jarayon uchun umumiy faylga yig'ish (fon vazifasi, SHARED_STORE)"""
+    while True:
+        await asyncio.sleep(ERROR_DIGEST_INTERVAL)
+        try:
+            error_digest.spool(spool_file)
+        except Exception as e:
+            logger.warning(f"Xatolarni umumiy faylga yozib bo'lmadi: {e}")
+
+# ========================== FAYLLAR SOG'LIGI ==========================
+# Telegram "fayl mavjud emas" deb javob beradigan xatolar
+DEAD_FILE_ERRORS = ("wrong file identifier", "invalid file_id", "file not found", "wrong remote file")
+
+def is_dead_file_error(error: Exception) -> bool:
+    return isinstance(error, BadRequest) and any(text in str(error).lower() for text in DEAD_FILE_ERRORS)
+
+class FileHealthChecker:
+    """Saqlangan file_id larni sekin aylanib tekshirish
+    
+    Har bir kino uchun arzon get_file chaqiriladi. "File is too big"
+    javobi fayl mavjudligini bildiradi (bot faqat 20 MB gacha yuklay oladi).
+    Jarayon checkpoint fayliga yoziladi, qayta ishga tushganda o'sha
+    joydan davom etadi.
+    """
+
+    CHECKPOINT_EVERY = 20
+
+    def __init__(self, state_file: Optional[str], rate: float, concurrency: int):
+        self.state_file = state_file
+        self.rate = rate
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.last_code: Optional[str] = None
+        self.pass_started: Optional[str] = None
+        self.last_pass_finished: Optional[str] = None
+        # Joriy aylanishda yangi topilgan yaroqsiz kodlar
+        self.found: List[str] = []
+        self.checked_total = 0
+        self.broken_total = 0
+        self.errors_total = 0
+
+    def load(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            state = read_data_file(self.state_file)
+            self.last_code = state.get("last_code")
+            self.pass_started = state.get("pass_started")
+            self.last_pass_finished = state.get("last_pass_finished")
+            self.found = state.get("found", [])
+        except (OSError, ValueError) as e:
+            logger.warning(f"Fayl tekshiruvi holatini o'qib bo'lmadi: {e}")
+
+    def save(self):
+        if not self.state_file:
+            return
+        write_file_atomic(self.state_file, {
+            "last_code": self.last_code,
+            "pass_started": self.pass_started,
+            "last_pass_finished": self.last_pass_finished,
+            "found": self.found
+        })
+
+    async def check(self, bot, code: str):
+        """Bitta kinoni tekshirish va natijani bazaga yozish
+        
+        Telegram cheklovida semafor bo'shatilib kutiladi va xuddi shu kod
+        qayta tekshiriladi - checkpoint tekshirilmagan kodni o'tkazib yubormaydi.
+        """
+        while True:
+            async with self.semaphore:
+                retry_after = await self._check_once(bot, code)
+            if retry_after is None:
+                return
+            await asyncio.sleep(retry_after)
+
+    async def _check_once(self, bot, code: str) -> Optional[float]:
+        """Bitta urinish; Telegram cheklovi bo'lsa kutish vaqtini qaytaradi"""
+        movie = db.get_movie(code)
+        if movie is None:
+            return None
+        try:
+            await bot.get_file(movie["file_id"])
+            alive = True
+        except RetryAfter as e:
+            return e.retry_after
+        except BadRequest as e:
+            if "too big" in str(e).lower():
+                alive = True
+            elif is_dead_file_error(e):
+                alive = False
+                reason = str(e)
+            else:
+                self.errors_total += 1
+                return None
+        except Exception as e:
+            # Tarmoq xatolari fayl haqida hech narsa demaydi
+            logger.debug(f"Faylni tekshirishda xato ({code}): {e}")
+            self.errors_total += 1
+            return None
+        
+        self.checked_total += 1
+        if alive:
+            db.set_movie_broken(code, None)
+        elif "broken" not in movie:
+            db.set_movie_broken(code, reason)
+            self.broken_total += 1
+            self.found.append(code)
+            logger.warning(f"Kino fayli yaroqsiz: {code} ({reason})")
+        return None
+
+    async def run_pass(self, bot) -> List[str]:
+        """Bitta to'liq aylanish (checkpointdan davom etadi), yangi yaroqsiz kodlarni qaytaradi"""
+        if self.pass_started is None:
+            self.pass_started = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self.last_code = None
+            self.found = []
+        
+        codes = sorted(db.get_all_movies().keys())
+        if self.last_code is not None:
+            codes = [code for code in codes if code > self.last_code]
+        
+        delay = 1 / self.rate
+        pending = set()
+        for n, code in enumerate(codes, 1):
+            task = asyncio.create_task(self.check(bot, code))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            await asyncio.sleep(delay)
+            if n % self.CHECKPOINT_EVERY == 0:
+                # Checkpoint faqat tugagan tekshiruvlargacha siljiydi
+                if pending:
+                    await asyncio.wait(set(pending))
+                self.last_code = code
+                self.save()
+        if pending:
+            await asyncio.wait(set(pending))
+        
+        found = self.found
+        self.last_code = None
+        self.pass_started = None
+        self.last_pass_finished = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.found = []
+        self.save()
+        return found
+
+    @staticmethod
+    def format(codes: List[str]) -> str:
+        broken = db.get_broken_movies()
+        text = f"🚫 Yaroqsiz kino fayllari topildi: {len(codes)} ta\n"
+        text += "Bu kinolar foydalanuvchilarga yuborilmaydi, qayta yuklang:\n\n"
+        for code in codes[:50]:
+            text += f"• {code}: {broken.get(code, {}).get('reason', '')[:80]}\n"
+        if len(codes) > 50:
+            text += f"... va yana {len(codes) - 50} ta"
+        return text
+
+    def stats(self) -> Dict:
+        return {
+            "in_progress": self.pass_started is not None,
+            "last_code": self.last_code,
+            "last_pass_finished": self.last_pass_finished,
+            "quarantined": len(db.get_broken_movies()),
+            "checked_total": self.checked_total,
+            "broken_total": self.broken_total,
+            "errors_total": self.errors_total
+        }
+
+async def file_check_loop(bot):
+    """Kino fayllarini davriy tekshirish va adminlarga xabar berish (fon vazifasi)"""
+    file_checker.load()
+    # Qayta ishga tushganda yaqinda tugagan aylanish takrorlanmaydi
+    if file_checker.pass_started is None and file_checker.last_pass_finished:
+        finished = datetime.strptime(file_checker.last_pass_finished, "%Y-%m-%d %H:%M:%S")
+        remaining = FILE_CHECK_INTERVAL - (datetime.now() - finished).total_seconds()
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+    while True:
+        try:
+            found = await file_checker.run_pass(bot)
+        except Exception as e:
+            logger.error(f"Fayllarni tekshirishda xato: {e}")
+            found = []
+        
+        if found:
+            text = FileHealthChecker.format(found)
+            for admin_id in db.get_admins():
+                try:
+                    await bot.send_message(chat_id=admin_id, text=text)
+                except Exception as e:
+                    logger.warning(f"Adminga fayllar hisobotini yuborib bo'lmadi ({admin_id}): {e}")
+        await asyncio.sleep(FILE_CHECK_INTERVAL)
+
+# ========================== CPU PROFILING ==========================
+# Bir vaqtda faqat bitta profiling ishlashi mumkin
+profile_lock = threading.Lock()
+
+def sample_stacks(seconds: float, interval: float) -> Dict[str, int]:
+    """Barcha threadlar (bot loop, web server) stekini davriy yig'ish
+    
+    Natija flamegraph uchun collapsed-stack ko'rinishida:
+    "thread;funksiya (fayl:qator);..." -> namunalar soni
+    """
+    counts: Dict[str, int] = {}
+    own_ident = threading.get_ident()
+    deadline = time.monotonic() + seconds
+    
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            key = ";".join(reversed(stack))
+            counts[key] = counts.get(key, 0) + 1
+        time.sleep(interval)
+    
+    return counts
+
+async def _run_in_loop(loop: asyncio.AbstractEventLoop, func):
+    """Funksiyani berilgan event loop threadida bajarish"""
+    async def call():
+        func()
+    await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(call(), loop))
+
+async def profile_process(seconds: float, fmt: str) -> Tuple[bytes, str]:
+    """Ishlab turgan jarayonni profiling qilish. (ma'lumot, fayl nomi)
+    
+    collapsed - barcha threadlar stek namunalari (flamegraph.pl / speedscope),
+    pstats - bot va web server loop threadlarida cProfile natijasi.
+    """
+    if not profile_lock.acquire(blocking=False):
+        raise RuntimeError("Profiling allaqachon ishlamoqda")
+    try:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        if fmt == "collapsed":
+            counts = await asyncio.to_thread(sample_stacks, seconds, PROFILE_SAMPLE_INTERVAL)
+            data = "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+            return data.encode('utf-8'), f"profile-{stamp}.collapsed"
+        
+        # cProfile faqat yoqilgan threadni kuzatadi, shuning uchun har bir loop o'z threadida yoqiladi
+        loops = [loop for loop in (bot_loop, web_loop) if loop is not None and loop.is_running()]
+        if not loops:
+            raise RuntimeError("Ishlab turgan event loop topilmadi")
+        profilers = [cProfile.Profile() for _ in loops]
+        for loop, profiler in zip(loops, profilers):
+            await _run_in_loop(loop, profiler.enable)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            for loop, profiler in zip(loops, profilers):
+                await _run_in_loop(loop, profiler.disable)
+        
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        # pstats.Stats.dump_stats bilan bir xil format (pstats.Stats(fayl) bilan o'qiladi)
+        return marshal.dumps(stats.stats), f"profile-{stamp}.pstats"
+    finally:
+        profile_lock.release()
+
+# ========================== LOOP KECHIKISHI ==========================
+class LoopWatchdog:
+    """Bot event loopi bloklanishini o'lchash va bloklagan stekni ushlash
+    
+    Loop ichidagi korutina har LOOP_LAG_INTERVAL da "yurak urishi" yozadi va
+    uxlash qancha kechikkanini o'lchaydi. Alohida thread urishlar to'xtab
+    qolganini ko'rsa, loop threadining joriy stekini oladi - aynan shu
+    paytda bloklab turgan chaqiruv ko'rinadi.
+    """
+
+    def __init__(self, interval: float, threshold_ms: float, window: int, keep: int):
+        self.interval = interval
+        self.threshold = threshold_ms / 1000
+        self.lags: deque = deque(maxlen=window)
+        self.blocks: deque = deque(maxlen=keep)
+        self.blocks_total = 0
+        self.beat = time.monotonic()
+        self._captured_beat: Optional[float] = None
+        self._loop_ident: Optional[int] = None
+        self._stop = threading.Event()
+
+    async def run(self):
+        """Loopda ishlaydigan yurak urishi (fon vazifasi)"""
+        self._loop_ident = threading.get_ident()
+        self._stop.clear()
+        Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        try:
+            while True:
+                self.beat = time.monotonic()
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, time.monotonic() - self.beat - self.interval)
+                self.lags.append(lag)
+                # Ushlangan blok uchun to'liq kechikishni yozish
+                if self._captured_beat == self.beat and self.blocks:
+                    self.blocks[-1]["lag_ms"] = round(lag * 1000, 1)
+        finally:
+            self._stop.set()
+
+    def _watch(self):
+        """Sidecar thread: to'xtab qolgan loopning stekini olish"""
+        while not self._stop.wait(self.interval / 2):
+            beat = self.beat
+            stalled = time.monotonic() - beat - self.interval
+            if stalled < self.threshold or self._captured_beat == beat:
+                continue
+            frame = sys._current_frames().get(self._loop_ident)
+            if frame is None:
+                continue
+            self._captured_beat = beat
+            self.blocks_total += 1
+            self.blocks.append({
+                "ts": datetime.now().isoformat(timespec="seconds"),
+                "lag_ms": round(stalled * 1000, 1),
+                "stack": [line.rstrip() for line in traceback.format_stack(frame)[-30:]]
+            })
+            logger.warning(f"Event loop {stalled * 1000:.0f} ms bloklandi: "
+                           f"{traceback.format_stack(frame, limit=1)[0].strip()}")
+
+    def stats(self) -> Dict:
+        lags = sorted(self.lags)
+        
+        def percentile(p: float) -> Optional[float]:
+            if not lags:
+                return None
+            return round(lags[min(len(lags) - 1, int(len(lags) * p))] * 1000, 1)
+        
+        return {
+            "samples": len(lags),
+            "p50_ms": percentile(0.5),
+            "p90_ms": percentile(0.9),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(lags[-1] * 1000, 1) if lags else None,
+            "threshold_ms": self.threshold * 1000,
+            "blocks_total": self.blocks_total
+        }
+
+# ========================== XOTIRA TAHLILI ==========================
+def read_rss_bytes() -> Optional[int]:
+    """Jarayonning joriy RSS hajmi (faqat Linux, /proc orqali)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def approx_deep_size(collection: Any, sample: int = MEMORY_SIZE_SAMPLE) -> int:
+    """Katta to'plamning taxminiy to'liq hajmi
+    
+    Barcha elementlarni aylanib chiqmaslik uchun dastlabki `sample` ta
+    element o'lchanadi va natija butun to'plamga ko'paytiriladi. To'plam
+    nusxalanmaydi (aks holda o'lchov paytida xotira ikki baravar oshadi),
+    shuning uchun u bot loopida chaqiriladi.
+    """
+    count = len(collection)
+    if count == 0:
+        return sys.getsizeof(collection)
+    items = list(islice(collection.items() if isinstance(collection, dict) else collection, sample))
+    sampled = sum(deep_getsizeof(item) for item in items)
+    return sys.getsizeof(collection) + int(sampled / len(items) * count)
+
+def memory_collections() -> Dict[str, Dict]:
+    """Asosiy to'plamlar: elementlar soni va taxminiy hajmi (baytlarda)
+    
+    Bot loopida chaqiriladi (web threaddan - run_on_bot_loop orqali).
+    """
+    collections = {"slow_traces": slow_traces}
+    for tenant in tenants:
+        # Bir nechta bot bo'lsa nomlar bot nomi bilan boshlanadi
+        prefix = f"{tenant.name}." if len(tenants) > 1 else ""
+        collections.update({
+            prefix + "db.movies": tenant.db.movies,
+            prefix + "db.users": tenant.db.users,
+            prefix + "db.channels": tenant.db.channels,
+            prefix + "db.admins": tenant.db.admins,
+            prefix + "db.movies_by_date": tenant.db.movies_by_date,
+            prefix + "conversation_state": tenant.conv_store._states,
+            prefix + "cold_users.index": tenant.db.cold_users._index,
+            prefix + "membership": tenant.membership._entries,
+            prefix + "flood_buckets": tenant.flood_control._buckets
+        })
+        if tenant.application is not None:
+            # PTB o'z keshlari (har bir chat/foydalanuvchi uchun lug'at)
+            collections[prefix + "ptb.chat_data"] = tenant.application.chat_data
+            collections[prefix + "ptb.user_data"] = tenant.application.user_data
+    
+    result = {}
+    for name, collection in collections.items():
+        result[name] = {"count": len(collection), "approx_bytes": approx_deep_size(collection)}
+    return result
+
+class MemorySnapshots:
+    """tracemalloc snapshotlarini olish va solishtirish"""
+
+    def __init__(self, keep: int):
+        self._snapshots: "OrderedDict[int, Dict]" = OrderedDict()
+        self._next_id = 1
+        self.keep = keep
+
+    def take(self, collections: Dict[str, Dict]) -> Dict:
+        """Yangi snapshot (tracemalloc + bot loopida o'lchangan to'plamlar hajmi)"""
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc ishga tushirilmagan (/debug/memory/start)")
+        record = {
+            "id": self._next_id,
+            "taken_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "rss_bytes": read_rss_bytes(),
+            "collections": collections,
+            "snapshot": tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ))
+        }
+        self._snapshots[self._next_id] = record
+        self._next_id += 1
+        while len(self._snapshots) > self.keep:
+            self._snapshots.popitem(last=False)
+        return record
+
+    def get(self, snapshot_id: Optional[int]) -> Dict:
+        """Snapshotni olish (None - eng oxirgisi)"""
+        if not self._snapshots:
+            raise KeyError("Snapshot yo'q")
+        if snapshot_id is None:
+            return next(reversed(self._snapshots.values()))
+        return self._snapshots[snapshot_id]
+
+    def clear(self) -> int:
+        dropped = len(self._snapshots)
+        self._snapshots.clear()
+        return dropped
+
+    @staticmethod
+    def top(record: Dict, group: str, limit: int) -> List[Dict]:
+        """Eng ko'p xotira egallagan joylar"""
+        return [
+            {"location": str(stat.traceback), "size": stat.size, "count": stat.count}
+            for stat in record["snapshot"].statistics(group)[:limit]
+        ]
+
+    @staticmethod
+    def diff(base: Dict, target: Dict, group: str, limit: int) -> Dict:
+        """Ikki snapshot farqi: fayl:qator bo'yicha va to'plamlar bo'yicha"""
+        stats = target["snapshot"].compare_to(base["snapshot"], group)
+        collections = {}
+        for name, after in target["collections"].items():
+            before = base["collections"].get(name, {"count": 0, "approx_bytes": 0})
+            collections[name] = {
+                "count_diff": after["count"] - before["count"],
+                "bytes_diff": after["approx_bytes"] - before["approx_bytes"],
+                "count": after["count"],
+                "approx_bytes": after["approx_bytes"]
+            }
+        rss_diff = None
+        if base["rss_bytes"] is not None and target["rss_bytes"] is not None:
+            rss_diff = target["rss_bytes"] - base["rss_bytes"]
+        return {
+            "base": base["id"],
+            "target": target["id"],
+            "rss_diff": rss_diff,
+            "collections": collections,
+            "top": [
+                {"location": str(stat.traceback), "size_diff": stat.size_diff, "size": stat.size,
+                 "count_diff": stat.count_diff}
+                for stat in stats[:limit]
+            ]
+        }
+
+# ========================== XOTIRA NAZORATI ==========================
+def release_memory():
+    """Bo'shagan xotirani operatsion tizimga qaytarish (glibc, bo'lmasa hech narsa qilmaydi)"""
+    try:
+        import ctypes
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+class MemoryGovernor:
+    """RSS ni kuzatib, OOM dan oldin xotirani bo'shatish
+    
+    soft: a'zolik va /stats keshlari, sekin tracelar, tracemalloc
+    snapshotlari tozalanadi, uzoq ishlatilmagan suhbat holatlari chiqariladi.
+    hard: bundan tashqari xotiradagi holat diskka yoziladi, faol bo'lmagan
+    foydalanuvchilar odatdagidan oldin arxivlanadi va past ustuvorlikdagi
+    yangilanishlar (obuna bo'lmaganlarning /start i, xizmat yangilanishlari)
+    tashlab yuboriladi. RSS soft dan pastga tushganda tashlab yuborish to'xtaydi.
+    """
+
+    def __init__(self, soft_bytes: int, hard_bytes: int, cooldown: int, idle_state_age: int):
+        self.soft_bytes = soft_bytes
+        self.hard_bytes = hard_bytes
+        self.cooldown = cooldown
+        self.idle_state_age = idle_state_age
+        self.rss: Optional[int] = None
+        self.level = "ok"
+        self.shedding = False
+        self.shed_total = 0
+        self.checks = 0
+        # amal -> necha marta bajarilgan / jami bo'shatilgan (yozuv yoki bayt)
+        self.actions: Counter = Counter()
+        self.freed: Counter = Counter()
+        self.history: deque = deque(maxlen=20)
+        self._last_pass = {"soft": 0.0, "hard": 0.0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.soft_bytes or self.hard_bytes)
+
+    def _level(self, rss: int) -> str:
+        if self.hard_bytes and rss >= self.hard_bytes:
+            return "hard"
+        if self.soft_bytes and rss >= self.soft_bytes:
+            return "soft"
+        return "ok"
+
+    def check(self) -> str:
+        """RSS ni o'lchash va kerak bo'lsa amallarni bajarish (fon vazifasidan)"""
+        rss = read_rss_bytes()
+        if rss is None:
+            return self.level
+        self.rss = rss
+        self.checks += 1
+        level = self._level(rss)
+        
+        if level != self.level:
+            log = logger.info if level == "ok" else logger.warning
+            log(f"🧠 Xotira holati: {self.level} -> {level} (RSS {rss // 2**20} MB)")
+            self.level = level
+        
+        if level == "ok":
+            if self.shedding:
+                self.shedding = False
+                logger.info("🧠 Past ustuvorlikdagi yangilanishlar yana qabul qilinmoqda")
+            return level
+        
+        now = time.monotonic()
+        if now - self._last_pass[level] >= self.cooldown:
+            self._last_pass[level] = now
+            done = self.trim()
+            if level == "hard":
+                done.update(self.relieve())
+            self.history.append({
+                "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "level": level,
+                "rss_mb": rss // 2**20,
+                "actions": done
+            })
+            logger.warning(
+                f"🧠 Xotira bosimi ({level}, RSS {rss // 2**20} MB): "
+                + ", ".join(f"{action}={freed}" for action, freed in done.items())
+            )
+        
+        if level == "hard" and not self.shedding:
+            self.shedding = True
+            logger.warning("🧠 Past ustuvorlikdagi yangilanishlar tashlab yuborilmoqda")
+        return level
+
+    def _record(self, done: Dict[str, int], action: str, freed: int):
+        done[action] = done.get(action, 0) + freed
+        self.actions[action] += 1
+        self.freed[action] += freed
+
+    def trim(self) -> Dict[str, int]:
+        """soft amallar: keshlarni qisqartirish"""
+        done: Dict[str, int] = {}
+        for tenant in tenants:
+            with tenant_context(tenant):
+                self._record(done, "membership_cache", tenant.membership.clear())
+                self._record(done, "stats_cache_bytes", tenant.stats_cache.clear())
+                self._record(done, "idle_conversations", tenant.conv_store.evict_idle(self.idle_state_age))
+        
+        self._record(done, "slow_traces", len(slow_traces))
+        slow_traces.clear()
+        self._record(done, "memory_snapshots", memory_snapshots.clear())
+        self._record(done, "gc_objects", gc.collect())
+        release_memory()
+        return done
+
+    def relieve(self) -> Dict[str, int]:
+        """hard amallar: holatni diskka yozish va faol foydalanuvchilarni kamaytirish"""
+        done: Dict[str, int] = {}
+        for tenant in tenants:
+            with tenant_context(tenant):
+                # OOM bo'lsa ham saqlanmagan holat yo'qolmasin
+                flush_tenant(tenant)
+                self._record(done, "flush", 1)
+                if USER_ARCHIVE_AFTER_DAYS > 0:
+                    archived = tenant.db.archive_inactive_users(max(1, USER_ARCHIVE_AFTER_DAYS // 4))
+                    self._record(done, "archived_users", archived)
+        release_memory()
+        return done
+
+    def should_shed(self, update: Update, lane: str) -> bool:
+        """hard holatda past ustuvorlikdagi yangilanishni tashlab yuborish kerakmi"""
+        if not self.shedding or lane not in ("onboarding", "background"):
+            return False
+        if lane == "onboarding":
+            # Obunasi tasdiqlangan foydalanuvchilar xizmat olishda davom etadi
+            user = db.users.get(str(update.effective_user.id))
+            if user and user.get("is_subscribed"):
+                return False
+        self.shed_total += 1
+        return True
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "rss_mb": self.rss // 2**20 if self.rss else None,
+            "soft_mb": self.soft_bytes // 2**20,
+            "hard_mb": self.hard_bytes // 2**20,
+            "level": self.level,
+            "shedding": self.shedding,
+            "shed_total": self.shed_total,
+            "checks": self.checks,
+            "actions": dict(self.actions),
+            "freed": dict(self.freed),
+            "history": list(self.history)
+        }
+
+async def memory_governor_loop():
+    """RSS ni davriy tekshirish (fon vazifasi, barcha botlar uchun bitta)"""
+    while True:
+        await asyncio.sleep(MEMORY_CHECK_INTERVAL)
+        try:
+            memory_governor.check()
+        except Exception as e:
+            logger.error(f"Xotira nazoratida xato: {e}")
+
+# ========================== STATISTIKA KESHI ==========================
+class StatsCache:
+    """/stats javobining tayyor snapshoti
+    
+    Snapshot hisoblanadigan to'plamlar o'zgarganda (stats_key: kinolar,
+    kanallar, foydalanuvchilar, adminlar soni va a'zolik hodisalari) yoki
+    TTL o'tganda qayta hisoblanadi. Har bir xabarda o'zgaradigan maydonlar
+    (flood, navbatlar, xotira ...) ETag ga kirmaydi: ETag faqat barqaror
+    maydonlardan olinadi, shuning uchun ular o'zgarmasa 304 qaytariladi.
+    """
+
+    # ETag hisoblanadigan maydonlar (build_stats() natijasidan)
+    STABLE_FIELDS = ("bot", "movies_count", "channels_count", "users_count", "users_hot", "admins_count", "activity")
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self.body: bytes = b""
+        self.etag = ""
+        self.built_at = 0.0
+        self.key: Optional[Tuple] = None
+        self.builds = 0
+        self.not_modified = 0
+
+    async def get(self, build, key: Tuple) -> Tuple[bytes, str]:
+        """Snapshotni olish; build() bot loopida bajariladi (to'plamlar shu yerda o'zgaradi)"""
+        if key != self.key or time.monotonic() - self.built_at >= self.ttl:
+            # Xato bo'lsa eski snapshot va ETag o'zgarmaydi
+            stats = await run_on_bot_loop(build)
+            self.body = json.dumps(stats, ensure_ascii=False, default=str).encode('utf-8')
+            stable = json.dumps(
+                {field: stats.get(field) for field in self.STABLE_FIELDS},
+                ensure_ascii=False, default=str, sort_keys=True
+            ).encode('utf-8')
+            # Zaif ETag: tezkor o'zgaruvchi maydonlar farq qilishi mumkin
+            self.etag = 'W/"' + hashlib.sha1(stable).hexdigest()[:16] + '"'
+            self.built_at = time.monotonic()
+            self.key = key
+            self.builds += 1
+        return self.body, self.etag
+
+    def max_age(self) -> int:
+        return max(0, int(self.ttl - (time.monotonic() - self.built_at)))
+
+    def clear(self) -> int:
+        """Snapshotni tashlab yuborish (keyingi so'rovda qayta quriladi), bo'shagan baytlar"""
+        freed = len(self.body)
+        self.body = b""
+        self.key = None
+        return freed
+
+# ========================== USTUVORLIK NAVBATLARI ==========================
+class LaneFull(Exception):
+    """Navbat chegarasiga yetgan - yangilanish tashlab yuboriladi"""
+
+class UpdateLane:
+    """Bitta ustuvorlik navbati: vazn, ulush, kutayotganlar va kechikish namunalari"""
+
+    def __init__(self, name: str, weight: int, max_queue: int, window: int):
+        self.name = name
+        self.weight = weight
+        self.max_queue = max_queue
+        self.share = 1  # LaneScheduler tomonidan hisoblanadi
+        self.running = 0
+        self.pending = 0  # kirgan, lekin hali ishga tushmagan
+        self.waiting: deque = deque()  # slot kutayotgan futurelar
+        self.vtime = 0.0
+        self.processed = 0
+        self.dropped = 0
+        self.waits: deque = deque(maxlen=window)  # navbat slot berguncha kutish (soniya)
+        self.serial_waits: deque = deque(maxlen=window)  # foydalanuvchi qulfini kutish (soniya)
+        self.totals: deque = deque(maxlen=window)  # kirishdan tugashgacha (soniya)
+
+    def stats(self) -> Dict:
+        def percentiles(samples: deque) -> Dict:
+            values = sorted(samples)
+            def percentile(p: float) -> Optional[float]:
+                if not values:
+                    return None
+                return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 1)
+            return {"p50_ms": percentile(0.5), "p95_ms": percentile(0.95), "p99_ms": percentile(0.99)}
+        
+        return {
+            "weight": self.weight,
+            "share": self.share,
+            "running": self.running,
+            "waiting": self.pending,
+            "max_queue": self.max_queue,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "wait": percentiles(self.waits),
+            "serial_wait": percentiles(self.serial_waits),
+            "total": percentiles(self.totals)
+        }
+
+class LaneScheduler:
+    """Yangilanishlarni ustuvorlik navbatlari bo'yicha vaznli adolatli rejalashtirish
+    
+    Umumiy `concurrency` ta slot navbatlar orasida vaznlariga qarab
+    bo'linadi (share). Bo'sh slot keyingi kutayotgan navbatga virtual vaqt
+    bo'yicha beriladi (WFQ): vazni katta navbat tez-tez xizmat oladi, lekin
+    kichik vaznli navbat ham och qolmaydi. Boshqa navbatlar o'z ulushini
+    ishlatmayotgan bo'lsa, navbat ulushidan ko'proq slot olishi mumkin.
+    Bitta foydalanuvchining yangilanishlari kelish tartibida, ketma-ket
+    qayta ishlanadi.
+    """
+
+    def __init__(self, concurrency: int, lanes: List[Tuple[str, int, int]], window: int):
+        self.concurrency = concurrency
+        self.lanes: Dict[str, UpdateLane] = {
+            name: UpdateLane(name, weight, max_queue, window) for name, weight, max_queue in lanes
+        }
+        total_weight = sum(lane.weight for lane in self.lanes.values())
+        for lane in self.lanes.values():
+            lane.share = max(1, concurrency * lane.weight // total_weight)
+        self.running = 0
+        self.vtime = 0.0
+        # Foydalanuvchi -> [qulf, foydalanuvchilar soni]
+        self._serial: Dict[int, list] = {}
+
+    @property
+    def capacity(self) -> int:
+        """Bir vaqtda qabul qilinadigan eng ko'p yangilanish (ishlayotgan + navbatdagi)"""
+        return self.concurrency + sum(lane.max_queue for lane in self.lanes.values())
+
+    def waiting(self) -> int:
+        return sum(lane.pending for lane in self.lanes.values())
+
+    def _dispatch(self):
+        """Bo'sh slotlarni kutayotgan navbatlarga berish"""
+        while self.running < self.concurrency:
+            candidates = [lane for lane in self.lanes.values() if lane.waiting]
+            if not candidates:
+                return
+            # Avval ulushidan kam ishlatayotgan navbatlar, bo'lmasa - barchasi
+            candidates = [lane for lane in candidates if lane.running < lane.share] or candidates
+            lane = min(candidates, key=lambda l: (max(l.vtime, self.vtime), -l.weight))
+            future = lane.waiting.popleft()
+            if future.done():
+                continue  # bekor qilingan
+            start = max(lane.vtime, self.vtime)
+            lane.vtime = start + 1 / lane.weight
+            self.vtime = start
+            self.running += 1
+            lane.running += 1
+            future.set_result(None)
+
+    def _release(self, lane: UpdateLane):
+        self.running -= 1
+        lane.running -= 1
+        self._dispatch()
+
+    async def _acquire(self, lane: UpdateLane):
+        future = asyncio.get_running_loop().create_future()
+        lane.waiting.append(future)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(lane)  # slot berilgan edi
+            else:
+                future.cancel()
+            raise
+
+    @asynccontextmanager
+    async def slot(self, lane_name: str, key: Optional[int] = None, max_pending: int = 0):
+        """Navbatdan slot olish; navbat yoki foydalanuvchi chegarasi to'lgan bo'lsa LaneFull
+        
+        max_pending > 0 bo'lsa bitta foydalanuvchi (key) navbatda shuncha
+        yangilanishdan ko'pini ushlab turolmaydi.
+        """
+        lane = self.lanes[lane_name]
+        user_pending = self._serial[key][1] if key in self._serial else 0
+        if lane.pending >= lane.max_queue or (max_pending > 0 and user_pending >= max_pending):
+            lane.dropped += 1
+            raise LaneFull(lane_name)
+        
+        entered = time.perf_counter()
+        lane.pending += 1
+        serial = None
+        if key is not None:
+            serial = self._serial.setdefault(key, [asyncio.Lock(), 0])
+            serial[1] += 1
+        try:
+            if serial is not None:
+                await serial[0].acquire()
+            # Navbat kutishi foydalanuvchi qulfi olingandan keyin boshlanadi:
+            # oldingi yangilanishini kutgan foydalanuvchi navbat kechikishiga qo'shilmaydi
+            queued = time.perf_counter()
+            if serial is not None:
+                lane.serial_waits.append(queued - entered)
+            try:
+                await self._acquire(lane)
+            except BaseException:
+                if serial is not None:
+                    serial[0].release()
+                raise
+        except BaseException:
+            lane.pending -= 1
+            self._forget(key, serial)
+            raise
+        
+        lane.pending -= 1
+        lane.waits.append(time.perf_counter() - queued)
+        try:
+            yield
+        finally:
+            lane.processed += 1
+            lane.totals.append(time.perf_counter() - entered)
+            if serial is not None:
+                serial[0].release()
+            self._forget(key, serial)
+            self._release(lane)
+
+    def _forget(self, key: Optional[int], serial: Optional[list]):
+        if serial is not None:
+            serial[1] -= 1
+            if serial[1] == 0:
+                del self._serial[key]
+
+    def stats(self) -> Dict:
+        return {
+            "concurrency": self.concurrency,
+            "running": self.running,
+            "lanes": {name: lane.stats() for name, lane in self.lanes.items()}
+        }
+
+def parse_lanes(spec: str) -> List[Tuple[str, int, int]]:
+    """UPDATE_LANES qatorini (nom:vazn:chegara,...) o'qish"""
+    lanes = []
+    for item in spec.split(","):
+        name, weight, max_queue = item.strip().split(":")
+        lanes.append((name, max(1, int(weight)), int(max_queue)))
+    return lanes
+
+# ========================== SO'ROVLAR CHEKLOVI ==========================
+class SharedRateLimiter(BaseRateLimiter):
+    """Barcha botlar uchun bitta Bot API cheklovi
+    
+    Har bir bot uchun umumiy (RATE_LIMIT_PER_BOT) va har bir chatga
+    yuboriladigan xabarlar uchun (RATE_LIMIT_PER_CHAT) token bucket. Token yetmasa so'rov navbatdagi
+    bo'sh vaqtgacha kutadi; bitta loopda ishlagani uchun qulf kerak emas.
+    """
+
+    IDLE_TTL = 60  # soniya, ishlatilmagan chat bucketlari tozalanadi
+    # Faqat chatga xabar yozadigan metodlar chat bucketidan o'tadi; getChatMember,
+    # getChat, getFile kabi o'qish so'rovlari (kanal id si bilan ham) faqat bot bucketida
+    CHAT_ENDPOINTS = ("send", "copymessage", "forwardmessage", "editmessage")
+
+    def __init__(self, per_bot: float, per_chat: float, chat_burst: int):
+        self.per_bot = per_bot
+        self.per_chat = per_chat
+        self.chat_burst = chat_burst
+        # kalit -> (tokenlar, oxirgi yangilanish); manfiy tokenlar - navbatdagi so'rovlar
+        self._buckets: Dict[Tuple, Tuple[float, float]] = {}
+        self._paused_until: Dict[int, float] = {}
+        self.delayed_total = 0
+        self.retry_after_total = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _reserve(self, key: Tuple, rate: float, burst: float) -> float:
+        """Bitta token band qilish va kutish kerak bo'lgan vaqtni qaytarish"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate) - 1
+        self._buckets[key] = (tokens, now)
+        return -tokens / rate if tokens < 0 else 0.0
+
+    def _prune(self):
+        now = time.monotonic()
+        self._buckets = {
+            key: (tokens, updated) for key, (tokens, updated) in self._buckets.items()
+            if tokens < 0 or now - updated < self.IDLE_TTL
+        }
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        # callback - ExtBot ning bog'langan metodi, bot shu orqali aniqlanadi
+        bot_key = id(getattr(callback, "__self__", None))
+        delay = max(0.0, self._paused_until.get(bot_key, 0) - time.monotonic())
+        
+        chat_id = data.get("chat_id")
+        if chat_id is not None and self.per_chat > 0 and endpoint.lower().startswith(self.CHAT_ENDPOINTS):
+            delay = max(delay, self._reserve(("chat", bot_key, chat_id), self.per_chat, self.chat_burst))
+        if self.per_bot > 0:
+            delay = max(delay, self._reserve(("bot", bot_key), self.per_bot, self.per_bot))
+        if len(self._buckets) > 10000:
+            self._prune()
+        
+        if delay > 0:
+            self.delayed_total += 1
+            await asyncio.sleep(delay)
+        try:
+            return await callback(*args, **kwargs)
+        except RetryAfter as e:
+            # Telegram cheklovi: shu botning keyingi so'rovlari ham kutadi
+            self.retry_after_total += 1
+            self._paused_until[bot_key] = time.monotonic() + e.retry_after
+            raise
+
+    def stats(self) -> Dict:
+        return {
+            "buckets": len(self._buckets),
+            "delayed_total": self.delayed_total,
+            "retry_after_total": self.retry_after_total
+        }
+
+# ========================== BOTLAR (TENANTLAR) ==========================
+class LeaderLock:
+    """Umumiy papkadagi jarayonlardan bittasini yetakchi qilish (bloklanmaydigan fcntl qulfi)
+    
+    Qulf jarayon tugaguncha (yoki release() gacha) ushlab turiladi; yetakchi
+    jarayon to'xtasa OS qulfni bo'shatadi va boshqa jarayon uni oladi.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._file = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._file is not None
+
+    def try_acquire(self) -> bool:
+        if self._file is not None:
+            return True
+        lock_file = open(self.filename, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        return True
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+class Tenant:
+    """Bitta bot: token, EGA admin, alohida ma'lumotlar papkasi va unga tegishli holat"""
+
+    def __init__(self, name: str, token: str, owner_id: int, data_dir: str, webhook_secret: str = ""):
+        self.name = name
+        self.token = token
+        self.webhook_secret = webhook_secret
+        self.db = Database(data_dir, owner_id)
+        self.conv_store = ConversationStore(
+            os.path.join(data_dir, CONV_STATE_FILE) if CONV_STATE_FILE else None,
+            CONV_STATE_TTL, CONV_STATE_MAX, shared=SHARED_STORE,
+            # Oddiy foydalanuvchilar adminning yuklash/o'chirish oqimini siqib chiqarmaydi
+            protected=self.db.is_admin
+        )
+        self.membership = MembershipCache(ttl=MEMBERSHIP_SHARED_TTL if SHARED_STORE else MEMBERSHIP_CACHE_TTL)
+        self.flood_control = FloodControl(FLOOD_RATE, FLOOD_BURST, FLOOD_COOLDOWN, FLOOD_MAX_COOLDOWN, FLOOD_IDLE_TTL)
+        self.error_digest = ErrorDigest()
+        self.file_checker = FileHealthChecker(
+            os.path.join(data_dir, FILE_CHECK_STATE) if FILE_CHECK_STATE else None,
+            FILE_CHECK_RATE, FILE_CHECK_CONCURRENCY
+        )
+        self.stats_cache = StatsCache(STATS_CACHE_TTL)
+        self.lanes = (
+            LaneScheduler(UPDATE_CONCURRENCY, parse_lanes(UPDATE_LANES), LANE_LATENCY_WINDOW)
+            if UPDATE_CONCURRENCY > 0 else None
+        )
+        # Umumiy papkada yakka fon vazifalarini qaysi jarayon bajarishi (bitta jarayonda kerak emas)
+        self.leader = LeaderLock(os.path.join(data_dir, LEADER_LOCK_FILE)) if SHARED_STORE else None
+        self.application: Optional[Application] = None
+        self.background_tasks: List[asyncio.Task] = []
+
+    @property
+    def runs_singletons(self) -> bool:
+        """Bu jarayon yakka fon vazifalarini bajaradimi"""
+        return self.leader is None or self.leader.is_leader
+
+    @property
+    def webhook_path(self) -> str:
+        # Bitta bot rejimida eski /webhook manzili saqlanadi
+        return "/webhook" if self.name == DEFAULT_TENANT else f"/webhook/{self.name}"
+
+DEFAULT_TENANT = "default"
+
+# Handlerlar va fon vazifalari qaysi bot uchun ishlayotgani
+current_tenant: ContextVar[Optional[Tenant]] = ContextVar("current_tenant", default=None)
+
+class TenantProxy:
+    """Joriy botning obyektiga yo'naltiruvchi proksi (db, conv_store ...)
+    
+    Handlerlar global nomlardan foydalanishda davom etadi, har bir
+    yangilanish esa o'z botining holatini ko'radi.
+    """
+
+    __slots__ = ("_attr",)
+
+    def __init__(self, attr: str):
+        object.__setattr__(self, "_attr", attr)
+
+    def __getattr__(self, name: str):
+        tenant = current_tenant.get()
+        if tenant is None:
+            raise RuntimeError("Bot konteksti o'rnatilmagan (init_state() chaqirilmagan)")
+        return getattr(getattr(tenant, self._attr), name)
+
+    def __setattr__(self, name: str, value):
+        # Masalan: membership.events += 1
+        setattr(getattr(current_tenant.get(), self._attr), name, value)
+
+@contextmanager
+def tenant_context(tenant: Tenant):
+    """Blok ichida (va unda yaratilgan vazifalarda) joriy botni o'rnatish"""
+    tenant_token = current_tenant.set(tenant)
+    bot_token = log_bot.set(tenant.name if len(tenants) > 1 else None)
+    try:
+        yield
+    finally:
+        log_bot.reset(bot_token)
+        current_tenant.reset(tenant_token)
+
+# Barcha botlar (init_state() da yuklanadi)
+tenants: List[Tenant] = []
+
+# Joriy botning holati (main() -> init_state() dan keyin ishlaydi, import paytida diskka tegilmaydi)
+db = TenantProxy("db")
+conv_store = TenantProxy("conv_store")
+membership = TenantProxy("membership")
+flood_control = TenantProxy("flood_control")
+error_digest = TenantProxy("error_digest")
+file_checker = TenantProxy("file_checker")
+
+# Butun jarayon uchun umumiy obyektlar
+memory_snapshots = MemorySnapshots(MEMORY_SNAPSHOT_KEEP)
+loop_watchdog = LoopWatchdog(LOOP_LAG_INTERVAL, LOOP_LAG_THRESHOLD_MS, LOOP_LAG_WINDOW, LOOP_BLOCK_STACKS)
+rate_limiter = SharedRateLimiter(RATE_LIMIT_PER_BOT, RATE_LIMIT_PER_CHAT, RATE_LIMIT_CHAT_BURST)
+memory_governor = MemoryGovernor(
+    MEMORY_SOFT_LIMIT_MB * 2**20, MEMORY_HARD_LIMIT_MB * 2**20, MEMORY_ACTION_COOLDOWN, MEMORY_IDLE_STATE_AGE
+)
+
+def load_tenant_configs() -> List[Dict]:
+    """BOTS_CONFIG faylidan botlar ro'yxati, berilmagan bo'lsa BOT_TOKEN/OWNER_ID dan bitta bot
+    
+    Fayl ko'rinishi (bots.example.json):
+    [{"name": "kino1", "token": "...", "owner_id": 123, "data_dir": "bots/kino1"}, ...]
+    """
+    if not BOTS_CONFIG:
+        return [{"name": DEFAULT_TENANT, "token": BOT_TOKEN, "owner_id": OWNER_ID, "data_dir": "."}]
+    
+    configs = read_data_file(BOTS_CONFIG)
+    if not isinstance(configs, list) or not configs:
+        raise ValueError(f"{BOTS_CONFIG}: botlar ro'yxati bo'sh yoki noto'g'ri")
+    names = set()
+    for config in configs:
+        name = str(config.get("name", ""))
+        if not re.fullmatch(r"[A-Za-z0-9_-]+", name) or name in names:
+            raise ValueError(f"{BOTS_CONFIG}: bot nomi noto'g'ri yoki takroriy: {name!r}")
+        if not config.get("token") or not config.get("owner_id"):
+            raise ValueError(f"{BOTS_CONFIG}: {name} uchun token va owner_id kerak")
+        names.add(name)
+    return configs
+
+def init_state():
+    """Barcha botlarning diskdagi ma'lumotlarini yuklash"""
+    tenants.clear()
+    for config in load_tenant_configs():
+        tenants.append(Tenant(
+            config["name"],
+            config["token"],
+            int(config["owner_id"]),
+            config.get("data_dir") or os.path.join("bots", config["name"]),
+            config.get("webhook_secret", WEBHOOK_SECRET)
+        ))
+    # Asosiy thread konteksti (skriptlar va bitta bot rejimi uchun) - birinchi bot
+    current_tenant.set(tenants[0])
+    mark_startup("state")
+    logger.info(f"Botlar: {', '.join(tenant.name for tenant in tenants)}")
+
+# ========================== WEB API ==========================
+
+def build_stats(tenant: Tenant) -> Dict:
+    """Bot statistikasi - bot loopida chaqiriladi (run_on_bot_loop), chunki to'plamlar o'sha yerda o'zgaradi"""
+    # Ichki chaqiruvlar (db, membership ...) uchun bot konteksti o'rnatiladi
+    with tenant_context(tenant):
+        return {
+            "bot": tenant.name,
+            "movies_count": len(tenant.db.movies),
+            "channels_count": len(tenant.db.channels),
+            "users_count": tenant.db.count_users(),
+            "users_hot": len(tenant.db.users),
+            "cold_users": tenant.db.cold_users.stats(),
+            "admins_count": len(tenant.db.get_admins()),
+            "conversation_state": tenant.conv_store.memory_usage(),
+            "membership": tenant.membership.stats(),
+            "flood": tenant.flood_control.stats(),
+            "errors": tenant.error_digest.stats(),
+            "file_check": tenant.file_checker.stats(),
+            "loop_lag": loop_watchdog.stats(),
+            "rate_limiter": rate_limiter.stats(),
+            "memory": memory_governor.stats(),
+            "lanes": tenant.lanes.stats() if tenant.lanes else None,
+            "startup": startup_report,
+            "activity": tenant.db.analytics.summary()
+        }
+
+def stats_key(tenant: Tenant) -> Tuple:
+    """/stats keshi kaliti: faqat hisoblanadigan to'plamlar o'zgarganda o'zgaradi"""
+    tenant_db = tenant.db
+    return (
+        len(tenant_db.movies), len(tenant_db.channels), tenant_db.count_users(),
+        len(tenant_db.admins), tenant.membership.events
+    )
+
+# Eksport ustunlari (CSV uchun)
+MOVIE_EXPORT_FIELDS = ["code", "file_id", "file_type", "caption", "uploader_id", "upload_date", "download_count"]
+# last_subscription_check eski yozuvlarda bor (masalan users.json dagi 7557993644); yo'q bo'lsa bo'sh
+USER_EXPORT_FIELDS = ["user_id", "joined_date", "last_activity", "movies_downloaded", "is_subscribed",
+                      "last_subscription_check"]
+
+def iter_items(collection: Dict) -> Iterator[Tuple[str, Dict]]:
+    """Lug'at elementlari (kalitlar nusxasi bo'yicha)"""
+    # Bot boshqa threadda lug'atni o'zgartirishi mumkin, shuning uchun kalitlar nusxasi olinadi
+    for key in list(collection.keys()):
+        record = collection.get(key)
+        if record is not None:
+            yield key, record
+
+def iter_export(items: Iterator[Tuple[str, Dict]], key_field: str, date_field: str, since: Optional[str],
+                fmt: str, fields: List[str], compress: bool) -> Iterator[bytes]:
+    """Ma'lumotlarni bo'laklab NDJSON/CSV ko'rinishida oqim qilish
+    
+    Yozuvlar bittadan olinadi va bo'laklab serializatsiya qilinadi,
+    shuning uchun xotira hajmi doimiy qoladi.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None  # 31 = gzip formati
+    
+    def emit(text: str) -> bytes:
+        data = text.encode('utf-8')
+        return compressor.compress(data) if compressor else data
+    
+    buffer = io.StringIO()
+    writer = None
+    if fmt == "csv":
+        writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+    
+    rows = 0
+    for key, record in items:
+        if since and record.get(date_field, "") < since:
+            continue
+        
+        row = {key_field: key, **record}
+        if writer:
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(row, ensure_ascii=False))
+            buffer.write("\n")
+        rows += 1
+        
+        if rows % EXPORT_CHUNK_ROWS == 0:
+            chunk = emit(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
+            if chunk:
+                yield chunk
+    
+    tail = emit(buffer.getvalue())
+    if compressor:
+        tail += compressor.flush()
+    if tail:
+        yield tail
+
+# Botlar event loopi (web server threadidan murojaat qilish uchun)
+bot_loop: Optional[asyncio.AbstractEventLoop] = None
+# Web server event loopi (bot threadidan murojaat qilish uchun)
+web_loop: Optional[asyncio.AbstractEventLoop] = None
+
+async def run_on_bot_loop(func, timeout: float = BOT_LOOP_CALL_TIMEOUT):
+    """Bot to'plamlarini o'qiydigan funksiyani bot loopida bajarib natijasini olish
+    
+    db.users, suhbat holati, flood bucketlari kabi lug'atlar faqat bot loopida
+    o'zgaradi; ularni web threadda aylanib chiqish "dictionary changed size
+    during iteration" xatosiga olib keladi. Bot loopi ishlamayotgan bo'lsa
+    (yoki chaqiruv o'sha loopdan bo'lsa) funksiya shu yerning o'zida bajariladi.
+    """
+    loop = bot_loop
+    if loop is None or not loop.is_running() or loop is asyncio.get_running_loop():
+        return func()
+    
+    async def call():
+        return func()
+    future = asyncio.run_coroutine_threadsafe(call(), loop)
+    return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+
+MEMORY_GROUPS = ("lineno", "filename", "traceback")
+
+def create_web_app():
+    """FastAPI ilovasini yaratish (fastapi faqat web server kerak bo'lganda import qilinadi)"""
+    from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request
+    from fastapi.responses import JSONResponse, Response, StreamingResponse
+    
+    web_app = FastAPI()
+    
+    def get_tenant(name: Optional[str]) -> Tenant:
+        """?bot= bo'yicha botni topish (berilmasa - birinchi bot)"""
+        if not tenants:
+            raise HTTPException(status_code=503, detail="Bot ishga tushmagan")
+        if name is None:
+            return tenants[0]
+        for tenant in tenants:
+            if tenant.name == name:
+                return tenant
+        raise HTTPException(status_code=404, detail="Bot topilmadi")
+    
+    @web_app.get("/")
+    async def root():
+        return {"status": "online", "bot": "Kino Bot", "timestamp": datetime.now().isoformat()}
+
+    @web_app.get("/health")
+    async def health_check():
+        return {"status": "healthy", "bot": "running"}
+
+    @web_app.get("/stats")
+    async def get_stats(bot: Optional[str] = None, if_none_match: Optional[str] = Header(None)):
+        tenant = get_tenant(bot)
+        stats_cache = tenant.stats_cache
+        try:
+            body, etag = await stats_cache.get(functools.partial(build_stats, tenant), stats_key(tenant))
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Bot javob bermayapti")
+        headers = {"ETag": etag, "Cache-Control": f"public, max-age={stats_cache.max_age()}"}
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+            stats_cache.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type="application/json", headers=headers)
+
+    @web_app.get("/ready")
+    async def readiness_check():
+        """Bot haqiqatan ishlayotganini tekshirish (fly.io health check uchun)"""
+        now = time.time()
+        problems = []
+        if not tenants:
+            problems.append("bot ishga tushmagan")
+        
+        bots = {}
+        for tenant in tenants:
+            # Har bir bot alohida tekshiriladi, bittasi ishlamasa ham instansiya tayyor emas
+            tenant_problems, queue_depth, update_age = [], None, None
+            app = tenant.application
+            if app is None or not app.running:
+                tenant_problems.append("bot ishga tushmagan")
+            else:
+                # Navbatlar yoqilgan bo'lsa yangilanishlar PTB navbatidan darhol olinib, navbatlarda kutadi
+                queue_depth = app.update_queue.qsize() + (tenant.lanes.waiting() if tenant.lanes else 0)
+                if app.last_update_at:
+                    update_age = round(now - app.last_update_at, 1)
+                if not WEBHOOK_URL and not (app.updater and app.updater.running):
+                    tenant_problems.append("polling to'xtagan")
+                if queue_depth > READY_MAX_QUEUE:
+                    tenant_problems.append("navbat to'lib ketgan")
+            if READY_MAX_UPDATE_AGE and update_age is not None and update_age > READY_MAX_UPDATE_AGE:
+                tenant_problems.append("yangilanishlar kelmayapti")
+            
+            problems.extend(tenant_problems if len(tenants) == 1 else [f"{tenant.name}: {p}" for p in tenant_problems])
+            bots[tenant.name] = {
+                "last_update_age": update_age,
+                "queue_depth": queue_depth,
+                "last_save_age": round(now - tenant.db.last_save, 1) if tenant.db.last_save else None,
+                "stats_cache": {"builds": tenant.stats_cache.builds, "not_modified": tenant.stats_cache.not_modified}
+            }
+        
+        if len(bots) == 1:
+            # Bitta bot rejimida javob avvalgi ko'rinishda qoladi
+            body = {"ready": not problems, "problems": problems, **next(iter(bots.values()))}
+        else:
+            body = {"ready": not problems, "problems": problems, "bots": bots}
+        return JSONResponse(body, status_code=200 if not problems else 503, headers={"Cache-Control": "no-store"})
+
+    def require_api_token(
+        x_api_token: Optional[str] = Header(None),
+        token: Optional[str] = Query(None)
+    ):
+        """Himoyalangan endpointlar uchun tokenni tekshirish"""
+        supplied = x_api_token or token or ""
+        if not API_TOKEN or not hmac.compare_digest(supplied, API_TOKEN):
+            raise HTTPException(status_code=401, detail="Token noto'g'ri")
+
+    def normalize_since(since: Optional[str]) -> Optional[str]:
+        """since= qiymatini saqlangan sana formatiga keltirish"""
+        if not since:
+            return None
+        try:
+            return datetime.fromisoformat(since).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="since formati: YYYY-MM-DD yoki YYYY-MM-DDTHH:MM:SS")
+
+    def export_response(name: str, items: Iterator[Tuple[str, Dict]], key_field: str, date_field: str,
+                        fields: List[str], fmt: str, compress: bool, since: Optional[str]) -> StreamingResponse:
+        """Eksport uchun StreamingResponse yaratish"""
+        if fmt not in ("ndjson", "csv"):
+            raise HTTPException(status_code=400, detail="format: ndjson yoki csv")
+        
+        since = normalize_since(since)
+        filename = f"{name}.{fmt}" + (".gz" if compress else "")
+        media_type = "application/gzip" if compress else ("text/csv" if fmt == "csv" else "application/x-ndjson")
+        
+        # Sinxron generator threadpool da aylantiriladi - event loop bloklanmaydi
+        return StreamingResponse(
+            iter_export(items, key_field, date_field, since, fmt, fields, compress),
+            media_type=media_type,
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        )
+
+    @web_app.get("/export/movies", dependencies=[Depends(require_api_token)])
+    def export_movies(format: str = "ndjson", gzip: bool = False, since: Optional[str] = None,
+                      bot: Optional[str] = None):
+        db = get_tenant(bot).db
+        return export_response("movies", iter_items(db.movies), "code", "upload_date",
+                               MOVIE_EXPORT_FIELDS, format, gzip, since)
+
+    @web_app.get("/export/users", dependencies=[Depends(require_api_token)])
+    def export_users(format: str = "ndjson", gzip: bool = False, since: Optional[str] = None,
+                     bot: Optional[str] = None):
+        db = get_tenant(bot).db
+        # Faol foydalanuvchilar, so'ng arxivdagilar
+        users = chain(iter_items(db.users), db.cold_users.iter_records(exclude=db.users))
+        return export_response("users", users, "user_id", "last_activity",
+                               USER_EXPORT_FIELDS, format, gzip, since)
+
+    @web_app.on_event("startup")
+    async def remember_web_loop():
+        global web_loop
+        web_loop = asyncio.get_running_loop()
+
+    async def forward_update(tenant: Tenant, request: Request, secret: Optional[str]):
+        """Telegram webhook yangilanishini botning navbatiga uzatish"""
+        if tenant.webhook_secret and not hmac.compare_digest(secret or "", tenant.webhook_secret):
+            raise HTTPException(status_code=401, detail="Token noto'g'ri")
+        app = tenant.application
+        if app is None or bot_loop is None or not app.running:
+            # Telegram 503 dan keyin yangilanishni keyinroq qayta yuboradi
+            raise HTTPException(status_code=503, detail="Bot ishlamayapti")
+        
+        update = Update.de_json(await request.json(), app.bot)
+        # Web server alohida threadda ishlaydi, navbat esa bot loopiga tegishli
+        asyncio.run_coroutine_threadsafe(app.update_queue.put(update), bot_loop)
+        return {"ok": True}
+
+    @web_app.post("/webhook")
+    async def telegram_webhook(request: Request, x_telegram_bot_api_secret_token: Optional[str] = Header(None)):
+        return await forward_update(get_tenant(DEFAULT_TENANT if len(tenants) > 1 else None),
+                                    request, x_telegram_bot_api_secret_token)
+
+    @web_app.post("/webhook/{name}")
+    async def tenant_webhook(name: str, request: Request,
+                             x_telegram_bot_api_secret_token: Optional[str] = Header(None)):
+        return await forward_update(get_tenant(name), request, x_telegram_bot_api_secret_token)
+
+    @web_app.get("/traces/slow", dependencies=[Depends(require_api_token)])
+    async def get_slow_traces(limit: int = Query(SLOW_TRACE_BUFFER, ge=1)):
+        """Oxirgi sekin yangilanishlar (eng yangisi birinchi)"""
+        traces = list(slow_traces)[-limit:]
+        return {"threshold_ms": SLOW_UPDATE_THRESHOLD_MS, "traces": traces[::-1]}
+
+    @web_app.get("/debug/loop", dependencies=[Depends(require_api_token)])
+    async def get_loop_lag(limit: int = Query(LOOP_BLOCK_STACKS, ge=1)):
+        """Loop kechikishi foizliklari va oxirgi bloklovchi steklar (eng yangisi birinchi)"""
+        blocks = list(loop_watchdog.blocks)[-limit:]
+        return {"lag": loop_watchdog.stats(), "blocks": blocks[::-1]}
+
+    @web_app.get("/debug/profile", dependencies=[Depends(require_api_token)])
+    async def get_profile(seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS), format: str = "collapsed"):
+        """Jarayonni N soniya profiling qilish (collapsed yoki pstats)"""
+        if format not in ("collapsed", "pstats"):
+            raise HTTPException(status_code=400, detail="format: collapsed yoki pstats")
+        try:
+            data, filename = await profile_process(seconds, format)
+        except RuntimeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        return Response(
+            content=data,
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        )
+
+    @web_app.post("/debug/memory/start", dependencies=[Depends(require_api_token)])
+    def memory_start(frames: int = Query(1, ge=1, le=25)):
+        """tracemalloc ni ishga tushirish (frames - saqlanadigan stek chuqurligi)"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        return {"tracing": True, "frames": tracemalloc.get_traceback_limit()}
+
+    @web_app.post("/debug/memory/stop", dependencies=[Depends(require_api_token)])
+    def memory_stop():
+        """tracemalloc ni to'xtatish va snapshotlarni tozalash"""
+        tracemalloc.stop()
+        memory_snapshots.clear()
+        return {"tracing": False}
+
+    @web_app.post("/debug/memory/snapshot", dependencies=[Depends(require_api_token)])
+    async def memory_snapshot(group: str = "lineno", limit: int = Query(20, ge=1, le=200)):
+        """Snapshot olish va eng katta joylarni qaytarish"""
+        if group not in MEMORY_GROUPS:
+            raise HTTPException(status_code=400, detail=f"group: {', '.join(MEMORY_GROUPS)}")
+        try:
+            # To'plamlar bot loopida o'lchanadi, og'ir tracemalloc snapshoti - alohida threadda
+            collections = await run_on_bot_loop(memory_collections)
+            record = await asyncio.to_thread(memory_snapshots.take, collections)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Bot javob bermayapti")
+        except RuntimeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "id": record["id"],
+            "taken_at": record["taken_at"],
+            "rss_bytes": record["rss_bytes"],
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "collections": record["collections"],
+            "top": MemorySnapshots.top(record, group, limit)
+        }
+
+    @web_app.get("/debug/memory/diff", dependencies=[Depends(require_api_token)])
+    def memory_diff(base: int, target: Optional[int] = None, group: str = "lineno",
+                    limit: int = Query(20, ge=1, le=200)):
+        """Ikki snapshotni solishtirish (target berilmasa - eng oxirgisi)"""
+        if group not in MEMORY_GROUPS:
+            raise HTTPException(status_code=400, detail=f"group: {', '.join(MEMORY_GROUPS)}")
+        try:
+            return MemorySnapshots.diff(memory_snapshots.get(base), memory_snapshots.get(target), group, limit)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Snapshot topilmadi")
+
+    @web_app.get("/debug/memory/summary", dependencies=[Depends(require_api_token)])
+    async def memory_summary(limit: int = Query(20, ge=1, le=200)):
+        """Joriy xotira holati: RSS, to'plamlar hajmi va obyekt turlari soni"""
+        try:
+            collections = await run_on_bot_loop(memory_collections)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Bot javob bermayapti")
+        type_counts = await asyncio.to_thread(lambda: Counter(type(obj).__name__ for obj in gc.get_objects()))
+        return {
+            "rss_bytes": read_rss_bytes(),
+            "tracing": tracemalloc.is_tracing(),
+            "collections": collections,
+            "object_counts": dict(type_counts.most_common(limit)),
+            "gc_counts": gc.get_count(),
+            "governor": memory_governor.stats()
+        }
+    
+    return web_app
+
+# ========================== FUNKSIYALAR ==========================
+def is_admin(user_id: int) -> bool:
+    """Foydalanuvchi admin ekanligini tekshirish"""
+    return db.is_admin(user_id)
+
+def is_owner(user_id: int) -> bool:
+    """Foydalanuvchi EGA admin ekanligini tekshirish"""
+    return db.is_owner(user_id)
+
+def get_admin_keyboard(user_id: int) -> ReplyKeyboardMarkup:
+    """Admin paneli uchun pastki tugmalar"""
+    if is_owner(user_id):
+        # EGA admin uchun maxsus tugmalar
+        keyboard = [
+            [KeyboardButton("🎬 Kino Yuklash"), KeyboardButton("📢 Kanallarni Ko'rish")],
+            [KeyboardButton("➕ Kanal Qo'shish"), KeyboardButton("➖ Kanal O'chirish")],
+            [KeyboardButton("👑 Adminlarni Boshqarish"), KeyboardButton("📊 Statistika")],
+            [KeyboardButton("📝 Kinolar Ro'yxati"), KeyboardButton("🗑️ Kino O'chirish")],
+            [KeyboardButton("👤 Yuklovchilar"), KeyboardButton("📅 Sana Bo'yicha")],
+            [KeyboardButton("📦 Ommaviy Yuklash"), KeyboardButton("🔙 Asosiy Menyu")]
+        ]
     else:
         # Oddiy admin uchun tugmalar
         keyboard = [
             [KeyboardButton("🎬 Kino Yuklash"), KeyboardButton("📢 Kanallarni Ko'rish")],
             [KeyboardButton("➕ Kanal Qo'shish"), KeyboardButton("➖ Kanal O'chirish")],
             [KeyboardButton("📊 Statistika"), KeyboardButton("📝 Kinolar Ro'yxati")],
-            [KeyboardButton("🗑️ Kino O'chirish"), KeyboardButton("🔙 Asosiy Menyu")]
+            [KeyboardButton("🗑️ Kino O'chirish"), KeyboardButton("📦 Ommaviy Yuklash")],
+            [KeyboardButton("👤 Yuklovchilar"), KeyboardButton("📅 Sana Bo'yicha")],
+            [KeyboardButton("🔙 Asosiy Menyu")]
         ]
     
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=False)
 
+# Yuklovchi/sana bo'yicha ko'rinishlarda ko'rsatiladigan eng ko'p kino
+MOVIE_VIEW_LIMIT = 30
+
+def format_movie_list(title: str, codes: List[str]) -> str:
+    """Kinolar ro'yxati matni (jami soni va yuklab olishlar bilan)"""
+    if not codes:
+        return f"{title}\n\n🎬 Kino topilmadi."
+    
+    downloads = sum(db.movies[code].get("download_count", 0) for code in codes)
+    text_msg = f"{title}\n\n🎬 Kinolar: {len(codes)} ta, 📥 yuklab olishlar: {downloads}\n\n"
+    for idx, code in enumerate(codes[:MOVIE_VIEW_LIMIT], 1):
+        movie_info = db.movies[code]
+        text_msg += f"{idx}. Kod: {code}\n"
+        text_msg += f"   Izoh: {movie_info.get('caption', 'Izohsiz')[:30]}...\n"
+        text_msg += f"   Yuklangan: {movie_info['upload_date']}, yuklab olishlar: {movie_info.get('download_count', 0)}\n\n"
+    if len(codes) > MOVIE_VIEW_LIMIT:
+        text_msg += f"... va yana {len(codes) - MOVIE_VIEW_LIMIT} ta"
+    return text_msg
+
+def parse_date_range(text: str) -> Optional[Tuple[str, Optional[str]]]:
+    """Sana oralig'ini o'qish: "7" (oxirgi 7 kun), "2025-01-01" yoki "2025-01-01 2025-01-31"
+    
+    Natija saqlangan formatda (boshi, oxiri); oxiri None - hozirgacha.
+    """
+    parts = text.split()
+    try:
+        if len(parts) == 1 and parts[0].isdigit():
+            start = datetime.now() - timedelta(days=int(parts[0]))
+            return start.strftime("%Y-%m-%d %H:%M:%S"), None
+        if len(parts) in (1, 2):
+            start = datetime.strptime(parts[0], "%Y-%m-%d").strftime("%Y-%m-%d 00:00:00")
+            end_day = datetime.strptime(parts[-1], "%Y-%m-%d") if len(parts) == 2 else None
+            return start, end_day.strftime("%Y-%m-%d 23:59:59") if end_day else None
+    except ValueError:
+        pass
+    return None
+
 def get_admin_management_keyboard() -> ReplyKeyboardMarkup:
     """Admin boshqaruv uchun pastki tugmalar"""
     keyboard = [
@@ -357,32 +3649,75 @@ def get_subscription_keyboard() -> InlineKeyboardMarkup:
     keyboard.append([InlineKeyboardButton("✅ Obuna bo'ldim", callback_data="check_subscription")])
     return InlineKeyboardMarkup(keyboard)
 
-async def check_user_subscription(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
-    """Foydalanuvchi barcha kanallarga obuna bo'lganligini tekshirish"""
+async def fetch_membership(bot, channel_id: str, user_id: int) -> bool:
+    """get_chat_member orqali a'zolikni tekshirib, keshga yozish"""
+    membership.api_checks += 1
+    chat_member = await bot.get_chat_member(chat_id=channel_id, user_id=user_id)
+    is_member = chat_member.status in MEMBER_STATUSES
+    membership.set_status(channel_id, user_id, is_member)
+    return is_member
+
+async def check_user_subscription(user_id: int, context: ContextTypes.DEFAULT_TYPE, recheck: bool = False) -> bool:
+    """Foydalanuvchi barcha kanallarga obuna bo'lganligini tekshirish
+    
+    Holat avval keshdan olinadi, API faqat noma'lum holatda chaqiriladi.
+    recheck=True bo'lsa "a'zo emas" holatlari API orqali qayta tekshiriladi
+    ("✅ Obuna bo'ldim" tugmasi uchun).
+    """
     channels = db.get_channel_ids()
     
     if not channels:
         return True  # Agar kanal yo'q bo'lsa, tekshirish kerak emas
     
     for channel_id in channels:
-        try:
-            # Kanalga a'zolikni tekshirish
-            chat_member = await context.bot.get_chat_member(
-                chat_id=channel_id,
-                user_id=user_id
-            )
-            
-            # Agar a'zo bo'lmasa yoki chiqib ketgan bo'lsa
-            if chat_member.status not in ['member', 'administrator', 'creator']:
-                return False
-                
-        except Exception as e:
-            logger.error(f"Kanal tekshirishda xato: {e}")
-            # Agar bot kanalda admin bo'lmasa yoki xatolik bo'lsa
-            continue
+        is_member = membership.status(channel_id, user_id)
+        if is_member is True or (is_member is False and not recheck):
+            membership.cache_hits += 1
+        else:
+            try:
+                # Kanalga a'zolikni tekshirish
+                is_member = await fetch_membership(context.bot, channel_id, user_id)
+            except Exception as e:
+                logger.error(f"Kanal tekshirishda xato: {e}")
+                # Agar bot kanalda admin bo'lmasa yoki xatolik bo'lsa
+                continue
+        
+        # Agar a'zo bo'lmasa yoki chiqib ketgan bo'lsa
+        if not is_member:
+            return False
     
     return True
 
+async def membership_bootstrap_loop(bot):
+    """Foydalanuvchilar a'zoligini asta-sekin solishtirish (fon vazifasi)
+    
+    chat_member yangilanishlari o'tkazib yuborilgan bo'lishi mumkin, shuning
+    uchun vaqti-vaqti bilan barcha foydalanuvchilar cheklangan tezlikda
+    tekshiriladi.
+    """
+    delay = 1 / MEMBERSHIP_BOOTSTRAP_RATE
+    while True:
+        membership.retain(db.get_channel_ids())
+        checked = 0
+        
+        for user_id_str in list(db.users.keys()):
+            for channel_id in db.get_channel_ids():
+                while True:
+                    try:
+                        await fetch_membership(bot, channel_id, int(user_id_str))
+                        checked += 1
+                    except RetryAfter as e:
+                        # Telegram cheklovi: kutib, shu foydalanuvchini qayta tekshirish
+                        await asyncio.sleep(e.retry_after)
+                        continue
+                    except Exception as e:
+                        logger.debug(f"A'zolikni tekshirishda xato: {e}")
+                    break
+                await asyncio.sleep(delay)
+        
+        logger.info(f"A'zolik solishtirildi: {checked} ta tekshiruv")
+        await asyncio.sleep(MEMBERSHIP_RECONCILE_INTERVAL)
+
 async def force_subscription_check(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
     """Foydalanuvchini majburiy obuna tekshirish"""
     is_subscribed = await check_user_subscription(user_id, context)
@@ -398,60 +3733,286 @@ async def force_subscription_check(update: Update, context: ContextTypes.DEFAULT
         db.set_user_subscription(user_id, True)
         return True
 
-async def send_movie_to_user(update: Update, context: ContextTypes.DEFAULT_TYPE, movie_data: Dict):
-    """Foydalanuvchiga kino yuborish"""
+def get_bulk_keyboard() -> ReplyKeyboardMarkup:
+    """Ommaviy yuklash rejimi tugmalari"""
+    keyboard = [
+        [KeyboardButton("✅ Yakunlash")],
+        [KeyboardButton("🔙 Bekor qilish")]
+    ]
+    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=False)
+
+def parse_movie_manifest(filename: str, raw: bytes) -> List[Dict]:
+    """CSV yoki JSON manifestdan kinolar ro'yxatini o'qish (code, file_id, caption)"""
+    text = raw.decode('utf-8-sig')
+    
+    if filename.lower().endswith('.json'):
+        data = json.loads(text)
+        # {"kod": {...}} ko'rinishi ham qabul qilinadi
+        if isinstance(data, dict):
+            data = [dict(info, code=code) for code, info in data.items()]
+        rows = data
+    else:
+        rows = list(csv.DictReader(io.StringIO(text)))
+    
+    items = []
+    for row in rows:
+        if not isinstance(row, dict):
+            continue
+        items.append({
+            "code": str(row.get("code") or "").strip(),
+            "file_id": str(row.get("file_id") or "").strip(),
+            "file_type": (row.get("file_type") or "video").strip(),
+            "caption": row.get("caption") or ""
+        })
+    return items
+
+def is_manifest_document(message) -> bool:
+    """Hujjat CSV/JSON manifest ekanligini tekshirish"""
+    document = message.document
+    if not document or not document.file_name:
+        return False
+    return document.file_name.lower().endswith(('.csv', '.json'))
+
+async def send_movie_to_user(update: Update, context: ContextTypes.DEFAULT_TYPE, movie_data: Dict,
+                             movie_code: Optional[str] = None, reply_markup=None):
+    """Foydalanuvchiga kino yuborish (xabar yoki tugma bosilishidan keyin)"""
     file_id = movie_data["file_id"]
     file_type = movie_data["file_type"]
     caption = movie_data.get("caption", "")
+    chat_id = update.effective_chat.id
     
     try:
         if file_type == "video":
-            await context.bot.send_video(chat_id=update.effective_chat.id, video=file_id, caption=caption)
+            await context.bot.send_video(chat_id=chat_id, video=file_id, caption=caption, reply_markup=reply_markup)
         elif file_type == "document":
-            await context.bot.send_document(chat_id=update.effective_chat.id, document=file_id, caption=caption)
+            await context.bot.send_document(chat_id=chat_id, document=file_id, caption=caption, reply_markup=reply_markup)
         elif file_type == "audio":
-            await context.bot.send_audio(chat_id=update.effective_chat.id, audio=file_id, caption=caption)
+            await context.bot.send_audio(chat_id=chat_id, audio=file_id, caption=caption, reply_markup=reply_markup)
         else:
-            await update.message.reply_text("❌ Kino formati noto'g'ri")
+            await context.bot.send_message(chat_id=chat_id, text="❌ Kino formati noto'g'ri")
             return False
         
         return True
         
     except Exception as e:
         logger.error(f"Kino yuborishda xato: {e}")
-        await update.message.reply_text("❌ Kino yuborishda xatolik yuz berdi")
+        # Fayl o'chib ketgan bo'lsa, keyingi so'rovlar unga urinmasligi uchun karantinga olinadi
+        if movie_code and is_dead_file_error(e):
+            db.set_movie_broken(movie_code, str(e))
+        await context.bot.send_message(chat_id=chat_id, text="❌ Kino yuborishda xatolik yuz berdi")
         return False
 
+async def deliver_movie(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, code: str,
+                        reply_markup=None) -> bool:
+    """Obunasi tekshirilgan foydalanuvchiga kod bo'yicha kino yuborish va hisoblagichlarni oshirish"""
+    chat_id = update.effective_chat.id
+    movie_data = db.get_movie(code)
+    
+    if movie_data is None:
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="❌ Kino topilmadi.\nKodni tekshirib, qaytadan urinib ko'ring.",
+            reply_markup=reply_markup
+        )
+        return False
+    if "broken" in movie_data:
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="⚠️ Bu kino vaqtincha mavjud emas. Keyinroq urinib ko'ring.",
+            reply_markup=reply_markup
+        )
+        return False
+    
+    success = await send_movie_to_user(update, context, movie_data, code, reply_markup)
+    if success:
+        db.increment_download_count(code)
+        db.increment_user_downloads(user_id)
+    return success
+
 # ========================== HANDLERLAR ==========================
+def classify_update(update: Update) -> str:
+    """Yangilanishni ustuvorlik navbatiga ajratish (handlerlardan oldin, arzon tekshiruvlar)
+    
+    admin - adminlarning barcha amallari; delivery - kino kodi yoki
+    /start <kod>; onboarding - /start, obuna tekshiruvi va boshqa foydalanuvchi
+    xabarlari; background - kanal a'zoligi va boshqa xizmat yangilanishlari.
+    """
+    user = update.effective_user
+    if user is None or not (update.message or update.callback_query):
+        return "background"
+    if db.is_admin(user.id):
+        return "admin"
+    if update.message and update.message.text:
+        text = update.message.text.strip()
+        if text.startswith("/start "):
+            text = text[len("/start "):].strip()
+        if text in db.movies:
+            return "delivery"
+    return "onboarding"
+
+class KinoApplication(Application):
+    """Yangilanishlarni ustuvorlik navbatlari orqali o'tkazadigan va har biri uchun
+    log konteksti va trace o'rnatadigan Application"""
+
+    # Oxirgi qayta ishlangan yangilanish vaqti (/ready uchun)
+    last_update_at: Optional[float] = None
+
+    # Application qaysi botga tegishli (build_application() da o'rnatiladi)
+    tenant: Optional[Tenant] = None
+
+    async def process_update(self, update: object) -> None:
+        if not isinstance(update, Update):
+            return await super().process_update(update)
+        
+        if self.tenant is not None and current_tenant.get() is not self.tenant:
+            # Handlerlar global db/conv_store orqali shu botning holatini ko'radi
+            with tenant_context(self.tenant):
+                return await self.process_update(update)
+        
+        if not await flood_guard(update):
+            return
+        
+        lane = classify_update(update)
+        if memory_governor.should_shed(update, lane):
+            logger.debug(f"Xotira tanqisligi: yangilanish {update.update_id} ({lane}) tashlab yuborildi")
+            return
+        
+        lanes = self.tenant.lanes if self.tenant is not None else None
+        if lanes is not None:
+            user = update.effective_user
+            try:
+                max_pending = 0 if lane == "admin" else UPDATE_USER_MAX_PENDING  # ommaviy yuklash uchun
+                async with lanes.slot(lane, user.id if user else None, max_pending):
+                    return await self._process_traced(update)
+            except LaneFull:
+                logger.debug(f"{lane} navbati to'lgan, yangilanish {update.update_id} tashlab yuborildi")
+                return
+        await self._process_traced(update)
+
+    async def _process_traced(self, update: Update) -> None:
+        user = update.effective_user
+        user_id = user.id if user else None
+        update_token = log_update_id.set(update.update_id)
+        user_token = log_user_id.set(user_id)
+        mark_startup("first_update")
+        trace = UpdateTrace(update.update_id, user_id)
+        trace_token = current_trace.set(trace)
+        try:
+            if user_id is not None:
+                # Arxivdagi foydalanuvchi yozuvi handlerlardan oldin threadda o'qiladi
+                await db.cold_users.prefetch(str(user_id))
+            await super().process_update(update)
+        finally:
+            self.last_update_at = time.time()
+            finish_trace(trace)
+            current_trace.reset(trace_token)
+            log_update_id.reset(update_token)
+            log_user_id.reset(user_token)
+
+# Cheklovga tushganda bir marta yuboriladigan javob
+FLOOD_REPLY = "⏳ Juda tez yozyapsiz. Biroz kuting va qaytadan urinib ko'ring."
+
+async def flood_guard(update: Update) -> bool:
+    """Spam xabarlarni navbatlardan oldin to'xtatish (True - yangilanish o'tkaziladi)
+    
+    Tekshiruv ustuvorlik navbatiga kirishdan oldin bajariladi, shuning uchun
+    bitta foydalanuvchining spami navbat sig'imini egallab, boshqalarning
+    yangilanishlarini siqib chiqarmaydi.
+    """
+    user = update.effective_user
+    if user is None or not (update.message or update.callback_query):
+        return True
+    if db.is_admin(user.id):
+        return True  # Adminlar cheklanmaydi
+    
+    allowed, warn = flood_control.hit(user.id)
+    if allowed:
+        return True
+    
+    # Ogohlantirish har bir cheklov davrida faqat bir marta yuboriladi
+    if warn:
+        try:
+            if update.callback_query:
+                await update.callback_query.answer(FLOOD_REPLY)
+            else:
+                await update.message.reply_text(FLOOD_REPLY)
+        except Exception as e:
+            logger.debug(f"Flood ogohlantirishini yuborishda xato: {e}")
+    return False
+
+@track_handler
+async def chat_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Kanalga qo'shilish/chiqish yangilanishlari (bot kanalda admin bo'lishi kerak)"""
+    member_update = update.chat_member
+    channel_id = str(member_update.chat.id)
+    if channel_id not in db.get_channels():
+        return
+    
+    new_member = member_update.new_chat_member
+    membership.set_status(channel_id, new_member.user.id, new_member.status in MEMBER_STATUSES)
+    membership.events += 1
+
+async def shared_state_pull(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Boshqa instansiyalardagi o'zgarishlarni olish (SHARED_STORE rejimi)"""
+    db.refresh()
+    if update.effective_user:
+        conv_store.pull(update.effective_user.id)
+
+async def shared_state_push(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Suhbat holatini boshqa instansiyalar uchun yozish (SHARED_STORE rejimi)"""
+    if update.effective_user:
+        conv_store.push(update.effective_user.id)
+
+@track_handler
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """/start komandasi"""
+    """/start komandasi (t.me/bot?start=<kod> havolasi bilan kino darhol yuboriladi)"""
     user_id = update.effective_user.id
-    db.add_user(user_id)
-    db.update_user_activity(user_id)
     
+    # Deep-link: /start <kod>
+    code = context.args[0].strip() if context.args else None
+    
+    # users.json bir marta yoziladi: qo'shish, faollik va obuna holati birga
     if is_admin(user_id):
+        db.touch_user(user_id)
+    else:
+        is_subscribed = await check_user_subscription(user_id, context)
+        db.touch_user(user_id, subscribed=is_subscribed)
+    
+    if code and not is_admin(user_id):
+        if is_subscribed:
+            await deliver_movie(update, context, user_id, code, reply_markup=get_user_keyboard())
+        else:
+            # Obuna tasdiqlanganda (check_subscription tugmasi) kino avtomatik yuboriladi
+            context.user_data['pending_code'] = code
+            await update.message.reply_text(
+                "⚠️ Kinoni olish uchun quyidagi kanallarga obuna bo'ling:",
+                reply_markup=get_subscription_keyboard()
+            )
+        return
+    
+    if code:
+        # Adminlar uchun obuna tekshiruvi kerak emas
+        await deliver_movie(update, context, user_id, code, reply_markup=get_admin_keyboard(user_id))
+    elif is_admin(user_id):
         await update.message.reply_text(
             f"👑 {'EGA Admin' if is_owner(user_id) else 'Admin'} panelga xush kelibsiz!",
             reply_markup=get_admin_keyboard(user_id)
         )
     else:
-        # Oddiy foydalanuvchi uchun
-        is_subscribed = await check_user_subscription(user_id, context)
-        
+        # Oddiy foydalanuvchi uchun (obuna holati yuqorida saqlangan)
         if is_subscribed:
-            db.set_user_subscription(user_id, True)
             await update.message.reply_text(
                 "🎬 Kino botiga xush kelibsiz!\n\n"
                 "Kino olish uchun kodni yuboring.\n",
                 reply_markup=get_user_keyboard()
             )
         else:
-            db.set_user_subscription(user_id, False)
             await update.message.reply_text(
                 "⚠️ Botdan foydalanish uchun quyidagi kanallarga obuna bo'ling:",
                 reply_markup=get_subscription_keyboard()
             )
 
+@track_handler
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Matnli xabarlarni qayta ishlash"""
     user_id = update.effective_user.id
@@ -474,6 +4035,20 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
                 "Kodni yuboring:"
             )
         
+        elif text == "📦 Ommaviy Yuklash":
+            context.user_data.clear()
+            context.user_data['bulk_mode'] = True
+            context.user_data['bulk_items'] = []
+            
+            await update.message.reply_text(
+                "📦 Ommaviy yuklash rejimi:\n\n"
+                "• Saqlash kanalidan kino fayllarini ketma-ket forward qiling\n"
+                "  (izoh sifatida fayl izohi olinadi, kod avtomatik beriladi), yoki\n"
+                "• code,file_id,caption ustunli CSV/JSON manifest yuboring\n\n"
+                "Tugatgach: ✅ Yakunlash",
+                reply_markup=get_bulk_keyboard()
+            )
+        
         elif text == "📢 Kanallarni Ko'rish":
             channels = db.get_channels()
             
@@ -572,7 +4147,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             
             admin_list = []
             for idx, admin_id in enumerate(admins, 1):
-                admin_type = "👑 EGA" if admin_id == OWNER_ID else "👤 Admin"
+                admin_type = "👑 EGA" if admin_id == db.owner_id else "👤 Admin"
                 admin_list.append((idx, admin_id))
                 text_msg += f"{idx}. {admin_type} - ID: {admin_id}\n"
             
@@ -588,7 +4163,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             
             text_msg = "👑 Adminlar ro'yxati:\n\n"
             for idx, admin_id in enumerate(admins, 1):
-                admin_type = "👑 EGA" if admin_id == OWNER_ID else "👤 Admin"
+                admin_type = "👑 EGA" if admin_id == db.owner_id else "👤 Admin"
                 text_msg += f"{idx}. {admin_type} - ID: {admin_id}\n"
             
             text_msg += f"\n📊 Jami adminlar: {len(admins)} ta"
@@ -622,18 +4197,30 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         elif text == "📊 Statistika":
             movies_count = len(db.get_all_movies())
             channels_count = len(db.get_channels())
-            users_count = len(db.users)
+            users_count = db.count_users()
             admins_count = len(db.get_admins())
             
             total_downloads = sum(movie.get("download_count", 0) for movie in db.movies.values())
             
             text_msg = f"📊 Bot statistikasi:\n\n"
             text_msg += f"🎬 Kinolar soni: {movies_count}\n"
+            broken_count = len(db.get_broken_movies())
+            if broken_count:
+                text_msg += f"🚫 Yaroqsiz fayllar: {broken_count} ({', '.join(sorted(db.get_broken_movies())[:10])})\n"
             text_msg += f"📢 Kanallar soni: {channels_count}\n"
             text_msg += f"👥 Foydalanuvchilar: {users_count}\n"
             text_msg += f"👑 Adminlar soni: {admins_count}\n"
             text_msg += f"📥 Yuklab olishlar: {total_downloads}\n\n"
             
+            activity = db.analytics.summary()
+            retention = activity["retention"]
+            text_msg += f"📈 Faol (kun / hafta / oy): {activity['dau']} / {activity['wau']} / {activity['mau']}\n"
+            text_msg += f"🆕 Yangi (bugun / 7 kun / 30 kun): {activity['new_today']} / {activity['new_7d']} / {activity['new_30d']}\n"
+            text_msg += "🔁 Qaytish (D1 / D7 / D30): " + " / ".join(
+                f"{retention[k]['rate'] * 100:.0f}%" if retention[k]['rate'] is not None else "—"
+                for k in ("d1", "d7", "d30")
+            ) + "\n\n"
+            
             # Eng ko'p yuklangan kinolar
             if movies_count > 0:
                 text_msg += "🏆 Eng ko'p yuklangan kinolar:\n"
@@ -669,6 +4256,46 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
                 reply_markup=get_admin_keyboard(user_id)
             )
         
+        elif text == "👤 Yuklovchilar":
+            uploader_stats = db.get_uploader_stats()
+            
+            if not uploader_stats:
+                await update.message.reply_text(
+                    "🎬 Hozircha hech qanday kino yuklanmagan.",
+                    reply_markup=get_admin_keyboard(user_id)
+                )
+                return
+            
+            context.user_data.clear()
+            context.user_data['uploader_filter_mode'] = True
+            
+            text_msg = "👤 Yuklovchilar (yuklab olishlar bo'yicha):\n\n"
+            for idx, (uploader_id, movie_count, downloads) in enumerate(uploader_stats[:MOVIE_VIEW_LIMIT], 1):
+                uploader = uploader_id if uploader_id is not None else "noma'lum"
+                text_msg += f"{idx}. ID: {uploader}\n"
+                text_msg += f"   🎬 Kinolar: {movie_count}, 📥 yuklab olishlar: {downloads}\n\n"
+            
+            text_msg += "🔹 Kinolarini ko'rish uchun yuklovchi ID sini yuboring\n"
+            text_msg += "🔹 Bekor qilish uchun: 🔙 Bekor qilish"
+            
+            await update.message.reply_text(
+                text_msg,
+                reply_markup=ReplyKeyboardMarkup([[KeyboardButton("🔙 Bekor qilish")]], resize_keyboard=True)
+            )
+        
+        elif text == "📅 Sana Bo'yicha":
+            context.user_data.clear()
+            context.user_data['date_filter_mode'] = True
+            
+            await update.message.reply_text(
+                "📅 Sana bo'yicha kinolar:\n\n"
+                "🔹 Oxirgi N kun: 7\n"
+                "🔹 Sana oralig'i: 2025-01-01 2025-01-31\n"
+                "🔹 Bitta sanadan beri: 2025-01-01\n\n"
+                "Bekor qilish uchun: 🔙 Bekor qilish",
+                reply_markup=ReplyKeyboardMarkup([[KeyboardButton("🔙 Bekor qilish")]], resize_keyboard=True)
+            )
+        
         elif text == "🗑️ Kino O'chirish":
             movies = db.get_all_movies()
             
@@ -741,6 +4368,54 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             
             context.user_data.clear()
         
+        # ========== YUKLOVCHI BO'YICHA KO'RISH ==========
+        elif 'uploader_filter_mode' in context.user_data and context.user_data['uploader_filter_mode']:
+            if text == "🔙 Bekor qilish":
+                context.user_data.clear()
+                await update.message.reply_text(
+                    f"👑 {'EGA Admin' if is_owner(user_id) else 'Admin'} panelga qaytildi!",
+                    reply_markup=get_admin_keyboard(user_id)
+                )
+                return
+            
+            if not text.lstrip('-').isdigit():
+                await update.message.reply_text(
+                    "❌ Faqat yuklovchi ID sini yuboring (raqam).",
+                    reply_markup=ReplyKeyboardMarkup([[KeyboardButton("🔙 Bekor qilish")]], resize_keyboard=True)
+                )
+                return
+            
+            context.user_data.clear()
+            await update.message.reply_text(
+                format_movie_list(f"👤 {text} yuklagan kinolar:", db.get_movies_by_uploader(int(text))),
+                reply_markup=get_admin_keyboard(user_id)
+            )
+        
+        # ========== SANA BO'YICHA KO'RISH ==========
+        elif 'date_filter_mode' in context.user_data and context.user_data['date_filter_mode']:
+            if text == "🔙 Bekor qilish":
+                context.user_data.clear()
+                await update.message.reply_text(
+                    f"👑 {'EGA Admin' if is_owner(user_id) else 'Admin'} panelga qaytildi!",
+                    reply_markup=get_admin_keyboard(user_id)
+                )
+                return
+            
+            date_range = parse_date_range(text)
+            if date_range is None:
+                await update.message.reply_text(
+                    "❌ Noto'g'ri format. Masalan: 7 yoki 2025-01-01 2025-01-31",
+                    reply_markup=ReplyKeyboardMarkup([[KeyboardButton("🔙 Bekor qilish")]], resize_keyboard=True)
+                )
+                return
+            
+            start, end = date_range
+            context.user_data.clear()
+            await update.message.reply_text(
+                format_movie_list(f"📅 {start[:10]} — {end[:10] if end else 'hozirgacha'}:", db.get_movies_in_range(start, end)),
+                reply_markup=get_admin_keyboard(user_id)
+            )
+        
         # ========== KANAL O'CHIRISH REJIMI ==========
         elif 'remove_channel_mode' in context.user_data and context.user_data['remove_channel_mode']:
             channel_input = text.strip()
@@ -832,6 +4507,36 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             
             context.user_data.clear()
         
+        # ========== OMMAVIY YUKLASH REJIMI ==========
+        elif context.user_data.get('bulk_mode'):
+            if text != "✅ Yakunlash":
+                await update.message.reply_text(
+                    f"📦 Navbatda: {len(context.user_data.get('bulk_items', []))} ta kino\n"
+                    f"Fayl yoki manifest yuboring, tugatish uchun: ✅ Yakunlash",
+                    reply_markup=get_bulk_keyboard()
+                )
+                return
+            
+            items = context.user_data.get('bulk_items', [])
+            result = db.add_movies_bulk(items, uploader_id=user_id)
+            added = result['added']
+            
+            text_msg = f"📦 Ommaviy yuklash yakunlandi!\n\n"
+            text_msg += f"📥 Qabul qilingan: {len(items)} ta\n"
+            text_msg += f"✅ Qo'shildi: {len(added)} ta\n"
+            if added:
+                text_msg += f"🔢 Kodlar: {added[0]} ... {added[-1]}\n"
+            text_msg += f"♻️ Takroriy: {len(result['duplicates'])} ta\n"
+            if result['duplicates']:
+                text_msg += f"   {', '.join(result['duplicates'][:10])}\n"
+            text_msg += f"❌ Noto'g'ri: {result['invalid']} ta"
+            
+            await update.message.reply_text(
+                text_msg,
+                reply_markup=get_admin_keyboard(user_id)
+            )
+            context.user_data.clear()
+        
         # ========== KINO YUKLASH REJIMI ==========
         elif 'upload_mode' in context.user_data and context.user_data['upload_mode']:
             # Kod kutilmoqda
@@ -921,7 +4626,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
                     await update.message.reply_text("❌ O'zingizni qo'shib bo'lmaydi!")
                     return
                 
-                if new_admin_id == OWNER_ID:
+                if new_admin_id == db.owner_id:
                     await update.message.reply_text("❌ EGA admin allaqachon mavjud!")
                     return
                 
@@ -966,7 +4671,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
                     idx, admin_id = admin_list[admin_number - 1]
                     
                     # EGA adminni o'chirib bo'lmaydi
-                    if admin_id == OWNER_ID:
+                    if admin_id == db.owner_id:
                         await update.message.reply_text(
                             "❌ EGA adminni o'chirib bo'lmaydi!",
                             reply_markup=get_admin_management_keyboard()
@@ -999,7 +4704,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
                 if text.isdigit():
                     admin_id = int(text)
                     
-                    if admin_id == OWNER_ID:
+                    if admin_id == db.owner_id:
                         await update.message.reply_text("❌ EGA adminni o'chirib bo'lmaydi!")
                         return
                     
@@ -1025,13 +4730,12 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     else:
         # ========== FOYDALANUVCHI ==========
-        # Avval obuna tekshirish
-        subscribed = await force_subscription_check(update, context, user_id)
-        if not subscribed:
-            return
-        
-        # Foydalanuvchi tugmalarini qayta ishlash
+        # Foydalanuvchi tugmalarini qayta ishlash (obuna har bir tarmoqda bir marta tekshiriladi)
         if text == "ℹ️ Yordam":
+            subscribed = await force_subscription_check(update, context, user_id)
+            if not subscribed:
+                return
+            
             await update.message.reply_text(
                 "🎬 Kino Bot - Yordam\n\n"
                 "📥 Kino olish uchun kanalda tashlangan kodlardan yuboring.\n"
@@ -1042,6 +4746,13 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         
         else:
             # Kino kodi yuborildi
+            movie_data = db.get_movie(text)
+            
+            # Yaroqsiz fayl uchun obuna tekshiruvi va yuborishga urinilmaydi
+            if movie_data and "broken" in movie_data:
+                await update.message.reply_text("⚠️ Bu kino vaqtincha mavjud emas. Keyinroq urinib ko'ring.")
+                return
+            
             # Avval obuna tekshirish
             subscribed = await force_subscription_check(update, context, user_id)
             if not subscribed:
@@ -1049,21 +4760,9 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             
             db.set_user_subscription(user_id, True)
             
-            movie_data = db.get_movie(text)
-            
-            if movie_data:
-                success = await send_movie_to_user(update, context, movie_data)
-                
-                if success:
-                    db.increment_download_count(text)
-                    db.increment_user_downloads(user_id)
-
-            else:
-                await update.message.reply_text(
-                    "❌ Kino topilmadi.\n"
-                    "Kodni tekshirib, qaytadan urinib ko'ring."
-                )
+            await deliver_movie(update, context, user_id, text)
 
+@track_handler
 async def handle_file_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Fayl yuborilganda"""
     user_id = update.effective_user.id
@@ -1071,6 +4770,51 @@ async def handle_file_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     if not is_admin(user_id):
         return
     
+    # Ommaviy yuklash rejimi
+    if context.user_data.get('bulk_mode'):
+        items = context.user_data.setdefault('bulk_items', [])
+        
+        if is_manifest_document(update.message):
+            document = update.message.document
+            try:
+                file = await context.bot.get_file(document.file_id)
+                raw = await file.download_as_bytearray()
+                manifest_items = parse_movie_manifest(document.file_name, bytes(raw))
+            except Exception as e:
+                await update.message.reply_text(f"❌ Manifestni o'qishda xatolik: {e}")
+                return
+            
+            items.extend(manifest_items)
+            context.user_data['bulk_items'] = items  # o'zgarishni saqlash uchun
+            await update.message.reply_text(
+                f"✅ Manifest qabul qilindi: {len(manifest_items)} ta qator\n"
+                f"📦 Navbatda: {len(items)} ta kino",
+                reply_markup=get_bulk_keyboard()
+            )
+            return
+        
+        if update.message.video:
+            file_id, file_type = update.message.video.file_id, "video"
+        elif update.message.document:
+            file_id, file_type = update.message.document.file_id, "document"
+        elif update.message.audio:
+            file_id, file_type = update.message.audio.file_id, "audio"
+        else:
+            return
+        
+        items.append({
+            "code": "",
+            "file_id": file_id,
+            "file_type": file_type,
+            "caption": update.message.caption or ""
+        })
+        context.user_data['bulk_items'] = items  # o'zgarishni saqlash uchun
+        
+        # Har bir faylga javob bermaslik uchun (API chaqiruvlarni tejash)
+        if len(items) % BULK_ACK_EVERY == 0:
+            await update.message.reply_text(f"📦 Navbatda: {len(items)} ta kino")
+        return
+    
     # Admin kino yuklash rejimida bo'lsa
     if 'upload_mode' in context.user_data and context.user_data['upload_mode']:
         if 'movie_code' not in context.user_data:
@@ -1104,6 +4848,7 @@ async def handle_file_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             "Agar izoh bermoqchi bo'lmasangiz, faqat '.' yuboring."
         )
 
+@track_handler
 async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Tugmalar bosilganda"""
     query = update.callback_query
@@ -1113,11 +4858,17 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
     data = query.data
     
     if data == "check_subscription":
-        # Obuna tekshirish tugmasi
-        is_subscribed = await check_user_subscription(user_id, context)
+        # Obuna tekshirish tugmasi (foydalanuvchi endi obuna bo'lgan bo'lishi mumkin)
+        is_subscribed = await check_user_subscription(user_id, context, recheck=True)
         
         if is_subscribed:
             db.set_user_subscription(user_id, True)
+            pending_code = context.user_data.pop('pending_code', None)
+            if pending_code:
+                # Deep-link orqali kelgan kino kutib turgan edi
+                await query.edit_message_text("✅ Obuna tekshirildi! Kino yuborilmoqda...")
+                await deliver_movie(update, context, user_id, pending_code, reply_markup=get_user_keyboard())
+                return
             await query.edit_message_text(
                 "✅ Obuna tekshirildi! Botdan foydalanishingiz mumkin.\n\n"
                 "Kino olish uchun kodni yuboring.\n"
@@ -1129,30 +4880,71 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
                 reply_markup=get_subscription_keyboard()
             )
 
-async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Xatolarni qayta ishlash"""
-    logger.error(f"Xatolik yuz berdi: {context.error}")
+@track_handler
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/profile [soniya] [pstats] - jarayonni profiling qilish (faqat EGA admin)"""
+    user_id = update.effective_user.id
+    if not is_owner(user_id):
+        return
     
+    args = context.args or []
+    seconds = int(args[0]) if args and args[0].isdigit() else 10
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    fmt = "pstats" if "pstats" in args else "collapsed"
+    
+    await update.message.reply_text(f"⏱ Profiling boshlandi: {seconds} soniya ({fmt})")
     try:
-        await context.bot.send_message(
-            chat_id=OWNER_ID,
-            text=f"❌ Botda xatolik:\n{context.error}"
-        )
-    except:
-        pass
+        data, filename = await profile_process(seconds, fmt)
+    except RuntimeError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+    
+    await update.message.reply_document(
+        document=InputFile(data, filename=filename),
+        caption=f"📊 Profiling natijasi ({seconds} soniya)"
+    )
 
-# ========================== BOT FUNKSIYASI ==========================
-def run_bot():
-    """Botni ishga tushirish (alohida threadda)"""
-    print("🤖 Bot ishga tushmoqda...")
+@track_handler
+async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Xatolarni qayta ishlash (egaga har bir xato emas, davriy hisobot yuboriladi)"""
+    # Flood-wait xatolari haqida xabar yuborish cheklovni yanada kuchaytiradi
+    if isinstance(context.error, RetryAfter):
+        error_digest.suppressed_total += 1
+        logger.warning(f"Telegram cheklovi: {context.error.retry_after} soniya kutish kerak")
+        return
     
-    # Bot yaratish
-    application = Application.builder().token(BOT_TOKEN).build()
+    logger.error(f"Xatolik yuz berdi: {context.error}")
+    error_digest.record(context.error)
+
+# ========================== BOT FUNKSIYASI ==========================
+def build_application(tenant: Tenant) -> Application:
+    """Bitta bot uchun Application yaratish va handlerlarni ro'yxatdan o'tkazish"""
+    # Bot yaratish (user_data ConversationStore dan olinadi)
+    application = (
+        Application.builder()
+        .token(tenant.token)
+        .context_types(ContextTypes(context=BotContext))
+        .application_class(KinoApplication)
+        .request(TracedRequest(connection_pool_size=256))
+        # Barcha botlar bitta cheklovchidan foydalanadi
+        .rate_limiter(rate_limiter)
+        # Navbatlar yoqilgan bo'lsa PTB har bir yangilanishni darhol qabul qiladi,
+        # qaysi biri avval ishlashini LaneScheduler hal qiladi
+        .concurrent_updates(tenant.lanes.capacity if tenant.lanes else False)
+        .build()
+    )
+    application.tenant = tenant
+    tenant.application = application
     
     # Handlerlarni qo'shish
     application.add_handler(CommandHandler("start", start_command))
+    # Profiling bir necha soniya davom etadi, boshqa yangilanishlarni to'sib qo'ymasligi kerak
+    application.add_handler(CommandHandler("profile", profile_command, block=False))
     application.add_handler(CallbackQueryHandler(callback_query_handler))
     
+    # Kanal a'zoligi o'zgarishlari
+    application.add_handler(ChatMemberHandler(chat_member_update, ChatMemberHandler.CHAT_MEMBER))
+    
     # Fayl yuborish handleri
     application.add_handler(MessageHandler(
         filters.VIDEO | filters.Document.ALL | filters.AUDIO,
@@ -1162,118 +4954,286 @@ def run_bot():
     # Matnli xabarlar handleri
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
     
+    # Umumiy ma'lumotlar rejimi: har bir yangilanishdan oldin keshlarni
+    # yangilash va keyin suhbat holatini boshqa instansiyalar uchun yozish
+    if SHARED_STORE:
+        application.add_handler(TypeHandler(Update, shared_state_pull), group=-1)
+        application.add_handler(TypeHandler(Update, shared_state_push), group=100)
+    
     # Xatolik handleri
     application.add_error_handler(error_handler)
+    return application
+
+async def start_tenant(tenant: Tenant):
+    """Bitta botni ishga tushirish va uning fon vazifalarini yaratish
     
-    print(f"👑 EGA Admin ID: {OWNER_ID}")
-    print(f"👤 Adminlar soni: {len(db.get_admins())}")
-    print(f"🎬 Kinolar soni: {len(db.movies)}")
-    print(f"📢 Kanallar soni: {len(db.channels)}")
-    print(f"👥 Foydalanuvchilar soni: {len(db.users)}")
+    Chaqiruvchi tenant_context() ichida bo'lishi kerak - fon vazifalari
+    joriy kontekstni (botni) nusxalab oladi.
+    """
+    application = build_application(tenant)
     
-    # Polling ni ishga tushirish
-    application.run_polling(
-        drop_pending_updates=True,
-        allowed_updates=Update.ALL_TYPES
-    )
+    logger.info(f"👑 EGA Admin ID: {db.owner_id}")
+    logger.info(f"👤 Adminlar soni: {len(db.get_admins())}")
+    logger.info(f"🎬 Kinolar soni: {len(db.movies)}")
+    logger.info(f"📢 Kanallar soni: {len(db.channels)}")
+    logger.info(f"👥 Foydalanuvchilar soni: {db.count_users()} (arxivda: {db.cold_users.count()})")
+    
+    await application.initialize()
+    await application.start()
+    
+    # Webhook rejimi: yangilanishlar /webhook orqali keladi, polling qilinmaydi
+    if WEBHOOK_URL:
+        await application.bot.set_webhook(
+            url=f"{WEBHOOK_URL.rstrip('/')}{tenant.webhook_path}",
+            secret_token=tenant.webhook_secret or None,
+            allowed_updates=Update.ALL_TYPES
+        )
+        logger.info(f"✅ Webhook o'rnatildi: {WEBHOOK_URL}{tenant.webhook_path}")
+    else:
+        # Webhook ni o'chirish (agar mavjud bo'lsa)
+        try:
+            webhook_info = await application.bot.get_webhook_info()
+            if webhook_info.url:
+                logger.info(f"⚠️ Webhook topildi: {webhook_info.url}")
+                await application.bot.delete_webhook()
+                logger.info("✅ Webhook o'chirildi")
+        except Exception as e:
+            logger.info(f"⚠️ Webhook tekshirishda xato: {e}")
+        
+        # Polling ni ishga tushirish
+        await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+    
+    background_tasks = tenant.background_tasks
+    
+    # Suhbat holatlarini tozalash va saqlash
+    background_tasks.append(asyncio.create_task(conversation_state_loop()))
+    
+    # Faollik statistikasini saqlash (umumiy rejimda bitmaplar OR bilan birlashtiriladi)
+    background_tasks.append(asyncio.create_task(analytics_save_loop()))
+    
+    if tenant.leader is None or tenant.leader.try_acquire():
+        start_singleton_tasks(tenant)
+    else:
+        # Yetakchi to'xtasa uning o'rnini egallash; xatolar yetakchi uchun yig'iladi
+        logger.info("Boshqa jarayon yetakchi: yakka fon vazifalari bu jarayonda ishlamaydi")
+        background_tasks.append(asyncio.create_task(leader_election_loop(tenant)))
+        background_tasks.append(asyncio.create_task(error_spool_loop(db.path(ERROR_SPOOL_FILE))))
+
+def start_singleton_tasks(tenant: Tenant):
+    """Papka bo'yicha bitta jarayonda ishlashi kerak bo'lgan fon vazifalari"""
+    bot = tenant.application.bot
+    background_tasks = tenant.background_tasks
+    
+    # Kino fayllarini fon rejimida tekshirish
+    if FILE_CHECK_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(file_check_loop(bot)))
+    
+    # Faol bo'lmagan foydalanuvchilarni arxivlash
+    if USER_ARCHIVE_AFTER_DAYS > 0:
+        background_tasks.append(asyncio.create_task(user_archive_loop()))
+    
+    # Kanal a'zoligini asta-sekin solishtirish
+    background_tasks.append(asyncio.create_task(membership_bootstrap_loop(bot)))
+    
+    # Xatolar hisobotini egaga yuborish (umumiy rejimda boshqa jarayonlarning xatolari bilan)
+    spool_file = db.path(ERROR_SPOOL_FILE) if tenant.leader is not None else None
+    background_tasks.append(asyncio.create_task(error_digest_loop(bot, spool_file)))
+
+async def leader_election_loop(tenant: Tenant):
+    """Yetakchi qulfini davriy so'rash, olinganda yakka vazifalarni boshlash (fon vazifasi)"""
+    while not tenant.leader.try_acquire():
+        await asyncio.sleep(LEADER_RETRY_INTERVAL)
+    logger.info("Bu jarayon yetakchi bo'ldi: yakka fon vazifalari boshlanmoqda")
+    start_singleton_tasks(tenant)
 
-# ========================== WEB SERVER FUNKSIYASI ==========================
-# ========================== BOT FUNKSIYASI ==========================
 async def run_bot_async():
-    """Botni ishga tushirish (asynchronous)"""
-    print("🤖 Bot ishga tushmoqda...")
+    """Botlarni ishga tushirish (asynchronous)"""
+    logger.info(f"🤖 Botlar ishga tushmoqda: {len(tenants)}")
     
-    # Bot yaratish
-    application = Application.builder().token(BOT_TOKEN).build()
+    global bot_loop
+    bot_loop = asyncio.get_running_loop()
     
-    # Handlerlarni qo'shish
-    application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CallbackQueryHandler(callback_query_handler))
+    # Botlar ketma-ket ishga tushadi, biri ishlamasa qolganlari to'xtatiladi
+    started = []
+    try:
+        for tenant in tenants:
+            with tenant_context(tenant):
+                await start_tenant(tenant)
+            started.append(tenant)
+    except BaseException:
+        for tenant in started:
+            with tenant_context(tenant):
+                await shutdown_bot(tenant.application, tenant.background_tasks)
+        raise
     
-    # Fayl yuborish handleri
-    application.add_handler(MessageHandler(
-        filters.VIDEO | filters.Document.ALL | filters.AUDIO,
-        handle_file_message
-    ))
+    mark_startup("first_poll")
+    logger.info("⏱ Ishga tushish (ms): " + ", ".join(f"{stage}={ms}" for stage, ms in startup_report.items()))
     
-    # Matnli xabarlar handleri
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
+    # Event loop bloklanishlarini kuzatish (barcha botlar uchun bitta loop)
+    watchdog_task = asyncio.create_task(loop_watchdog.run())
+    # Xotira tanqisligida keshlarni qisqartirish va yuklamani kamaytirish
+    governor_task = asyncio.create_task(memory_governor_loop()) if memory_governor.enabled else None
     
-    # Xatolik handleri
-    application.add_error_handler(error_handler)
+    # SIGTERM (fly.io/render qayta deploy) yoki SIGINT kelguncha ishlash
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass  # Windows
+    await stop_event.wait()
     
-    print(f"👑 EGA Admin ID: {OWNER_ID}")
-    print(f"👤 Adminlar soni: {len(db.get_admins())}")
-    print(f"🎬 Kinolar soni: {len(db.movies)}")
-    print(f"📢 Kanallar soni: {len(db.channels)}")
-    print(f"👥 Foydalanuvchilar soni: {len(db.users)}")
+    # Barcha botlar parallel to'xtatiladi - umumiy muddat SHUTDOWN_TIMEOUT dan oshmaydi
+    async def shutdown_tenant(tenant: Tenant):
+        with tenant_context(tenant):
+            await shutdown_bot(tenant.application, tenant.background_tasks)
     
-    # Polling ni ishga tushirish
-    await application.initialize()
-    await application.start()
+    await asyncio.gather(*(shutdown_tenant(tenant) for tenant in tenants))
+    process_tasks = [task for task in (watchdog_task, governor_task) if task is not None]
+    for task in process_tasks:
+        task.cancel()
+    await asyncio.gather(*process_tasks, return_exceptions=True)
+    logger.info("✅ Barcha botlar to'xtatildi")
+
+async def shutdown_bot(application: Application, background_tasks: List[asyncio.Task]):
+    """Botni xavfsiz to'xtatish: yangilanishlarni qabul qilmaslik, ishlayotganlarini
+    tugatish, barcha holatni diskka yozish"""
+    logger.info("🛑 To'xtatish signali olindi, yangilanishlar qabul qilinmaydi")
+    started = time.monotonic()
     
-    # Webhook ni o'chirish (agar mavjud bo'lsa)
+    # 1. Yangi yangilanishlarni olishni to'xtatish
+    if application.updater and application.updater.running:
+        await application.updater.stop()
+    
+    # 2. Navbatdagi va ishlayotgan handlerlarni muddat ichida tugatish
     try:
-        webhook_info = await application.bot.get_webhook_info()
-        if webhook_info.url:
-            print(f"⚠️ Webhook topildi: {webhook_info.url}")
-            await application.bot.delete_webhook()
-            print("✅ Webhook o'chirildi")
-    except Exception as e:
-        print(f"⚠️ Webhook tekshirishda xato: {e}")
+        await asyncio.wait_for(application.stop(), timeout=SHUTDOWN_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"Handlerlar {SHUTDOWN_TIMEOUT} soniyada tugamadi, kutmasdan davom etiladi")
+    
+    # 3. Fon vazifalarini to'xtatish
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    
+    # 4. Yuborilmagan xatolar hisobotini yuborishga urinish (yetakchi bo'lmasa - yetakchiga qoldirish)
+    tenant = current_tenant.get()
+    if not tenant.runs_singletons:
+        try:
+            error_digest.spool(db.path(ERROR_SPOOL_FILE))
+        except Exception as e:
+            logger.warning(f"Xatolarni umumiy faylga yozib bo'lmadi: {e}")
+    entries = error_digest.drain()
+    if entries:
+        try:
+            await asyncio.wait_for(
+                application.bot.send_message(chat_id=db.owner_id, text=ErrorDigest.format(entries)), timeout=5
+            )
+        except Exception as e:
+            logger.warning(f"Xatolar hisobotini yuborib bo'lmadi: {e}")
     
-    # Polling ni ishga tushirish
-    await application.updater.start_polling()
+    # 5. Xotiradagi holatni saqlash
+    flush_tenant(tenant)
+    if tenant.leader is not None:
+        tenant.leader.release()
     
-    # Hech qachon tugamaydi
-    await asyncio.Event().wait()
+    try:
+        await application.shutdown()
+    except Exception as e:
+        logger.warning(f"Application to'xtatishda xato: {e}")
+    logger.info(f"✅ Bot to'xtatildi ({time.monotonic() - started:.1f} soniya)")
+
+def flush_tenant(tenant: Tenant):
+    """Bitta botning xotirada turgan holatini diskka yozish"""
+    savers = [("suhbat holati", tenant.conv_store.save), ("faollik statistikasi", tenant.db.analytics.save)]
+    # Tekshiruv checkpointini faqat uni yuritgan (yetakchi) jarayon yozadi
+    if tenant.runs_singletons:
+        savers.append(("fayllar tekshiruvi", tenant.file_checker.save))
+    for name, save in savers:
+        try:
+            save()
+        except Exception as e:
+            logger.error(f"Saqlashda xato ({tenant.name}, {name}): {e}")
+
+def flush_state():
+    """Barcha botlarning xotirada turgan holatini diskka yozish"""
+    for tenant in tenants:  # Holat hali yuklanmagan bo'lsa ro'yxat bo'sh
+        flush_tenant(tenant)
 
 def run_bot():
     """Botni sinxron tarzda ishga tushirish"""
     asyncio.run(run_bot_async())
 
 # ========================== WEB SERVER FUNKSIYASI ==========================
+# To'xtatish uchun uvicorn.Server obyekti
+web_server: Any = None
+
 def run_web_server():
     """Web server ishga tushirish"""
-    print(f"🌐 Web server {PORT} portda ishga tushmoqda...")
-    uvicorn.run(
-        fastapi_app,
+    global web_server
+    import uvicorn
+    logger.info(f"🌐 Web server {PORT} portda ishga tushmoqda...")
+    web_server = uvicorn.Server(uvicorn.Config(
+        create_web_app(),
         host="0.0.0.0",
         port=PORT,
         log_level="info",
-        access_log=True
-    )
+        access_log=True,
+        # uvicorn o'z handlerlarini o'rnatmaydi, loglar root navbatiga tushadi
+        log_config=None,
+        timeout_graceful_shutdown=5
+    ))
+    # Signallar asosiy threadda (bot) qayta ishlanadi
+    web_server.run()
+
+def stop_web_server(thread: Thread, timeout: float = 10):
+    """uvicorn ni ochiq so'rovlarni tugatgan holda to'xtatish"""
+    if web_server is None:
+        return
+    web_server.should_exit = True
+    thread.join(timeout)
+    if thread.is_alive():
+        logger.warning("Web server o'z vaqtida to'xtamadi")
 
 # ========================== ASOSIY FUNKSIYA ==========================
 def main():
     """Asosiy funksiya - ikkala server birga"""
-    # Fayllarni yaratish (agar mavjud bo'lmasa)
-    for file in [MOVIES_FILE, CHANNELS_FILE, USERS_FILE, ADMINS_FILE]:
-        if not os.path.exists(file):
-            if file == ADMINS_FILE:
-                data = {"admin_ids": [OWNER_ID]}
-                with open(file, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=4)
-            else:
-                with open(file, 'w', encoding='utf-8') as f:
-                    json.dump({}, f, ensure_ascii=False, indent=4)
+    global log_listener
+    log_listener = setup_logging()
+    
+    # Ma'lumot fayllari har bir bot papkasida Database tomonidan yaratiladi
+    if RUN_MODE not in ("all", "worker"):
+        raise RuntimeError(f"RUN_MODE noto'g'ri: {RUN_MODE} (all yoki worker)")
+    if RUN_MODE == "worker" and WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL web serverni talab qiladi (RUN_MODE=all)")
     
-    print(f"🚀 Render.com Web Service da ishga tushmoqda...")
-    print(f"🌐 PORT: {PORT}")
+    logger.info(f"🚀 Ishga tushmoqda (rejim: {RUN_MODE})...")
+    init_state()
     
     # Web serverni alohida threadda ishga tushirish
-    web_thread = Thread(target=run_web_server, daemon=True)
-    web_thread.start()
+    web_thread = None
+    if RUN_MODE == "all":
+        logger.info(f"🌐 PORT: {PORT}")
+        web_thread = Thread(target=run_web_server, daemon=True)
+        web_thread.start()
     
     # Botni asosiy threadda ishga tushirish (bu threadda event loop bor)
-    run_bot()
+    try:
+        run_bot()
+    finally:
+        # Bot to'xtagandan keyin web server (webhook so'rovlari 503 oladi)
+        if web_thread is not None:
+            stop_web_server(web_thread)
+
+mark_startup("import")
 
 # ========================== DASURNI ISHGA TUSHIRISH ==========================
 if __name__ == "__main__":
     try:
         main()
     except KeyboardInterrupt:
-        print("\n👋 Bot to'xtatildi")
+        flush_state()
+        logger.info("👋 Bot to'xtatildi")
     except Exception as e:
         logger.error(f"Asosiy xatolik: {e}")
-        print(f"❌ Xatolik: {e}")
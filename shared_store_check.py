@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SHARED_STORE rejimini bitta mashinada tekshirish
+Bir nechta jarayon bir vaqtda bitta ma'lumotlar papkasini o'zgartiradi,
+so'ng hech qanday yozuv yo'qolmaganligi tekshiriladi.
+
+Ishlatish:
+    python shared_store_check.py [jarayonlar_soni] [har_biri_uchun_amallar]
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def worker(worker_id: int, operations: int):
+    """Bitta jarayon: foydalanuvchi qo'shadi va yuklab olishlarni oshiradi"""
+    sys.path.insert(0, BOT_DIR)
+    import bot
+    bot.init_state()
+
+    for i in range(operations):
+        user_id = worker_id * 1_000_000 + i
+        bot.db.add_user(user_id)
+        bot.db.increment_download_count("1")
+        bot.db.increment_user_downloads(user_id)
+        # Boshqa jarayonlar o'zgarishlarini ko'rish (handlerdagi kabi)
+        bot.db.refresh()
+
+
+def main():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    operations = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    data_dir = tempfile.mkdtemp(prefix="kino-shared-")
+    with open(os.path.join(data_dir, "movies.json"), 'w', encoding='utf-8') as f:
+        json.dump({"1": {"file_id": "x", "file_type": "video", "caption": "",
+                         "uploader_id": None, "upload_date": "2025-01-01 00:00:00",
+                         "download_count": 0}}, f)
+
+    env = dict(os.environ, SHARED_STORE="1", CONV_STATE_FILE="")
+    workers = [
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker", str(n), str(operations)],
+            cwd=data_dir, env=env
+        )
+        for n in range(1, processes + 1)
+    ]
+    failed = sum(1 for p in workers if p.wait() != 0)
+
+    with open(os.path.join(data_dir, "movies.json"), encoding='utf-8') as f:
+        downloads = json.load(f)["1"]["download_count"]
+    with open(os.path.join(data_dir, "users.json"), encoding='utf-8') as f:
+        users = json.load(f)
+
+    expected = processes * operations
+    user_downloads = sum(u["movies_downloaded"] for u in users.values())
+    print(f"Jarayonlar: {processes}, amallar: {operations}, xato bilan tugaganlar: {failed}")
+    print(f"Yuklab olishlar: {downloads}/{expected}")
+    print(f"Foydalanuvchilar: {len(users)}/{expected}, ularning yuklashlari: {user_downloads}/{expected}")
+
+    shutil.rmtree(data_dir, ignore_errors=True)
+    ok = not failed and downloads == expected and len(users) == expected and user_downloads == expected
+    print("✅ OK" if ok else "❌ Yozuvlar yo'qoldi")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        worker(int(sys.argv[2]), int(sys.argv[3]))
+    else:
+        sys.exit(main())
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ishga tushish vaqti hisoboti
+bot modulini `python -X importtime` bilan alohida jarayonda import qilib,
+qaysi paketlar eng ko'p vaqt olishini ko'rsatadi.
+
+Ishlatish:
+    python startup_report.py          # worker rejimi (faqat bot)
+    python startup_report.py --web    # web server (fastapi/uvicorn) bilan
+    python startup_report.py --top 30
+
+Ishlab turgan botning to'liq bosqichlari (import, state, first_poll,
+first_update) esa logda "⏱ Ishga tushish" qatorida va /stats dagi
+"startup" maydonida ko'rinadi.
+"""
+
+import os
+import sys
+import subprocess
+import tempfile
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_importtime(web: bool) -> str:
+    """Yangi jarayonda import qilish va -X importtime natijasini qaytarish"""
+    code = "import bot"
+    if web:
+        code += "; bot.create_web_app(); import uvicorn"
+    env = dict(os.environ, PYTHONPATH=BOT_DIR, LOG_LEVEL="WARNING")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=tempfile.gettempdir(), env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+    return result.stderr
+
+
+def parse(output: str):
+    """(modul, o'z vaqti us, jami vaqti us) ro'yxati"""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # sarlavha qatori
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def main():
+    args = sys.argv[1:]
+    web = "--web" in args
+    top = int(args[args.index("--top") + 1]) if "--top" in args else 15
+
+    rows = parse(run_importtime(web))
+    total = sum(self_us for _, self_us, _ in rows)
+
+    packages = {}
+    for name, self_us, _ in rows:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+
+    print(f"Rejim: {'web' if web else 'worker'}; modullar: {len(rows)}; jami import: {total / 1000:.1f} ms\n")
+    print(f"Eng sekin paketlar (o'z vaqti yig'indisi, top {top}):")
+    for package, self_us in sorted(packages.items(), key=lambda x: x[1], reverse=True)[:top]:
+        print(f"  {self_us / 1000:>8.1f} ms  {self_us / total * 100:>5.1f}%  {package}")
+
+    print(f"\nEng sekin modullar (o'z vaqti, top {top}):")
+    for name, self_us, cumulative_us in sorted(rows, key=lambda x: x[1], reverse=True)[:top]:
+        print(f"  {self_us / 1000:>8.1f} ms  (jami {cumulative_us / 1000:>7.1f} ms)  {name}")
+
+    heavy = [package for package in ("fastapi", "uvicorn", "pydantic", "starlette") if package in packages]
+    print("\nWeb stek import qilingan: " + (", ".join(heavy) if heavy else "yo'q"))
+
+
+if __name__ == "__main__":
+    main()
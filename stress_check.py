@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Database va handlerlarni parallel yangilanishlar ostida tekshirish
+Haqiqiy handlerlar soxta Bot API (tarmoqsiz) va soxta soat bilan ishga
+tushiriladi, minglab aralash yangilanishlar (/start, kino kodi, deep link,
+obuna tekshiruvi, admin qo'shish) navbatga beriladi. Ish davomida va
+oxirida quyidagilar tekshiriladi:
+
+  - kinolarning download_count yig'indisi = yetkazilgan kinolar soni
+  - foydalanuvchilarning movies_downloaded yig'indisi = yetkazilganlar
+  - birorta foydalanuvchi yo'qolmagan (faol + arxiv)
+  - ma'lumot fayllari har doim o'qiladi (boshqa threaddan ham)
+  - EGA va boshqa adminlar hech qachon yo'qolmaydi
+  - diskdan qayta yuklangan holat xotiradagi bilan bir xil
+
+Natija bir xil seed uchun bir xil bo'ladi (oxirgi "holat" xeshi), parallel
+rejimda ham: soxta API tasodifiyligi har bir so'rov uchun seed, endpoint,
+chat va shu chatdagi so'rov tartib raqamidan olinadi (javoblar kelish
+tartibiga bog'liq emas), arxivdan oldindan o'qish (thread) o'chiriladi.
+Har bir parallellik darajasi ikki marta ishga tushiriladi va xeshlar
+solishtiriladi.
+
+Ishlatish:
+    python stress_check.py [yangilanishlar_soni] [foydalanuvchilar_soni]
+    python stress_check.py 3000 300 --seed 7 --concurrency 0,8,32
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import hashlib
+import asyncio
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+OWNER_ID = 1
+ADMIN_IDS = [2, 3]
+CHANNEL_ID = "-1001234567890"
+MOVIES = 40
+FIRST_USER_ID = 100_000
+SEND_FAILURE_RATE = 0.01  # sendVideo uchun tasodifiy tarmoq xatolari
+
+
+class FakeClock:
+    """bot modulidagi time.time/time.monotonic va datetime.now o'rniga
+
+    Vaqt faqat advance() bilan o'zgaradi, shuning uchun flood nazorati,
+    keshlar TTL va arxivlash har safar bir xil ishlaydi.
+    """
+
+    START = datetime(2025, 1, 1, 12, 0, 0)
+
+    def __init__(self):
+        self.now = 0.0
+        clock = self
+
+        class FakeTime:
+            def __getattr__(self, name):
+                return getattr(time, name)  # perf_counter, sleep ... haqiqiy
+
+            def time(self):
+                return 1_735_732_800 + clock.now
+
+            def monotonic(self):
+                return 1_000 + clock.now
+
+        class FakeDatetime(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return clock.START + timedelta(seconds=clock.now)
+
+        self.time = FakeTime()
+        self.datetime = FakeDatetime
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+class StubBotApi:
+    """Bot API javoblari: obuna holati user_id ga bog'liq, yuborilgan kinolar hisoblanadi"""
+
+    def __init__(self, seed: int):
+        self.seed = seed
+        self.calls = 0
+        self.call_numbers = {}  # (endpoint, chat/user) -> so'rovlar soni
+        self.deliveries = {}  # chat_id -> yuborilgan kinolar
+        self.failed_sends = 0
+        self.added_admins = set()
+
+    @staticmethod
+    def is_subscribed(user_id: int) -> bool:
+        return user_id % 5 != 0
+
+    def rng_for(self, endpoint: str, params: dict) -> random.Random:
+        """So'rov uchun alohida rng: bitta foydalanuvchining so'rovlari ketma-ket
+        bo'lgani uchun n-so'rov har safar bir xil qiymatlarni oladi"""
+        key = (endpoint, str(params.get("user_id") or params.get("chat_id") or ""))
+        number = self.call_numbers.get(key, 0)
+        self.call_numbers[key] = number + 1
+        return random.Random(f"{self.seed}:{key[0]}:{key[1]}:{number}")
+
+    async def handle(self, endpoint: str, params: dict):
+        self.calls += 1
+        rng = self.rng_for(endpoint, params)
+        # Javoblar aralashib kelishi uchun har bir so'rov tasodifiy marta navbat beradi
+        for _ in range(rng.randrange(4)):
+            await asyncio.sleep(0)
+
+        chat = {"id": int(params.get("chat_id", 0) or 0), "type": "private"}
+        if endpoint == "getMe":
+            return 200, {"id": 42, "is_bot": True, "first_name": "Kino", "username": "kino_bot"}
+        if endpoint == "getChatMember":
+            user_id = int(params["user_id"])
+            status = "member" if self.is_subscribed(user_id) else "left"
+            return 200, {"status": status, "user": {"id": user_id, "is_bot": False, "first_name": "u"}}
+        if endpoint == "sendVideo":
+            if rng.random() < SEND_FAILURE_RATE:
+                self.failed_sends += 1
+                return 500, None
+            self.deliveries[chat["id"]] = self.deliveries.get(chat["id"], 0) + 1
+            return 200, {"message_id": self.calls, "date": 0, "chat": chat}
+        if endpoint.startswith("send"):
+            text = str(params.get("text", ""))
+            if "Admin muvaffaqiyatli qo'shildi" in text:
+                self.added_admins.add(int(text.split("ID: ")[1].split()[0]))
+            return 200, {"message_id": self.calls, "date": 0, "chat": chat}
+        return 200, True
+
+
+def install_stub(bot, api: StubBotApi):
+    """HTTPXRequest o'rniga tarmoqsiz javoblar"""
+    from telegram.request import HTTPXRequest
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        params = request_data.parameters if request_data else {}
+        status, result = await api.handle(url.rsplit('/', 1)[-1], params)
+        if status != 200:
+            return status, json.dumps({"ok": False, "error_code": status, "description": "Internal Server Error"}).encode()
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    async def noop(self):
+        pass
+
+    HTTPXRequest.do_request = do_request
+    HTTPXRequest.initialize = noop
+    HTTPXRequest.shutdown = noop
+
+
+def make_workload(rng: random.Random, updates: int, users: int, movie_codes: list):
+    """(user_id, turi, matn) ro'yxati; har bir foydalanuvchi /start bilan boshlaydi"""
+    user_ids = [FIRST_USER_ID + n for n in range(users)]
+    started = set()
+    next_admin = 900_000
+    workload = []
+    while len(workload) < updates:
+        roll = rng.random()
+        if roll < 0.01:
+            # EGA admin yangi admin qo'shadi (ikki bosqichli suhbat)
+            workload.append((OWNER_ID, "text", "➕ Yangi Admin Qo'shish"))
+            workload.append((OWNER_ID, "text", str(next_admin)))
+            next_admin += 1
+            continue
+        if roll < 0.03:
+            workload.append((rng.choice(ADMIN_IDS), "text", "📊 Statistika"))
+            continue
+
+        user_id = rng.choice(user_ids)
+        if user_id not in started:
+            started.add(user_id)
+            workload.append((user_id, "command", "/start"))
+            continue
+
+        kind = rng.random()
+        code = rng.choice(movie_codes)
+        if kind < 0.45:
+            workload.append((user_id, "text", code))
+        elif kind < 0.6:
+            workload.append((user_id, "command", f"/start {code}"))
+        elif kind < 0.75:
+            workload.append((user_id, "command", "/start"))
+        elif kind < 0.85:
+            workload.append((user_id, "text", "ℹ️ Yordam"))
+        elif kind < 0.95:
+            workload.append((user_id, "callback", "check_subscription"))
+        else:
+            workload.append((user_id, "text", str(rng.randrange(10_000, 20_000))))  # mavjud bo'lmagan kod
+    return workload[:updates], started
+
+
+def make_update(update_id: int, user_id: int, kind: str, text: str) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": "u"}
+    message = {"message_id": update_id, "date": 0, "chat": {"id": user_id, "type": "private"}, "from": user}
+    if kind == "callback":
+        message["from"] = {"id": 42, "is_bot": True, "first_name": "Kino"}
+        message["text"] = "⚠️"
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": user, "chat_instance": "1", "message": message, "data": text
+        }}
+    message["text"] = text
+    if kind == "command":
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def data_files(bot, db) -> list:
+    return [db.path(name) for name in (bot.MOVIES_FILE, bot.USERS_FILE, bot.CHANNELS_FILE, bot.ADMINS_FILE)]
+
+
+def read_all_files(bot, db) -> list:
+    """Barcha ma'lumot fayllarini o'qish; o'qilmaganlari ro'yxati"""
+    problems = []
+    for path in data_files(bot, db):
+        try:
+            bot.read_data_file(path)
+        except (ValueError, OSError) as e:
+            problems.append(f"{os.path.basename(path)}: {e}")
+    return problems
+
+
+def user_downloads(db) -> int:
+    hot = sum(record.get("movies_downloaded", 0) for record in db.users.values())
+    cold = sum(record.get("movies_downloaded", 0) for _, record in db.cold_users.iter_records(exclude=db.users))
+    return hot + cold
+
+
+def state_digest(db) -> str:
+    """Yakuniy holat xeshi (bir xil seed - bir xil xesh)"""
+    users = {user_id: record for user_id, record in db.users.items()}
+    users.update(dict(db.cold_users.iter_records(exclude=db.users)))
+    state = {
+        "movies": {code: movie["download_count"] for code, movie in db.movies.items()},
+        "users": {user_id: record["movies_downloaded"] for user_id, record in users.items()},
+        "admins": sorted(db.admins)
+    }
+    return hashlib.sha1(json.dumps(state, sort_keys=True).encode()).hexdigest()[:12]
+
+
+async def run_once(bot, concurrency: int, updates: int, users: int, seed: int) -> dict:
+    """Bitta ishga tushirish: yangi papka, yangi bot, bir xil ish yuki"""
+    from telegram import Update
+
+    rng = random.Random(seed)
+    clock = FakeClock()
+    bot.time = clock.time
+    bot.datetime = clock.datetime
+    api = StubBotApi(seed + 1)
+    install_stub(bot, api)
+
+    data_dir = tempfile.mkdtemp(prefix="kino-stress-")
+    tenant = bot.Tenant("stress", "42:stress", OWNER_ID, data_dir)
+    bot.tenants[:] = [tenant]
+    token = bot.current_tenant.set(tenant)
+    db = tenant.db
+
+    async def skip_prefetch(user_id: str):
+        pass
+
+    # Thread tugash vaqti haqiqiy soatga bog'liq: fetch() arxivdan o'zi (sinxron) o'qiydi
+    db.cold_users.prefetch = skip_prefetch
+    for admin_id in ADMIN_IDS:
+        db.add_admin(admin_id)
+    db.add_channel(CHANNEL_ID, "@kino_kanal", "Kino kanal")
+    codes = [str(code) for code in range(1, MOVIES + 1)]
+    for code in codes:
+        db.add_movie(code, f"file-{code}", "video", f"Kino {code}", uploader_id=OWNER_ID)
+
+    # Navbat chegaralari katta: bu yerda tashlab yuborish emas, parallel ishlash tekshiriladi
+    tenant.lanes = bot.LaneScheduler(
+        concurrency, [(name, weight, 1_000_000) for name, weight, _ in bot.parse_lanes(bot.UPDATE_LANES)], 10_000
+    ) if concurrency > 0 else None
+    application = bot.build_application(tenant)
+    await application.initialize()
+    await application.start()
+
+    workload, started_users = make_workload(rng, updates, users, codes)
+    problems = []
+    stop_reader = threading.Event()
+    reader_stats = {"reads": 0, "errors": []}
+
+    loop = asyncio.get_running_loop()
+
+    async def build_stats():
+        return bot.build_stats(tenant)
+
+    def reader():
+        # Web server threadi kabi: fayllar o'qiladi, /stats esa bot loopida quriladi
+        while not stop_reader.is_set():
+            try:
+                errors = read_all_files(bot, db)
+                asyncio.run_coroutine_threadsafe(build_stats(), loop).result(timeout=10)
+            except Exception as e:
+                errors = [f"{type(e).__name__}: {e}"]
+            reader_stats["reads"] += 1
+            reader_stats["errors"].extend(errors)
+            time.sleep(0.001)
+
+    reader_thread = threading.Thread(target=reader, daemon=True)
+    reader_thread.start()
+
+    began = time.perf_counter()
+    for update_id, (user_id, kind, text) in enumerate(workload, start=1):
+        await application.update_queue.put(Update.de_json(make_update(update_id, user_id, kind, text), application.bot))
+        clock.advance(rng.uniform(0, 0.05))
+        if update_id % 100 == 0:
+            await asyncio.sleep(0)
+        if update_id % 500 == 0:
+            # Ish davomida: arxivlash (faol -> arxiv) va fayllar o'qilishi
+            clock.advance(60)
+            db.archive_inactive_users(0)
+            problems.extend(read_all_files(bot, db))
+    await application.update_queue.join()
+    elapsed = time.perf_counter() - began
+
+    stop_reader.set()
+    await asyncio.to_thread(reader_thread.join)  # reader bot loopini kutayotgan bo'lishi mumkin
+    await application.stop()
+    await application.shutdown()
+    bot.flush_tenant(tenant)
+    bot.current_tenant.reset(token)
+
+    # ========== INVARIANTLAR ==========
+    delivered = sum(api.deliveries.values())
+    movie_downloads = sum(movie["download_count"] for movie in db.movies.values())
+    if movie_downloads != delivered:
+        problems.append(f"download_count yig'indisi {movie_downloads} != yetkazilgan {delivered}")
+    if user_downloads(db) != delivered:
+        problems.append(f"movies_downloaded yig'indisi {user_downloads(db)} != yetkazilgan {delivered}")
+    for chat_id, count in api.deliveries.items():
+        record = db.users.get(str(chat_id)) or db.cold_users.fetch(str(chat_id))
+        if record is None or record["movies_downloaded"] != count:
+            problems.append(f"{chat_id}: yetkazilgan {count}, yozilgan {record and record['movies_downloaded']}")
+
+    missing = [user_id for user_id in started_users
+               if str(user_id) not in db.users and str(user_id) not in db.cold_users]
+    if missing:
+        problems.append(f"yo'qolgan foydalanuvchilar: {len(missing)} (masalan {missing[:3]})")
+    if db.count_users() != len(started_users):
+        problems.append(f"foydalanuvchilar soni {db.count_users()} != {len(started_users)}")
+
+    expected_admins = {OWNER_ID, *ADMIN_IDS, *api.added_admins}
+    if not expected_admins <= db.admins:
+        problems.append(f"yo'qolgan adminlar: {sorted(expected_admins - db.admins)}")
+
+    problems.extend(read_all_files(bot, db))
+    problems.extend(f"reader: {error}" for error in reader_stats["errors"][:5])
+    if tenant.error_digest.recorded_total:
+        problems.append(f"handler xatolari: {tenant.error_digest.recorded_total}")
+
+    # Diskdan qayta yuklangan holat xotiradagi bilan bir xil
+    digest = state_digest(db)
+    reloaded = bot.Database(data_dir, OWNER_ID)
+    if state_digest(reloaded) != digest:
+        problems.append("diskdagi holat xotiradagidan farq qiladi")
+
+    lanes = tenant.lanes.stats()["lanes"] if tenant.lanes else {}
+    shutil.rmtree(data_dir, ignore_errors=True)
+    return {
+        "concurrency": concurrency,
+        "updates": len(workload),
+        "elapsed": elapsed,
+        "delivered": delivered,
+        "failed_sends": api.failed_sends,
+        "users": len(started_users),
+        "admins_added": len(api.added_admins),
+        "api_calls": api.calls,
+        "reader_reads": reader_stats["reads"],
+        "lane_wait_p95": {name: lane["wait"]["p95_ms"] for name, lane in lanes.items()},
+        "serial_wait_p95": {name: lane["serial_wait"]["p95_ms"] for name, lane in lanes.items()},
+        "digest": digest,
+        "problems": problems
+    }
+
+
+def main():
+    args = sys.argv[1:]
+    seed = int(args[args.index("--seed") + 1]) if "--seed" in args else 1
+    levels = [int(level) for level in args[args.index("--concurrency") + 1].split(",")] \
+        if "--concurrency" in args else [0, 8, 32]
+    positional = [arg for n, arg in enumerate(args) if not arg.startswith("--") and (n == 0 or not args[n - 1].startswith("--"))]
+    updates = int(positional[0]) if positional else 3000
+    users = int(positional[1]) if len(positional) > 1 else 300
+
+    os.environ.setdefault("LOG_LEVEL", "CRITICAL")  # kutilgan (soxta) xatolar logga chiqmaydi
+    os.environ.setdefault("RATE_LIMIT_PER_BOT", "0")
+    os.environ.setdefault("RATE_LIMIT_PER_CHAT", "0")
+    sys.path.insert(0, BOT_DIR)
+    import bot
+    bot.setup_logging()
+
+    print(f"Yangilanishlar: {updates}, foydalanuvchilar: {users}, seed: {seed}")
+    header = ("parallel", "yangil./s", "soniya", "yetkazildi", "xato", "API", "o'qishlar", "holat")
+    print("{:>8} {:>10} {:>7} {:>10} {:>5} {:>7} {:>9}  {}".format(*header))
+
+    failed = False
+    for concurrency in levels:
+        result = asyncio.run(run_once(bot, concurrency, updates, users, seed))
+        repeat = asyncio.run(run_once(bot, concurrency, updates, users, seed))
+        if (repeat["digest"], repeat["delivered"]) != (result["digest"], result["delivered"]):
+            result["problems"].append(
+                f"takroriy ishga tushirish farq qildi: {repeat['digest']} ({repeat['delivered']} yetkazildi)")
+        print(f"{concurrency:>8} {result['updates'] / result['elapsed']:>10.0f} {result['elapsed']:>7.2f} "
+              f"{result['delivered']:>10} {result['failed_sends']:>5} {result['api_calls']:>7} "
+              f"{result['reader_reads']:>9}  {result['digest']}")
+        if result["lane_wait_p95"]:
+            print("         navbatda kutish p95 (ms): " + ", ".join(
+                f"{name}={wait}" for name, wait in result["lane_wait_p95"].items()))
+            print("         foydalanuvchi qulfi p95 (ms): " + ", ".join(
+                f"{name}={wait}" for name, wait in result["serial_wait_p95"].items()))
+        for problem in result["problems"]:
+            print(f"  ❌ {problem}")
+        failed = failed or bool(result["problems"])
+
+    print("❌ Invariantlar buzildi" if failed else "✅ OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())